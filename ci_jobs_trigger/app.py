@@ -1,31 +1,123 @@
+import math
+import multiprocessing
 import os
 import tempfile
 
 from flask import Flask
+from flask import g
 from flask import request
+from gunicorn.app.base import BaseApplication
 from simple_logger.logger import get_logger
 from flask.logging import default_handler
 
-from ci_jobs_trigger.libs.addons_webhook_trigger.addons_webhook_trigger import (
-    process_hook,
-    ADDONS_WEBHOOK_JOBS_TRIGGER_CONFIG_STR,
-)
-from ci_jobs_trigger.libs.openshift_ci.re_trigger.re_trigger import JobTriggering
-from ci_jobs_trigger.libs.openshift_ci.zstream_trigger.zstream_trigger import (
-    OPENSHIFT_CI_ZSTREAM_TRIGGER_CONFIG_OS_ENV_STR,
-    process_and_trigger_jobs,
-    monitor_and_trigger,
-)
-from ci_jobs_trigger.libs.operators_iib_trigger.iib_trigger import run_iib_update
 from ci_jobs_trigger.utils.general import (
     get_config,
     process_webhook_exception,
     run_in_process,
 )
+from ci_jobs_trigger.utils.loop_supervisor import get_loops_state, supervise_loops
+from ci_jobs_trigger.utils.metrics import (
+    METRICS_CONTENT_TYPE,
+    get_metrics,
+    mark_metrics_process_dead,
+    prepare_metrics_multiprocess_dir,
+    track_route_request_finished,
+    track_route_request_started,
+)
+
+# The subsystems are imported by the routes and loops which use them; their dependencies (ocp_utilities, rosa,
+# boto3, gitlab, jenkins...) are slow to import and would delay the healthcheck and bloat every process
+ZSTREAM_TRIGGER_MODULE = "ci_jobs_trigger.libs.openshift_ci.zstream_trigger.zstream_trigger"
+IIB_TRIGGER_MODULE = "ci_jobs_trigger.libs.operators_iib_trigger.iib_trigger"
+ADDONS_WEBHOOK_TRIGGER_MODULE = "ci_jobs_trigger.libs.addons_webhook_trigger.addons_webhook_trigger"
 
 APP = Flask("ci-jobs-trigger")
 APP.logger.removeHandler(default_handler)
 APP.logger.addHandler(get_logger(APP.logger.name).handlers[0])
+IIB_RUN_NOW_EVENT = multiprocessing.Event()
+ADDONS_HOOK_QUEUED_EVENT = multiprocessing.Event()
+DEFAULT_WORKERS = 2
+CGROUP_V2_CPU_MAX_FILE = "/sys/fs/cgroup/cpu.max"
+CGROUP_V1_CPU_QUOTA_FILE = "/sys/fs/cgroup/cpu/cpu.cfs_quota_us"
+CGROUP_V1_CPU_PERIOD_FILE = "/sys/fs/cgroup/cpu/cpu.cfs_period_us"
+
+
+class CiJobsTriggerServer(BaseApplication):
+    # Pre-fork gunicorn server; the loops supervisor is started once in the master before the workers are forked
+    def __init__(self, application, options):
+        self.application = application
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        return self.application
+
+
+def get_cgroup_cpu_limit():
+    # cpu_count() is the node CPUs in a pod, the container CPU limit is read from its cgroup (v2, then v1)
+    try:
+        with open(CGROUP_V2_CPU_MAX_FILE) as fd:
+            quota, period = fd.read().split()
+
+    except (OSError, ValueError):
+        try:
+            with open(CGROUP_V1_CPU_QUOTA_FILE) as quota_fd, open(CGROUP_V1_CPU_PERIOD_FILE) as period_fd:
+                quota, period = quota_fd.read().strip(), period_fd.read().strip()
+
+        except OSError:
+            return None
+
+    # "max" (v2) and -1 (v1) mean no limit
+    if quota in ("max", "-1"):
+        return None
+
+    return math.ceil(int(quota) / int(period))
+
+
+def get_default_workers():
+    if cpu_limit := get_cgroup_cpu_limit():
+        return cpu_limit * 2 + 1
+
+    return DEFAULT_WORKERS
+
+
+def get_server_options(host, port):
+    return {
+        "bind": f"{host}:{port}",
+        "workers": int(os.environ.get("CI_JOBS_TRIGGER_WORKERS", get_default_workers())),
+        "threads": int(os.environ.get("CI_JOBS_TRIGGER_THREADS", 4)),
+        "worker_class": "gthread",
+        # zstream route triggers the jobs synchronously
+        "timeout": int(os.environ.get("CI_JOBS_TRIGGER_WORKER_TIMEOUT", 300)),
+        "child_exit": lambda server, worker: mark_metrics_process_dead(pid=worker.pid),
+    }
+
+
+def get_request_route():
+    return request.url_rule.rule if request.url_rule else "unmatched"
+
+
+@APP.before_request
+def track_request_started():
+    g.request_start_time = track_route_request_started(route=get_request_route())
+
+
+@APP.after_request
+def track_request_status(response):
+    g.response_status = response.status_code
+    return response
+
+
+@APP.teardown_request
+def track_request_finished(exception=None):
+    if (request_start_time := g.pop("request_start_time", None)) is not None:
+        track_route_request_finished(
+            route=get_request_route(), status=g.pop("response_status", 500), start_time=request_start_time
+        )
 
 
 @APP.route("/healthcheck")
@@ -33,8 +125,23 @@ def healthcheck():
     return "alive"
 
 
+@APP.route("/metrics")
+def metrics():
+    return get_metrics(), 200, {"Content-Type": METRICS_CONTENT_TYPE}
+
+
+@APP.route("/loops")
+def loops_state():
+    return get_loops_state()
+
+
 @APP.route("/openshift-ci-zstream-trigger", methods=["POST"])
 def zstream_trigger():
+    from ci_jobs_trigger.libs.openshift_ci.zstream_trigger.zstream_trigger import (
+        OPENSHIFT_CI_ZSTREAM_TRIGGER_CONFIG_OS_ENV_STR,
+        process_and_trigger_jobs,
+    )
+
     try:
         version = request.query_string.decode()
         APP.logger.info(f"Processing version: {version}")
@@ -52,6 +159,8 @@ def zstream_trigger():
 
 @APP.route("/openshift-ci-re-trigger", methods=["POST"])
 def openshift_ci_job_re_trigger():
+    from ci_jobs_trigger.libs.openshift_ci.re_trigger.re_trigger import JobTriggering
+
     hook_data = request.json
     try:
         job_triggering = JobTriggering(hook_data=hook_data, logger=APP.logger)
@@ -68,15 +177,21 @@ def openshift_ci_job_re_trigger():
 
 @APP.route("/addons-trigger", methods=["POST"])
 def process_addons_trigger():
+    from ci_jobs_trigger.libs.addons_webhook_trigger.addons_webhook_trigger import (
+        ADDONS_WEBHOOK_JOBS_TRIGGER_CONFIG_STR,
+        enqueue_hook,
+    )
+
     try:
         hook_data = request.json
         repository_name = hook_data["repository"]["name"]
         APP.logger.info(f"{repository_name}: Event type: {hook_data['event_type']}")
-        failed_triggered_jobs = process_hook(data=hook_data, logger=APP.logger)
-        if failed_triggered_jobs:
-            APP.logger.error(f"{repository_name}: Failed triggered jobs: {failed_triggered_jobs}")
+        # Jobs are triggered by the hooks queue workers, reply before GitLab's webhook timeout
+        if enqueue_hook(data=hook_data, logger=APP.logger):
+            ADDONS_HOOK_QUEUED_EVENT.set()
+            return "Queued"
 
-        return "Processed done"
+        return "Skipped"
     except Exception as ex:
         return process_webhook_exception(
             logger=APP.logger,
@@ -88,16 +203,48 @@ def process_addons_trigger():
         )
 
 
+@APP.route("/operators-iib-trigger", methods=["POST"])
+def operators_iib_trigger_run_now():
+    APP.logger.info("Operators IIB trigger run requested")
+    IIB_RUN_NOW_EVENT.set()
+    return "Run requested"
+
+
 if __name__ == "__main__":
+    prepare_metrics_multiprocess_dir()
+    # The loops run under a single supervisor process, which restarts them when they exit
     run_in_process(
         targets={
-            monitor_and_trigger: {"logger": APP.logger},
-            run_iib_update: {"logger": APP.logger, "tmp_dir": tempfile.mkdtemp(dir="/tmp", prefix="ci-jobs-trigger")},
+            supervise_loops: {
+                "targets": {
+                    f"{ZSTREAM_TRIGGER_MODULE}:monitor_and_trigger": {"logger": APP.logger},
+                    f"{IIB_TRIGGER_MODULE}:run_iib_update": {
+                        "logger": APP.logger,
+                        "tmp_dir": tempfile.mkdtemp(dir="/tmp", prefix="ci-jobs-trigger"),
+                        "run_now_event": IIB_RUN_NOW_EVENT,
+                    },
+                    f"{ADDONS_WEBHOOK_TRIGGER_MODULE}:run_addons_hooks_workers": {
+                        "logger": APP.logger,
+                        "hook_queued_event": ADDONS_HOOK_QUEUED_EVENT,
+                    },
+                },
+                "logger": APP.logger,
+            }
         }
     )
-    APP.logger.info(f"Starting {APP.name} app")
-    APP.run(
-        port=int(os.environ.get("CI_JOBS_TRIGGER_LISTEN_PORT", 5000)),
-        host=os.environ.get("CI_JOBS_TRIGGER_LISTEN_IP", "127.0.0.1"),
-        use_reloader=True if os.environ.get("CI_JOBS_TRIGGER_USE_RELOAD") else False,
-    )
+    listen_port = int(os.environ.get("CI_JOBS_TRIGGER_LISTEN_PORT", 5000))
+    listen_ip = os.environ.get("CI_JOBS_TRIGGER_LISTEN_IP", "127.0.0.1")
+    if os.environ.get("CI_JOBS_TRIGGER_DEV_SERVER"):
+        APP.logger.info(f"Starting {APP.name} app with flask development server")
+        APP.run(
+            port=listen_port,
+            host=listen_ip,
+            use_reloader=True if os.environ.get("CI_JOBS_TRIGGER_USE_RELOAD") else False,
+        )
+
+    else:
+        server_options = get_server_options(host=listen_ip, port=listen_port)
+        APP.logger.info(
+            f"Starting {APP.name} app with {server_options['workers']} workers and {server_options['threads']} threads"
+        )
+        CiJobsTriggerServer(application=APP, options=server_options).run()
@@ -1,15 +1,146 @@
+import os
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-from ci_jobs_trigger.libs.utils.general import trigger_ci_job
-from ci_jobs_trigger.utils.general import get_config, get_gitlab_api, AddonsWebhookTriggerError
+from pyhelper_utils.general import tts
+
+from ci_jobs_trigger.libs.addons_webhook_trigger.hooks_queue import (
+    HOOK_STATUS_DONE,
+    HOOK_STATUS_FAILED,
+    AddonsHooksQueue,
+)
+from ci_jobs_trigger.libs.utils.general import drain_trigger_outbox, trigger_ci_job
+from ci_jobs_trigger.utils.circuit_breaker import CircuitOpenError, is_dependency_failure
+from ci_jobs_trigger.utils.general import (
+    AddonsWebhookTriggerError,
+    get_backoff_seconds,
+    get_config,
+    process_webhook_exception,
+    run_gitlab_api_call,
+)
+from ci_jobs_trigger.utils.loop_supervisor import record_loop_cycle
+from ci_jobs_trigger.utils.rate_limiter import TRIGGER_PRIORITY_NORMAL
+from ci_jobs_trigger.utils.trigger_outbox import TRIGGER_STATUS_DONE, claim_trigger, record_triggers
 
 ADDONS_WEBHOOK_JOBS_TRIGGER_CONFIG_STR = "ADDONS_WEBHOOK_JOBS_TRIGGER_CONFIG"
+ADDON_IMAGE_SET_FILE_REGEX = re.compile(r"addons/(?P<product>.*)/addonimagesets/(?P<env>production|stage)/.*.yaml")
+SUPPORTED_CIS = ("openshift-ci", "jenkins")
+OCM_ENVS = ("production", "stage")
+REPOSITORY_REQUIRED_KEYS = ("gitlab_url", "gitlab_token", "products_jobs_mapping")
+HOOKS_QUEUE_DEFAULT_WORKERS = 4
+HOOKS_QUEUE_DEFAULT_RETENTION = "168h"
+HOOKS_QUEUE_POLL_SECONDS = 5
+HOOKS_QUEUE_MAX_ATTEMPTS = 5
+HOOKS_QUEUE_RETRY_SECONDS = 30
+HOOKS_QUEUE_MAX_RETRY_SECONDS = 1800
+TRIGGER_OUTBOX_SOURCE = "addons"
+TRIGGER_OUTBOX_DRAIN_SECONDS = 60
+# GitLab maximum page size, fewer requests for merge requests touching many files
+MERGE_REQUEST_DIFFS_PER_PAGE = 100
+
+# Config file path -> loaded config and compiled jobs index, rebuilt when the file modification time changes
+ADDONS_JOBS_INDEX_CACHE = {}
+ADDONS_JOBS_INDEX_CACHE_LOCK = threading.Lock()
 
 
 class RepositoryNotFoundError(Exception):
     pass
 
 
+class AddonsWebhookConfigError(Exception):
+    pass
+
+
+class InvalidHookDataError(Exception):
+    pass
+
+
+# Retrying the hook cannot fix these
+HOOK_PERMANENT_ERRORS = (RepositoryNotFoundError, AddonsWebhookConfigError, InvalidHookDataError)
+
+
+def compile_repository_jobs_index(repository_name, repository_data):
+    repository_jobs_index = {}
+    if not isinstance(repository_data, dict):
+        raise AddonsWebhookConfigError(f"{repository_name}: repository config is not a mapping")
+
+    if missing_keys := [key for key in REPOSITORY_REQUIRED_KEYS if not repository_data.get(key)]:
+        raise AddonsWebhookConfigError(f"{repository_name}: missing mandatory keys: {missing_keys}")
+
+    for _ci, ci_addons in repository_data["products_jobs_mapping"].items():
+        if _ci not in SUPPORTED_CIS:
+            raise AddonsWebhookConfigError(
+                f"{repository_name}: unsupported ci {_ci}, supported cis: {list(SUPPORTED_CIS)}"
+            )
+
+        for _addon, addon_envs in (ci_addons or {}).items():
+            if not isinstance(addon_envs, dict):
+                raise AddonsWebhookConfigError(f"{repository_name}: {_ci}: {_addon} must map ocm envs to jobs")
+
+            for _ocm_env, _jobs in addon_envs.items():
+                if _ocm_env not in OCM_ENVS:
+                    raise AddonsWebhookConfigError(
+                        f"{repository_name}: {_ci}: {_addon}: unsupported ocm env {_ocm_env}, "
+                        f"supported envs: {list(OCM_ENVS)}"
+                    )
+
+                if not isinstance(_jobs, list) or not all(isinstance(_job, str) for _job in _jobs):
+                    raise AddonsWebhookConfigError(
+                        f"{repository_name}: {_ci}: {_addon}: {_ocm_env} jobs must be a list of job names"
+                    )
+
+                repository_jobs_index[(repository_name, _addon, _ocm_env, _ci)] = tuple(dict.fromkeys(_jobs))
+
+    return repository_jobs_index
+
+
+def compile_addons_jobs_index(config_data, logger):
+    # (repository, addon, ocm env, ci) -> jobs
+    addons_jobs_index = {}
+    repositories = config_data.get("repositories")
+    if not isinstance(repositories, dict) or not repositories:
+        raise AddonsWebhookConfigError("`repositories` is missing or not a mapping")
+
+    # A repository with an invalid config is removed, the hooks of the other repositories are still processed
+    for repository_name, repository_data in list(repositories.items()):
+        try:
+            addons_jobs_index.update(
+                compile_repository_jobs_index(repository_name=repository_name, repository_data=repository_data)
+            )
+        except AddonsWebhookConfigError as ex:
+            logger.error(f"Skipping repository with invalid config: {ex}")
+            repositories.pop(repository_name)
+
+    return addons_jobs_index
+
+
+def get_addons_webhook_config(logger):
+    config_path = os.environ.get(ADDONS_WEBHOOK_JOBS_TRIGGER_CONFIG_STR)
+    try:
+        config_mtime = os.stat(config_path).st_mtime_ns
+    except (TypeError, OSError):
+        config_mtime = None
+
+    with ADDONS_JOBS_INDEX_CACHE_LOCK:
+        cached_config = ADDONS_JOBS_INDEX_CACHE.get(config_path)
+        if cached_config and config_mtime is not None and cached_config["mtime"] == config_mtime:
+            return cached_config["config_data"], cached_config["addons_jobs_index"]
+
+    config_data = get_config(os_environ=ADDONS_WEBHOOK_JOBS_TRIGGER_CONFIG_STR, logger=logger)
+    addons_jobs_index = compile_addons_jobs_index(config_data=config_data, logger=logger)
+    if config_mtime is not None:
+        with ADDONS_JOBS_INDEX_CACHE_LOCK:
+            ADDONS_JOBS_INDEX_CACHE[config_path] = {
+                "mtime": config_mtime,
+                "config_data": config_data,
+                "addons_jobs_index": addons_jobs_index,
+            }
+
+    return config_data, addons_jobs_index
+
+
 def repo_data_from_config(repository_name, config_data):
     data = config_data["repositories"].get(repository_name)
     if not data:
@@ -19,97 +150,265 @@ def repo_data_from_config(repository_name, config_data):
 
 
 def get_merge_request(repository_data, object_attributes, project, logger):
-    api = get_gitlab_api(url=repository_data["gitlab_url"], token=repository_data["gitlab_token"])
-    project = api.projects.get(project)
-    merge_request = project.mergerequests.get(object_attributes["iid"])
+    def _get_merge_request(_api):
+        _project = _api.projects.get(project)
+        return _project, _project.mergerequests.get(object_attributes["iid"])
+
+    project, merge_request = run_gitlab_api_call(
+        url=repository_data["gitlab_url"], token=repository_data["gitlab_token"], func=_get_merge_request
+    )
     logger.info(f"{project.name}: New merge request [{merge_request.iid}] {merge_request.title}")
     return merge_request
 
 
-def process_hook(data, logger):
-    def _trigger_jobs(
-        _addon,
-        _ocm_env,
-        _repository_data,
-        _config_data,
-        _logger,
-        _project,
-    ):
-        openshift_ci = "openshift-ci"
-        jenkins_ci = "jenkins"
-        _openshift_ci_jobs = []
-        _jenkins_ci_jobs = []
-        openshift_ci_jobs_from_config = _repository_data["products_jobs_mapping"].get(openshift_ci, {})
-        jenkins_ci_jobs_from_config = _repository_data["products_jobs_mapping"].get(jenkins_ci, {})
-
-        for key, val in openshift_ci_jobs_from_config.items():
-            if key == _addon and [*val][0] == _ocm_env:
-                _openshift_ci_jobs.extend(val[_ocm_env])
-
-        for key, val in jenkins_ci_jobs_from_config.items():
-            if key == _addon and [*val][0] == _ocm_env:
-                _jenkins_ci_jobs.extend(val[_ocm_env])
-
-        if not _openshift_ci_jobs and not _jenkins_ci_jobs:
-            logger.info(f"{_project}: No job found for product: {_addon}")
-            return False
-
-        failed_triggered_jobs = {}
-        for _job in _openshift_ci_jobs:
-            try:
-                trigger_ci_job(
-                    job=_job,
-                    product=_addon,
-                    _type="addon",
-                    ci=openshift_ci,
-                    config_data=_config_data,
-                    logger=_logger,
-                )
-            except AddonsWebhookTriggerError:
-                failed_triggered_jobs.setdefault(openshift_ci, []).append(_job)
+def get_merge_request_changed_files(merge_request):
+    # Unlike changes(), the paginated diffs listing is not truncated for large merge requests; python-gitlab has
+    # no method for it. GitLab cannot leave the diff bodies out, pages are read one at a time and only their paths
+    # are kept. The old path of a renamed or deleted file is a changed file too
+    diffs_path = f"{merge_request.manager.path}/{merge_request.encoded_id}/diffs"
+    return {
+        path
+        for diff in merge_request.manager.gitlab.http_list(
+            diffs_path, iterator=True, per_page=MERGE_REQUEST_DIFFS_PER_PAGE
+        )
+        for path in (diff["new_path"], diff["old_path"])
+    }
+
+
+def get_changed_addons(changed_files):
+    changed_addons = set()
+    for changed_file in changed_files:
+        # TODO: Get product version from changed_file and send it to slack
+        if matches := ADDON_IMAGE_SET_FILE_REGEX.match(changed_file):
+            changed_addons.add((matches.group("product"), matches.group("env")))
+
+    return changed_addons
+
+
+def get_addons_jobs(changed_addons, repository_name, addons_jobs_index):
+    # ci -> job -> addons which triggered the job, a job mapped to several changed addons is triggered once
+    addons_jobs = {}
+    for _ci in SUPPORTED_CIS:
+        for _addon, _ocm_env in sorted(changed_addons):
+            for _job in addons_jobs_index.get((repository_name, _addon, _ocm_env, _ci), ()):
+                addons_jobs.setdefault(_ci, {}).setdefault(_job, []).append(_addon)
+
+    return addons_jobs
+
+
+def trigger_addons_jobs(addons_jobs, config_data, logger, outbox_batch):
+    failed_triggered_jobs = {}
+    for _ci, _jobs in addons_jobs.items():
+        # A hook processed again (retried or re-queued on restart) only triggers the jobs it did not trigger yet
+        outbox_entries = record_triggers(
+            source=TRIGGER_OUTBOX_SOURCE,
+            batch=outbox_batch,
+            ci=_ci,
+            priority=TRIGGER_PRIORITY_NORMAL,
+            jobs={_job: {"product": ", ".join(_addons), "_type": "addon"} for _job, _addons in _jobs.items()},
+        )
+        for _job, _addons in _jobs.items():
+            if outbox_entries[_job]["status"] == TRIGGER_STATUS_DONE:
+                logger.info(f"{_ci}: {_job} already triggered for {outbox_batch}, skipping")
+                continue
+
+            if not claim_trigger(entry_id=outbox_entries[_job]["id"]):
+                logger.info(f"{_ci}: {_job} is already deferred or being triggered for {outbox_batch}, skipping")
                 continue
 
-        for _job in _jenkins_ci_jobs:
             try:
                 trigger_ci_job(
                     job=_job,
-                    product=_addon,
+                    product=", ".join(_addons),
                     _type="addon",
-                    ci=jenkins_ci,
-                    config_data=_config_data,
-                    logger=_logger,
+                    ci=_ci,
+                    config_data=config_data,
+                    logger=logger,
+                    outbox_entry_id=outbox_entries[_job]["id"],
                 )
             except AddonsWebhookTriggerError:
-                failed_triggered_jobs.setdefault(jenkins_ci, []).append(_job)
+                failed_triggered_jobs.setdefault(_ci, []).append(_job)
                 continue
 
-        return failed_triggered_jobs
+    return failed_triggered_jobs
+
 
+def process_hook(data, logger):
     object_attributes = data["object_attributes"]
-    if object_attributes.get("action") == "merge":
-        config_data = get_config(os_environ=ADDONS_WEBHOOK_JOBS_TRIGGER_CONFIG_STR, logger=logger)
-        repository_name = data["repository"]["name"]
-        repository_data = repo_data_from_config(repository_name=repository_name, config_data=config_data)
+    if object_attributes.get("action") != "merge":
+        return {}
+
+    config_data, addons_jobs_index = get_addons_webhook_config(logger=logger)
+    repository_name = data["repository"]["name"]
+    repository_data = repo_data_from_config(repository_name=repository_name, config_data=config_data)
+    project = data["project"]["id"]
+    merge_request = get_merge_request(
+        repository_data=repository_data, object_attributes=object_attributes, project=project, logger=logger
+    )
+
+    changed_addons = get_changed_addons(changed_files=get_merge_request_changed_files(merge_request=merge_request))
+    if not changed_addons:
+        logger.info(f"{project}: No addon changes found in merge request")
+        return {}
+
+    addons_jobs = get_addons_jobs(
+        changed_addons=changed_addons, repository_name=repository_name, addons_jobs_index=addons_jobs_index
+    )
+    if not addons_jobs:
+        logger.info(f"{project}: No job found for products: {sorted(changed_addons)}")
+        return {}
+
+    return trigger_addons_jobs(
+        addons_jobs=addons_jobs,
+        config_data=config_data,
+        logger=logger,
+        outbox_batch=":".join(str(_key) for _key in get_hook_queue_key(data=data)),
+    )
+
+
+def get_hook_queue_key(data):
+    try:
+        object_attributes = data["object_attributes"]
         project = data["project"]["id"]
-        merge_request = get_merge_request(
-            repository_data=repository_data, object_attributes=object_attributes, project=project, logger=logger
+        iid = int(object_attributes["iid"])
+        data["repository"]["name"]
+    except (KeyError, TypeError, ValueError) as ex:
+        raise InvalidHookDataError(f"Invalid merge request hook payload: {ex!r}")
+
+    merge_commit_sha = object_attributes.get("merge_commit_sha") or object_attributes.get("last_commit", {}).get("id")
+    if not merge_commit_sha:
+        raise InvalidHookDataError(f"{project}: Merge request {iid} hook payload has no merge commit")
+
+    return project, iid, merge_commit_sha
+
+
+def enqueue_hook(data, logger):
+    if data.get("object_attributes", {}).get("action") != "merge":
+        return False
+
+    project, iid, merge_commit_sha = get_hook_queue_key(data=data)
+    config_data, _ = get_addons_webhook_config(logger=logger)
+    repo_data_from_config(repository_name=data["repository"]["name"], config_data=config_data)
+
+    with AddonsHooksQueue(queue_db_path=config_data.get("hooks_queue_db_path")) as hooks_queue:
+        if hooks_queue.enqueue(project=project, iid=iid, merge_commit_sha=merge_commit_sha, payload=data):
+            logger.info(f"{project}: Merge request {iid} ({merge_commit_sha}) queued")
+            return True
+
+    logger.info(f"{project}: Merge request {iid} ({merge_commit_sha}) already queued, skipping re-delivered hook")
+    return False
+
+
+def is_retryable_hook_error(ex):
+    # Config errors and client errors (e.g. merge request not found) are not fixed by processing the hook again
+    return not isinstance(ex, HOOK_PERMANENT_ERRORS) and is_dependency_failure(ex=ex)
+
+
+def process_next_queued_hook(hooks_queue, logger):
+    if not (queued_hook := hooks_queue.claim()):
+        return False
+
+    hook_id, data, attempts = queued_hook
+    repository_name = data["repository"]["name"]
+    try:
+        if failed_triggered_jobs := process_hook(data=data, logger=logger):
+            logger.error(f"{repository_name}: Failed triggered jobs: {failed_triggered_jobs}")
+
+        hooks_queue.set_status(hook_id=hook_id, status=HOOK_STATUS_DONE)
+
+    except CircuitOpenError as ex:
+        # Waiting for a dependency known to be down does not use one of the hook attempts
+        logger.warning(f"{repository_name}: Hook {hook_id} postponed, {ex}")
+        hooks_queue.retry(
+            hook_id=hook_id, error=str(ex), retry_after_seconds=ex.retry_after_seconds, count_attempt=False
         )
 
-        for change in merge_request.changes().get("changes", []):
-            changed_file = change.get("new_path")
-            # TODO: Get product version from changed_file and send it to slack
-            matches = re.match(
-                r"addons/(?P<product>.*)/addonimagesets/(?P<env>production|stage)/.*.yaml",
-                changed_file,
+    except Exception as ex:
+        if attempts < HOOKS_QUEUE_MAX_ATTEMPTS and is_retryable_hook_error(ex=ex):
+            retry_after_seconds = get_backoff_seconds(
+                failures=attempts, base_seconds=HOOKS_QUEUE_RETRY_SECONDS, max_seconds=HOOKS_QUEUE_MAX_RETRY_SECONDS
             )
-            if matches:
-                return _trigger_jobs(
-                    _addon=matches.group("product"),
-                    _ocm_env=matches.group("env"),
-                    _repository_data=repository_data,
-                    _config_data=config_data,
-                    _logger=logger,
-                    _project=project,
-                )
+            logger.warning(
+                f"{repository_name}: Failed to process hook {hook_id} (attempt {attempts}/{HOOKS_QUEUE_MAX_ATTEMPTS}), "
+                f"retrying in {retry_after_seconds} seconds. error: {ex}"
+            )
+            hooks_queue.retry(hook_id=hook_id, error=str(ex), retry_after_seconds=retry_after_seconds)
+            return True
+
+        hooks_queue.set_status(hook_id=hook_id, status=HOOK_STATUS_FAILED, error=str(ex))
+        process_webhook_exception(
+            logger=logger,
+            ex=ex,
+            route="addons-trigger",
+            slack_errors_webhook_url=get_config(os_environ=ADDONS_WEBHOOK_JOBS_TRIGGER_CONFIG_STR, logger=logger).get(
+                "slack_errors_webhook_url"
+            ),
+        )
 
     return True
+
+
+def drain_hooks_queue(queue_db_path, logger, hook_queued_event=None):
+    with AddonsHooksQueue(queue_db_path=queue_db_path) as hooks_queue:
+        while True:
+            cycle_start_time = time.monotonic()
+            hook_processed, failed = False, False
+            try:
+                hook_processed = process_next_queued_hook(hooks_queue=hooks_queue, logger=logger)
+
+            except Exception as ex:
+                failed = True
+                logger.error(f"Failed to read addons hooks queue: {ex}")
+
+            # Also recorded while the queue is empty, the heartbeat shows the workers are polling
+            record_loop_cycle(
+                loop_name="run_addons_hooks_workers",
+                cycle_seconds=time.monotonic() - cycle_start_time,
+                logger=logger,
+                failed=failed,
+            )
+            if hook_processed:
+                continue
+
+            if hook_queued_event:
+                if hook_queued_event.wait(timeout=HOOKS_QUEUE_POLL_SECONDS):
+                    hook_queued_event.clear()
+
+            else:
+                time.sleep(HOOKS_QUEUE_POLL_SECONDS)
+
+
+def run_addons_hooks_workers(logger, hook_queued_event=None):
+    config_data = get_config(os_environ=ADDONS_WEBHOOK_JOBS_TRIGGER_CONFIG_STR, logger=logger)
+    queue_db_path = config_data.get("hooks_queue_db_path")
+    workers = int(config_data.get("hooks_queue_workers", HOOKS_QUEUE_DEFAULT_WORKERS))
+
+    with AddonsHooksQueue(queue_db_path=queue_db_path) as hooks_queue:
+        if reset_hooks := hooks_queue.reset_processing_hooks():
+            logger.info(f"Re-queued {reset_hooks} addons hooks which were being processed on shutdown")
+
+        # Before the workers start, so a re-queued hook finds these triggers done
+        drain_trigger_outbox(source=TRIGGER_OUTBOX_SOURCE, config_data=config_data, logger=logger, loop_start=True)
+
+        hooks_queue.prune(
+            retention_seconds=tts(ts=config_data.get("hooks_queue_retention", HOOKS_QUEUE_DEFAULT_RETENTION))
+        )
+
+    logger.info(f"Starting {workers} addons hooks queue workers")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for _ in range(workers):
+            executor.submit(
+                drain_hooks_queue, queue_db_path=queue_db_path, logger=logger, hook_queued_event=hook_queued_event
+            )
+
+        # The workers never return; meanwhile the triggers of hooks which did not send them are sent
+        drain_trigger_outbox_forever(config_data=config_data, logger=logger)
+
+
+def drain_trigger_outbox_forever(config_data, logger):
+    while True:
+        time.sleep(TRIGGER_OUTBOX_DRAIN_SECONDS)
+        try:
+            drain_trigger_outbox(source=TRIGGER_OUTBOX_SOURCE, config_data=config_data, logger=logger)
+        except Exception as ex:
+            logger.error(f"Failed to send pending addons triggers: {ex}")
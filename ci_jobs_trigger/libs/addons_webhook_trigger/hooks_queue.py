@@ -0,0 +1,78 @@
+import json
+import time
+from pathlib import Path
+
+from ci_jobs_trigger.utils.sqlite_table import SQLiteTable
+
+HOOK_STATUS_PENDING = "pending"
+HOOK_STATUS_PROCESSING = "processing"
+HOOK_STATUS_DONE = "done"
+HOOK_STATUS_FAILED = "failed"
+
+
+class AddonsHooksQueue(SQLiteTable):
+    table_name = "hooks"
+    table_columns = (
+        "id INTEGER PRIMARY KEY AUTOINCREMENT",
+        "project TEXT NOT NULL",
+        "iid INTEGER NOT NULL",
+        "merge_commit_sha TEXT NOT NULL",
+        "payload TEXT NOT NULL",
+        "status TEXT NOT NULL",
+        "attempts INTEGER NOT NULL DEFAULT 0",
+        "error TEXT",
+        "available_at REAL NOT NULL DEFAULT 0",
+        "created_at REAL NOT NULL",
+        "updated_at REAL NOT NULL",
+        "UNIQUE(project, iid, merge_commit_sha)",
+    )
+    final_statuses = (HOOK_STATUS_DONE, HOOK_STATUS_FAILED)
+
+    def __init__(self, queue_db_path=None):
+        super().__init__(db_path=queue_db_path or Path("/tmp", "addons_webhook_trigger_queue.db"))
+
+    def enqueue(self, project, iid, merge_commit_sha, payload):
+        # GitLab re-delivers hooks on timeouts, the unique key makes a re-delivery a no-op
+        now = time.time()
+        cursor = self.connection.execute(
+            f"INSERT OR IGNORE INTO {self.table_name} "
+            "(project, iid, merge_commit_sha, payload, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (str(project), iid, merge_commit_sha, json.dumps(payload), HOOK_STATUS_PENDING, now, now),
+        )
+        return cursor.rowcount == 1
+
+    def claim(self):
+        # A pending hook is claimed by a single worker
+        with self.write_transaction() as connection:
+            row = connection.execute(
+                f"SELECT id, payload, attempts FROM {self.table_name} "
+                "WHERE status = ? AND available_at <= ? ORDER BY id LIMIT 1",
+                (HOOK_STATUS_PENDING, time.time()),
+            ).fetchone()
+            if row:
+                connection.execute(
+                    f"UPDATE {self.table_name} SET status = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                    (HOOK_STATUS_PROCESSING, time.time(), row[0]),
+                )
+
+        # attempts includes this claim
+        return (row[0], json.loads(row[1]), row[2] + 1) if row else None
+
+    def set_status(self, hook_id, status, error=None):
+        self.update_status(row_id=hook_id, status=status, error=error)
+
+    def retry(self, hook_id, error, retry_after_seconds, count_attempt=True):
+        # The hook is pending again but is not claimed before retry_after_seconds
+        now = time.time()
+        self.connection.execute(
+            f"UPDATE {self.table_name} SET status = ?, error = ?, attempts = attempts - ?, available_at = ?, "
+            "updated_at = ? WHERE id = ?",
+            (HOOK_STATUS_PENDING, error, 0 if count_attempt else 1, now + retry_after_seconds, now, hook_id),
+        )
+
+    def reset_processing_hooks(self):
+        # Hooks claimed by workers which did not finish (i.e. the service was restarted) are processed again
+        return self.connection.execute(
+            f"UPDATE {self.table_name} SET status = ?, updated_at = ? WHERE status = ?",
+            (HOOK_STATUS_PENDING, time.time(), HOOK_STATUS_PROCESSING),
+        ).rowcount
@@ -1,61 +1,164 @@
-import os
+import json
+import threading
+import time
+from urllib.parse import quote, urljoin
 
 import jenkins
-from timeout_sampler import TimeoutExpiredError, TimeoutSampler
+import requests
+import urllib3
+from pyhelper_utils.general import tts
 
+from ci_jobs_trigger.utils.http_client import get_dependency_http_config, mount_http_adapter
+from ci_jobs_trigger.utils.metrics import track_dependency_call
 
-def jenkins_trigger_job(job, config_data, logger, operator_iib=False):
-    os.environ["PYTHONHTTPSVERIFY"] = "0"
+JENKINS_JOB_PARAMETERS_TREE = "property[parameterDefinitions[defaultParameterValue[name,value]]]"
+JENKINS_JOB_PARAMETERS_CACHE_TTL_SECONDS = 10 * 60
+JENKINS_DEFAULT_JOB_START_TIMEOUT = "5m"
+JENKINS_QUEUE_POLL_MAX_SLEEP_SECONDS = 10
+
+# Parameter definitions rarely change, keep them to skip the job info request on the next triggers
+JENKINS_JOB_PARAMETERS_CACHE = {}
+JENKINS_JOB_PARAMETERS_CACHE_LOCK = threading.Lock()
+
+# Clients are shared between triggers (and threads) to reuse HTTP connections and the Jenkins crumb
+JENKINS_CLIENTS = {}
+JENKINS_CLIENTS_LOCK = threading.Lock()
+
+
+def get_jenkins_api(url, username, password):
+    with JENKINS_CLIENTS_LOCK:
+        cached_client = JENKINS_CLIENTS.get((url, username))
+        if cached_client and cached_client["password"] == password:
+            return cached_client["api"]
+
+        http_config = get_dependency_http_config(dependency="jenkins")
+        api = jenkins.Jenkins(url=url, username=username, password=password, timeout=http_config["read_timeout"])
+        # Configure TLS on the client session instead of setting PYTHONHTTPSVERIFY in the process environment;
+        # python-jenkins does not expose its session, the dependency is kept to the versions tested with _session
+        api._session.verify = http_config["verify"]
+        mount_http_adapter(session=api._session, dependency="jenkins")
+        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+        JENKINS_CLIENTS[(url, username)] = {"api": api, "password": password}
+        return api
+
+
+def get_jenkins_job_url(api, job):
+    # A job in a folder ("folder/job") is served under job/folder/job/job/
+    return urljoin(api.server, "".join(f"job/{quote(name)}/" for name in job.split("/")))
+
+
+def get_jenkins_job_info(api, job):
+    # get_job_info fetches the whole job (builds included), only the parameter definitions are requested here
+    try:
+        with track_dependency_call(dependency="jenkins", operation="job_info"):
+            response = api.jenkins_open(
+                requests.Request(
+                    "GET", f"{get_jenkins_job_url(api=api, job=job)}api/json?tree={JENKINS_JOB_PARAMETERS_TREE}"
+                )
+            )
+    except jenkins.NotFoundException:
+        return None
+
+    return json.loads(response) if response else None
+
+
+def get_cached_job_parameter_definitions(api, job):
+    with JENKINS_JOB_PARAMETERS_CACHE_LOCK:
+        cached_parameters = JENKINS_JOB_PARAMETERS_CACHE.get((api.server, job))
+
+    if cached_parameters and cached_parameters["expiration_time"] > time.monotonic():
+        return cached_parameters["parameter_definitions"]
 
-    api = jenkins.Jenkins(
+    return None
+
+
+def cache_job_parameter_definitions(api, job, job_info):
+    parameter_definitions = [
+        param for _property in job_info.get("property", []) for param in _property.get("parameterDefinitions", [])
+    ]
+    with JENKINS_JOB_PARAMETERS_CACHE_LOCK:
+        JENKINS_JOB_PARAMETERS_CACHE[(api.server, job)] = {
+            "parameter_definitions": parameter_definitions,
+            "expiration_time": time.monotonic() + JENKINS_JOB_PARAMETERS_CACHE_TTL_SECONDS,
+        }
+
+    return parameter_definitions
+
+
+def jenkins_trigger_job(job, config_data, logger, operator_iib=False):
+    api = get_jenkins_api(
         url=config_data["jenkins_url"],
         username=config_data["jenkins_username"],
         password=config_data["jenkins_token"],
     )
 
-    if not api.job_exists(name=job):
-        logger.error(f"Jenkins job {job} not found.")
-        return False, None
+    # A projected job info request is used for the job existence and parameters, and only when not cached
+    parameter_definitions = get_cached_job_parameter_definitions(api=api, job=job)
+    if parameter_definitions is None:
+        if not (job_info := get_jenkins_job_info(api=api, job=job)):
+            logger.error(f"Jenkins job {job} not found.")
+            return False, None
+
+        parameter_definitions = cache_job_parameter_definitions(api=api, job=job, job_info=job_info)
 
     try:
-        last_build_number = api.get_job_info(job)["lastBuild"]["number"]
-    except TypeError:
-        last_build_number = 0
+        with track_dependency_call(dependency="jenkins", operation="build_job"):
+            queue_item_number = api.build_job(
+                name=job,
+                parameters=set_job_params(parameter_definitions=parameter_definitions, operator_iib=operator_iib),
+            )
+    except jenkins.NotFoundException:
+        with JENKINS_JOB_PARAMETERS_CACHE_LOCK:
+            JENKINS_JOB_PARAMETERS_CACHE.pop((api.server, job), None)
 
-    api.build_job(name=job, parameters=set_job_params(api=api, job=job, operator_iib=operator_iib))
+        logger.error(f"Jenkins job {job} not found.")
+        return False, None
 
-    return wait_for_job_started_in_jenkins(api=api, job=job, last_build_number=last_build_number, logger=logger)
+    return wait_for_job_started_in_jenkins(
+        api=api,
+        job=job,
+        queue_item_number=queue_item_number,
+        logger=logger,
+        timeout=tts(ts=config_data.get("jenkins_job_start_timeout", JENKINS_DEFAULT_JOB_START_TIMEOUT)),
+    )
 
 
-def set_job_params(api, job, operator_iib):
+def set_job_params(parameter_definitions, operator_iib):
     job_params = {}
     install_from_iib_job_param_str = "INSTALL_FROM_IIB"
 
-    for _property in api.get_job_info(name=job)["property"]:
-        for param in _property.get("parameterDefinitions", []):
-            param_dict = param["defaultParameterValue"]
-            param_name = param_dict["name"]
+    for param in parameter_definitions:
+        param_dict = param["defaultParameterValue"]
+        param_name = param_dict["name"]
 
-            if operator_iib and param_name == install_from_iib_job_param_str:
-                job_params[install_from_iib_job_param_str] = True
-                continue
+        if operator_iib and param_name == install_from_iib_job_param_str:
+            job_params[install_from_iib_job_param_str] = True
+            continue
 
-            job_params[param_name] = param_dict["value"]
+        job_params[param_name] = param_dict["value"]
 
     return job_params
 
 
-def wait_for_job_started_in_jenkins(api, job, last_build_number, logger):
-    for job_info in TimeoutSampler(
-        wait_timeout=3,
-        sleep=1,
-        func=api.get_job_info,
-        name=job,
-    ):
-        try:
-            if (job_info_last_build := job_info["lastBuild"]) and job_info_last_build["number"] > last_build_number:
-                return True, job_info_last_build
+def wait_for_job_started_in_jenkins(api, job, queue_item_number, logger, timeout):
+    # Follow the queue item created by our build request until Jenkins assigns it a build
+    sleep_seconds = 1
+    deadline = time.monotonic() + timeout
+    while True:
+        with track_dependency_call(dependency="jenkins", operation="queue_item"):
+            queue_item = api.get_queue_item(number=queue_item_number)
+        if executable := queue_item.get("executable"):
+            return True, executable
+
+        if queue_item.get("cancelled"):
+            logger.error(f"Jenkins job {job} queue item {queue_item_number} was cancelled.")
+            return False, None
 
-        except TimeoutExpiredError:
-            logger.error(f"Jenkins job {job} new build not triggered.")
+        remaining_seconds = deadline - time.monotonic()
+        if remaining_seconds <= 0:
+            logger.error(f"Jenkins job {job} new build not started after {timeout} seconds: {queue_item.get('why')}")
             return False, None
+
+        time.sleep(min(sleep_seconds, remaining_seconds))
+        sleep_seconds = min(sleep_seconds * 2, JENKINS_QUEUE_POLL_MAX_SLEEP_SECONDS)
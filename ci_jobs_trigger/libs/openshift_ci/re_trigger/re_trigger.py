@@ -1,5 +1,6 @@
 import json
 import xml
+from functools import partial
 
 import requests
 import shortuuid
@@ -9,8 +10,14 @@ from timeout_sampler import TimeoutSampler
 
 from ci_jobs_trigger.libs.openshift_ci.re_trigger.job_db import DB
 from ci_jobs_trigger.libs.openshift_ci.utils.constants import GANGWAY_API_URL, PROW_LOGS_URL_PREFIX
+from ci_jobs_trigger.utils.circuit_breaker import CircuitOpenError, guarded_dependency_call
 from ci_jobs_trigger.utils.general import OpenshiftCiReTriggerError, send_slack_message
+from ci_jobs_trigger.utils.http_client import get_http_session
+from ci_jobs_trigger.utils.metrics import track_dependency_call
+from ci_jobs_trigger.utils.rate_limiter import TRIGGER_PRIORITY_HIGH
+from ci_jobs_trigger.utils.tracing import span
 from ci_jobs_trigger.libs.openshift_ci.utils.general import (
+    defer_openshift_ci_trigger_job,
     get_authorization_header,
     openshift_ci_trigger_job,
 )
@@ -54,7 +61,11 @@ class JobTriggering:
             raise ValueError(f"{self.log_prefix} Missing parameters")
 
     def execute_trigger(self, job_db_path=None):
-        with DB(job_db_path=job_db_path) as database:
+        with span(name="re_trigger", log_prefix=self.log_prefix, job_name=self.job_name, build_id=self.build_id):
+            return self._execute_trigger(job_db_path=job_db_path)
+
+    def _execute_trigger(self, job_db_path=None):
+        with span(name="db_check"), DB(job_db_path=job_db_path) as database:
             if database.check_prow_job_id_in_db(job_name=self.job_name, prow_job_id=self.prow_job_id):
                 self.logger.warning(f"{self.log_prefix} Job was already auto-triggered. Exiting.")
                 send_slack_message(
@@ -64,7 +75,10 @@ class JobTriggering:
                 )
                 return False
 
-        if not self.wait_for_job_completed():
+        with span(name="wait_for_job_completed"):
+            job_completed = self.wait_for_job_completed()
+
+        if not job_completed:
             err_msg = "Timeout waiting for job to complete, not re-triggering"
             send_slack_message(
                 message=f"{self.slack_msg_prefix}{err_msg}",
@@ -74,30 +88,47 @@ class JobTriggering:
 
             raise OpenshiftCiReTriggerError(log_prefix=self.log_prefix, msg=err_msg)
 
-        tests_dict = self.get_testsuites_testcase_from_junit_operator(
-            junit_xml=self.get_tests_from_junit_operator_by_build_id()
-        )
-        if self.is_build_failed_on_setup(tests_dict=tests_dict):
-            prow_job_id = self._trigger_job()
+        junit_xml = self.get_tests_from_junit_operator_by_build_id()
+        with span(name="check_pre_phase"):
+            tests_dict = self.get_testsuites_testcase_from_junit_operator(junit_xml=junit_xml)
+            build_failed_on_setup = self.is_build_failed_on_setup(tests_dict=tests_dict)
+
+        if build_failed_on_setup:
+            with span(name="trigger"):
+                prow_job_id = self._trigger_job(job_db_path=job_db_path)
+
+            if not prow_job_id:
+                send_slack_message(
+                    message=f"{self.slack_msg_prefix}Job failed during `pre phase`, re-trigger deferred, "
+                    "gangway is unavailable",
+                    webhook_url=self.slack_webhook_url,
+                    logger=self.logger,
+                )
+                return True
+
             send_slack_message(
                 message=f"{self.slack_msg_prefix}Job failed during `pre phase`, re-triggering job",
                 webhook_url=self.slack_webhook_url,
                 logger=self.logger,
             )
-
-            with DB(job_db_path=job_db_path) as database:
-                database.write(job_name=self.job_name, prow_job_id=prow_job_id)
-                self.logger.info(f"{self.log_prefix} Save job data to DB")
+            self.save_triggered_job(prow_job_id=prow_job_id, job_db_path=job_db_path)
 
         return True
 
+    def save_triggered_job(self, prow_job_id, job_db_path=None):
+        with span(name="db_write"), DB(job_db_path=job_db_path) as database:
+            database.write(job_name=self.job_name, prow_job_id=prow_job_id)
+            self.logger.info(f"{self.log_prefix} Save job data to DB")
+
     def get_prow_job_status(self):
         self.logger.info(f"{self.log_prefix}  Get job status.")
         try:
-            response = self.get_url_content(
-                url=f"{self.trigger_url}/{self.prow_job_id}",
-                headers=get_authorization_header(trigger_token=self.trigger_token),
-            )
+            with guarded_dependency_call(dependency="gangway", operation="job_status"):
+                response = self.get_url_content(
+                    dependency="gangway",
+                    url=f"{self.trigger_url}/{self.prow_job_id}",
+                    headers=get_authorization_header(trigger_token=self.trigger_token),
+                )
 
             return yaml.safe_load(response).get("job_status")
 
@@ -120,9 +151,24 @@ class JobTriggering:
                 self.logger.info(f"{self.log_prefix} Job ended. Status: {job_status}")
                 return True
 
-    def _trigger_job(self):
+    def _trigger_job(self, job_db_path=None):
         self.logger.info(f"{self.log_prefix} Trigger job.")
-        response = openshift_ci_trigger_job(job_name=self.job_name, trigger_token=self.trigger_token)
+        try:
+            # Re-triggers go before the bulk zstream and IIB triggers
+            response = openshift_ci_trigger_job(
+                job_name=self.job_name, trigger_token=self.trigger_token, priority=TRIGGER_PRIORITY_HIGH
+            )
+        except CircuitOpenError as ex:
+            # Gangway is down, the job is re-triggered once it recovers instead of dropping the request
+            defer_openshift_ci_trigger_job(
+                job_name=self.job_name,
+                trigger_token=self.trigger_token,
+                priority=TRIGGER_PRIORITY_HIGH,
+                retry_after_seconds=ex.retry_after_seconds,
+                logger=self.logger,
+                on_triggered=partial(self.save_triggered_job, job_db_path=job_db_path),
+            )
+            return None
 
         if not response.ok:
             err_msg = f"Failed to get job status: {response.headers.get('grpc-message')}"
@@ -147,10 +193,12 @@ class JobTriggering:
             "https://gcsweb-ci.apps.ci.l2s4.p1.openshiftapps.com/gcs/test-platform-results/logs/"
             f"{self.job_name}/{self.build_id}/artifacts/junit_operator.xml"
         )
-        response = self.get_url_content(url=url)
+        with span(name="junit_download"), track_dependency_call(dependency="gcsweb", operation="junit_operator"):
+            response = self.get_url_content(dependency="gcsweb", url=url)
 
         try:
-            return xmltodict.parse(response)
+            with span(name="junit_parse"):
+                return xmltodict.parse(response)
         except xml.parsers.expat.ExpatError as _:
             self.logger.error(f"{self.log_prefix} Failed to read {url}. Response: {response}")
             raise
@@ -168,17 +216,17 @@ class JobTriggering:
         self.logger.info(f"{self.log_prefix} Job did not fail during `pre phase` and will not be re-triggered.")
         return False
 
-    def get_url_content(self, **kwargs):
+    def get_url_content(self, dependency, **kwargs):
         url = kwargs["url"]
         self.logger.info(f"{self.log_prefix} Get content from {url}")
-        response = requests.get(**kwargs)
+        response = get_http_session(dependency=dependency).get(**kwargs)
 
         response_text = response.text
         if response.ok:
             return response_text
 
         raise requests.exceptions.RequestException(
-            f"Failed to retrieve url {url} on {response_text}. Status {response.status_code}"
+            f"Failed to retrieve url {url} on {response_text}. Status {response.status_code}", response=response
         )
 
     def generate_slack_msg_prefix(self):
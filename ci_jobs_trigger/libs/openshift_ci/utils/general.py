@@ -1,15 +1,175 @@
-import requests
+import itertools
+import queue
+import threading
+import time
 
 from ci_jobs_trigger.libs.openshift_ci.utils.constants import GANGWAY_API_URL
+from ci_jobs_trigger.utils.circuit_breaker import (
+    CircuitOpenError,
+    check_dependency_available,
+    get_circuit_breaker,
+    guarded_dependency_call,
+)
+from ci_jobs_trigger.utils.http_client import get_http_session
+from ci_jobs_trigger.utils.process_local import ProcessLocal
+from ci_jobs_trigger.utils.rate_limiter import TRIGGER_PRIORITY_NORMAL, get_gangway_rate_limiter
+from ci_jobs_trigger.utils.trigger_outbox import (
+    TRIGGER_OUTBOX_CLAIM_SECONDS,
+    TRIGGER_STATUS_DONE,
+    TRIGGER_STATUS_FAILED,
+    TRIGGER_STATUS_PENDING,
+    extend_trigger_claim,
+    get_trigger_status,
+    set_trigger_status,
+)
 
 
-def openshift_ci_trigger_job(job_name, trigger_token):
-    return requests.post(
-        url=f"{GANGWAY_API_URL}/{job_name}",
-        headers=get_authorization_header(trigger_token=trigger_token),
-        json={"job_execution_type": "1"},
-    )
+def openshift_ci_trigger_job(job_name, trigger_token, priority=TRIGGER_PRIORITY_NORMAL):
+    # A trigger the open circuit rejects does not use a rate limit token
+    check_dependency_available(dependency="gangway", operation="trigger")
+
+    # Waits for a token of the shared gangway rate limiter; bulk triggers leave room for the higher priorities
+    if rate_limiter := get_gangway_rate_limiter():
+        rate_limiter.acquire(priority=priority)
+
+    # Raises CircuitOpenError without calling gangway while it is unavailable
+    with guarded_dependency_call(dependency="gangway", operation="trigger") as dependency_call:
+        response = get_http_session(dependency="gangway").post(
+            url=f"{GANGWAY_API_URL}/{job_name}",
+            headers=get_authorization_header(trigger_token=trigger_token),
+            json={"job_execution_type": "1"},
+        )
+        dependency_call.failed = not response.ok
+        dependency_call.unavailable = response.status_code >= 500 or response.status_code == 429
+
+    return response
 
 
 def get_authorization_header(trigger_token):
     return {"Authorization": f"Bearer {trigger_token}"}
+
+
+class DeferredTriggers:
+    # Triggers rejected while gangway is unavailable are kept and sent once its circuit lets calls through again;
+    # their trigger outbox entries stay claimed meanwhile, so another cycle does not send them too.
+    # They are lost on restart, their entries are sent again once the claim expires
+    def __init__(self):
+        self.triggers = queue.PriorityQueue()
+        # Orders triggers with the same retry time without comparing their other fields
+        self.sequence = itertools.count()
+        # Keys of the triggers waiting in the queue or being sent
+        self.queued_keys = set()
+        self.lock = threading.Lock()
+        self.sender = threading.Thread(target=self.run, name="deferred-triggers", daemon=True)
+        self.sender.start()
+
+    @staticmethod
+    def get_key(trigger):
+        # Triggers without an outbox entry (i.e. re-triggers) are kept once per job
+        return ("outbox", trigger["outbox_entry_id"]) if trigger["outbox_entry_id"] else ("job", trigger["job_name"])
+
+    def add(
+        self, job_name, trigger_token, priority, retry_after_seconds, logger, outbox_entry_id=None, on_triggered=None
+    ):
+        # on_triggered is called with the prow job id once the deferred trigger succeeded
+        trigger = {
+            "job_name": job_name,
+            "trigger_token": trigger_token,
+            "priority": priority,
+            "logger": logger,
+            "outbox_entry_id": outbox_entry_id,
+            "on_triggered": on_triggered,
+        }
+        with self.lock:
+            if (trigger_key := self.get_key(trigger=trigger)) in self.queued_keys:
+                logger.info(f"Trigger of {job_name} is already deferred, skipping")
+                return False
+
+            self.queued_keys.add(trigger_key)
+
+        self.put(trigger=trigger, retry_after_seconds=retry_after_seconds)
+        return True
+
+    def put(self, trigger, retry_after_seconds):
+        extend_trigger_claim(
+            entry_id=trigger["outbox_entry_id"], seconds=retry_after_seconds + TRIGGER_OUTBOX_CLAIM_SECONDS
+        )
+        self.triggers.put((time.monotonic() + retry_after_seconds, next(self.sequence), trigger))
+
+    def run(self):
+        while True:
+            retry_at, _, trigger = self.triggers.get()
+            requeued = False
+            try:
+                time.sleep(max(retry_at - time.monotonic(), 0))
+                requeued = self.trigger(trigger=trigger)
+            except Exception as ex:
+                # Never let a failure stop the sender thread
+                trigger["logger"].error(f"Failed to send deferred trigger of {trigger['job_name']}. error: {ex}")
+            finally:
+                if not requeued:
+                    with self.lock:
+                        self.queued_keys.discard(self.get_key(trigger=trigger))
+
+                self.triggers.task_done()
+
+    def trigger(self, trigger):
+        # Returns True when the trigger was deferred again
+        job_name, logger, outbox_entry_id = trigger["job_name"], trigger["logger"], trigger["outbox_entry_id"]
+        # Sent meanwhile by another sender, i.e. after this process' claim expired
+        if outbox_entry_id and get_trigger_status(entry_id=outbox_entry_id) != TRIGGER_STATUS_PENDING:
+            logger.info(f"Deferred trigger of {job_name} was already sent, skipping")
+            return False
+
+        try:
+            response = openshift_ci_trigger_job(
+                job_name=job_name, trigger_token=trigger["trigger_token"], priority=trigger["priority"]
+            )
+        except CircuitOpenError as ex:
+            self.put(trigger=trigger, retry_after_seconds=ex.retry_after_seconds)
+            return True
+
+        except Exception as ex:
+            logger.warning(f"Deferred trigger of {job_name} failed, retrying later. error: {ex}")
+            self.put(
+                trigger=trigger, retry_after_seconds=get_circuit_breaker(dependency="gangway").reset_timeout_seconds
+            )
+            return True
+
+        if response.ok:
+            prow_job_id = response.json()["id"]
+            set_trigger_status(entry_id=outbox_entry_id, status=TRIGGER_STATUS_DONE)
+            logger.info(f"Deferred trigger of {job_name} succeeded: {prow_job_id}")
+            if trigger["on_triggered"]:
+                trigger["on_triggered"](prow_job_id)
+        else:
+            error = response.headers.get("grpc-message")
+            set_trigger_status(entry_id=outbox_entry_id, status=TRIGGER_STATUS_FAILED, error=error)
+            logger.error(f"Deferred trigger of {job_name} failed: {error}")
+
+        return False
+
+
+# A forked process does not inherit the sender thread, it starts its own
+DEFERRED_TRIGGERS = ProcessLocal(factory=DeferredTriggers)
+
+
+def defer_openshift_ci_trigger_job(
+    job_name,
+    trigger_token,
+    retry_after_seconds,
+    logger,
+    priority=TRIGGER_PRIORITY_NORMAL,
+    outbox_entry_id=None,
+    on_triggered=None,
+):
+    logger.warning(f"Gangway is unavailable, deferring trigger of {job_name} by {int(retry_after_seconds)} seconds")
+    return DEFERRED_TRIGGERS.get().add(
+        job_name=job_name,
+        trigger_token=trigger_token,
+        priority=priority,
+        retry_after_seconds=retry_after_seconds,
+        logger=logger,
+        outbox_entry_id=outbox_entry_id,
+        on_triggered=on_triggered,
+    )
@@ -3,9 +3,10 @@ import json
 import logging
 import time
 import datetime
+import gitlab
 import yaml
+from gitlab.v4.objects import ProjectFile
 
-from croniter import CroniterBadCronError, croniter
 from pyhelper_utils.general import stt, tts
 from typing import Dict, List
 
@@ -15,13 +16,34 @@ from rosa.rosa_versions import get_rosa_versions
 from semver import Version
 import packaging.version
 
+from ci_jobs_trigger.utils.circuit_breaker import CircuitOpenError, guarded_dependency_call
 from ci_jobs_trigger.utils.constant import DAYS_TO_SECONDS
-from ci_jobs_trigger.utils.general import get_config, get_gitlab_api, send_slack_message
-from ci_jobs_trigger.libs.openshift_ci.utils.general import openshift_ci_trigger_job
+from ci_jobs_trigger.utils.general import (
+    SlackDigest,
+    get_config,
+    get_cron_iter,
+    run_gitlab_api_call,
+    send_slack_message,
+)
+from ci_jobs_trigger.utils.loop_supervisor import record_loop_cycle
+from ci_jobs_trigger.utils.rate_limiter import TRIGGER_PRIORITY_BULK
+from ci_jobs_trigger.utils.metrics import track_cycle, track_dependency_call
+from ci_jobs_trigger.utils.tracing import span
+from ci_jobs_trigger.utils.trigger_outbox import (
+    TRIGGER_STATUS_DONE,
+    TRIGGER_STATUS_FAILED,
+    claim_trigger,
+    record_triggers,
+    release_trigger_claim,
+    set_trigger_status,
+)
+from ci_jobs_trigger.libs.openshift_ci.utils.general import defer_openshift_ci_trigger_job, openshift_ci_trigger_job
+from ci_jobs_trigger.libs.utils.general import drain_trigger_outbox
 
 
 OPENSHIFT_CI_ZSTREAM_TRIGGER_CONFIG_OS_ENV_STR: str = "OPENSHIFT_CI_ZSTREAM_TRIGGER_CONFIG"
 LOG_PREFIX: str = "Zstream trigger:"
+TRIGGER_OUTBOX_SOURCE: str = "zstream"
 
 
 def processed_versions_file(processed_versions_file_path: str, logger: logging.Logger) -> Dict:
@@ -59,14 +81,18 @@ def already_processed_version(
 
 
 def get_gitlab_project_file(config: Dict, ocm_env: str) -> Dict:
-    api = get_gitlab_api(url=config["gitlab_url"], token=config["gitlab_token"])
-    project = api.projects.get(config["gitlab_project"])
-    project_file_content = project.files.get(
-        file_path=f"config/{'prod' if ocm_env == 'production' else ocm_env}.yaml", ref="master"
+    def _get_project_file(_api: gitlab.Gitlab) -> ProjectFile:
+        return _api.projects.get(config["gitlab_project"]).files.get(
+            file_path=f"config/{'prod' if ocm_env == 'production' else ocm_env}.yaml", ref="master"
+        )
+
+    project_file_content = run_gitlab_api_call(
+        url=config["gitlab_url"], token=config["gitlab_token"], func=_get_project_file
     )
     return yaml.safe_load(project_file_content.decode().decode("utf-8"))
 
 
+@span(name="rosa_version_enabled")
 def is_rosa_version_enabled(config: Dict, version: str, channel: str, ocm_env: str, logger: logging.Logger) -> bool:
     processed_versions_file_path = config["processed_versions_file_path"]
     processed_versions_file_content = processed_versions_file(
@@ -96,16 +122,24 @@ def filter_rosa_versions_by_channel(all_rosa_versions: Dict, rosa_channel: str,
     return filtered_rosa_dict
 
 
+@span(name="accepted_ocp_versions")
+def get_accepted_ocp_versions() -> Dict[str, Dict[str, List[str]]]:
+    with track_dependency_call(dependency="ocp-release", operation="accepted_versions"):
+        return get_accepted_cluster_versions()
+
+
+@span(name="rosa_versions")
 def get_all_rosa_versions(
     ocm_token: str, ocm_env: str, rosa_channel: str, version_channel: str, aws_region: str
 ) -> Dict[str, Dict[str, List[str]]]:
-    ocm_client = OCMPythonClient(
-        token=ocm_token,
-        endpoint="https://sso.redhat.com/auth/realms/redhat-external/protocol/openid-connect/token",
-        api_host=ocm_env,
-        discard_unknown_keys=True,
-    ).client
-    _all_rosa_versions = get_rosa_versions(ocm_client=ocm_client, aws_region=aws_region, channel_group=rosa_channel)
+    with guarded_dependency_call(dependency="ocm", operation="rosa_versions"):
+        ocm_client = OCMPythonClient(
+            token=ocm_token,
+            endpoint="https://sso.redhat.com/auth/realms/redhat-external/protocol/openid-connect/token",
+            api_host=ocm_env,
+            discard_unknown_keys=True,
+        ).client
+        _all_rosa_versions = get_rosa_versions(ocm_client=ocm_client, aws_region=aws_region, channel_group=rosa_channel)
 
     # To filter 'rc' and 'ec' versions from 'candidate' channel-group versions
     if not rosa_channel == version_channel:
@@ -116,9 +150,19 @@ def get_all_rosa_versions(
     return _all_rosa_versions
 
 
-def trigger_jobs(config: Dict, jobs: List, logger: logging.Logger, zstream_version: str) -> bool:
+def trigger_jobs(
+    config: Dict,
+    jobs: List,
+    logger: logging.Logger,
+    zstream_version: str,
+    slack_digest: SlackDigest,
+    outbox_batch: str | None = None,
+) -> bool:
     failed_triggers_jobs: List = []
     successful_triggers_jobs: List = []
+    deferred_triggers_jobs: List = []
+    already_triggered_jobs: List = []
+    outbox_entries: Dict = {}
     if not jobs:
         no_jobs_mgs: str = f"{LOG_PREFIX} No jobs to trigger"
         logger.info(no_jobs_mgs)
@@ -130,22 +174,81 @@ def trigger_jobs(config: Dict, jobs: List, logger: logging.Logger, zstream_versi
         return False
 
     else:
+        if outbox_batch:
+            # A version triggered again (previous run interrupted or deferred) only sends the jobs not sent yet
+            outbox_entries = record_triggers(
+                source=TRIGGER_OUTBOX_SOURCE,
+                batch=outbox_batch,
+                ci="openshift-ci",
+                priority=TRIGGER_PRIORITY_BULK,
+                jobs={job: {"product": zstream_version, "_type": "zstream"} for job in jobs},
+            )
+
         for job in jobs:
-            res = openshift_ci_trigger_job(job_name=job, trigger_token=config["trigger_token"])
+            outbox_entry = outbox_entries.get(job, {})
+            outbox_entry_id = outbox_entry.get("id")
+            if outbox_entry.get("status") == TRIGGER_STATUS_DONE:
+                already_triggered_jobs.append(job)
+                continue
+
+            if not claim_trigger(entry_id=outbox_entry_id):
+                # Deferred (or being sent) by another cycle, which sends it once gangway recovers
+                deferred_triggers_jobs.append(job)
+                continue
+
+            try:
+                with span(name="trigger_job", job=job, zstream_version=zstream_version):
+                    res = openshift_ci_trigger_job(
+                        job_name=job, trigger_token=config["trigger_token"], priority=TRIGGER_PRIORITY_BULK
+                    )
+
+            except CircuitOpenError as ex:
+                # Gangway is down, the job is triggered once it recovers instead of failing the whole version
+                defer_openshift_ci_trigger_job(
+                    job_name=job,
+                    trigger_token=config["trigger_token"],
+                    priority=TRIGGER_PRIORITY_BULK,
+                    retry_after_seconds=ex.retry_after_seconds,
+                    logger=logger,
+                    outbox_entry_id=outbox_entry_id,
+                )
+                deferred_triggers_jobs.append(job)
+                continue
+
+            except Exception:
+                # The entry stays pending and is sent again once it is not claimed any more
+                release_trigger_claim(entry_id=outbox_entry_id)
+                raise
 
             if res.ok:
+                set_trigger_status(entry_id=outbox_entry_id, status=TRIGGER_STATUS_DONE)
                 successful_triggers_jobs.append(job)
             else:
+                set_trigger_status(entry_id=outbox_entry_id, status=TRIGGER_STATUS_FAILED)
                 failed_triggers_jobs.append(job)
 
+        if already_triggered_jobs:
+            logger.info(
+                f"{LOG_PREFIX} Skipping {len(already_triggered_jobs)} jobs already triggered for version "
+                f"{zstream_version}: {already_triggered_jobs}"
+            )
+
+        if deferred_triggers_jobs:
+            deferred_msg: str = f"Deferred {len(deferred_triggers_jobs)} jobs: {deferred_triggers_jobs} for version {zstream_version}, gangway is unavailable"
+            logger.warning(f"{LOG_PREFIX} {deferred_msg}")
+            slack_digest.add(message=deferred_msg, webhook_url=config.get("slack_webhook_url"))
+
         if successful_triggers_jobs:
             success_msg: str = f"Triggered {len(successful_triggers_jobs)} jobs: {successful_triggers_jobs} for version {zstream_version}"
             logger.info(f"{LOG_PREFIX} {success_msg}")
-            send_slack_message(
-                message=success_msg,
-                webhook_url=config.get("slack_webhook_url"),
-                logger=logger,
-            )
+            slack_digest.add(message=success_msg, webhook_url=config.get("slack_webhook_url"))
+
+        # Deferred jobs are only kept in this process memory and are lost on restart,
+        # the version is not marked processed so the next cycle triggers the jobs which were not sent
+        if deferred_triggers_jobs:
+            return False
+
+        if successful_triggers_jobs or already_triggered_jobs:
             return True
 
         if failed_triggers_jobs:
@@ -161,6 +264,8 @@ def trigger_jobs(config: Dict, jobs: List, logger: logging.Logger, zstream_versi
     return False
 
 
+@track_cycle(cycle="zstream")
+@span(name="zstream_cycle")
 def process_and_trigger_jobs(logger: logging.Logger, version: str | None = None) -> Dict:
     trigger_res: Dict = {}
     config = get_config(
@@ -175,6 +280,27 @@ def process_and_trigger_jobs(logger: logging.Logger, version: str | None = None)
         logger.error(f"{LOG_PREFIX} No versions found in config.yaml")
         return trigger_res
 
+    # In digest mode the triggered versions of the whole cycle are sent as one slack message, errors are sent right away
+    with SlackDigest(
+        title=f"{LOG_PREFIX} triggered jobs", logger=logger, enabled=bool(config.get("slack_digest"))
+    ) as slack_digest:
+        return trigger_versions_jobs(
+            config=config,
+            versions_from_config=versions_from_config,
+            logger=logger,
+            slack_digest=slack_digest,
+            version=version,
+        )
+
+
+def trigger_versions_jobs(
+    config: Dict,
+    versions_from_config: Dict,
+    logger: logging.Logger,
+    slack_digest: SlackDigest,
+    version: str | None = None,
+) -> Dict:
+    trigger_res: Dict = {}
     if version:
         version_from_config = versions_from_config.get(version)
         if not version_from_config:
@@ -182,7 +308,11 @@ def process_and_trigger_jobs(logger: logging.Logger, version: str | None = None)
 
         logger.info(f"{LOG_PREFIX} Triggering all jobs from config file under version {version}")
         triggered = trigger_jobs(
-            config=config, jobs=versions_from_config[version], logger=logger, zstream_version=version
+            config=config,
+            jobs=versions_from_config[version],
+            logger=logger,
+            zstream_version=version,
+            slack_digest=slack_digest,
         )
         trigger_res[version] = triggered
         return trigger_res
@@ -236,7 +366,7 @@ def process_and_trigger_jobs(logger: logging.Logger, version: str | None = None)
                     aws_region=config["aws_region"],
                 )
                 if _rosa_env
-                else get_accepted_cluster_versions()
+                else get_accepted_ocp_versions()
             )
 
             if not (wanted_version_list := _all_versions.get(_version_channel, {}).get(_wanted_version)):
@@ -262,7 +392,14 @@ def process_and_trigger_jobs(logger: logging.Logger, version: str | None = None)
             logger.info(
                 f"{LOG_PREFIX} New Z-stream version {_latest_version}:{_version_channel} {_rosa_env} found, triggering jobs: {_jobs}"
             )
-            if trigger_jobs(config=config, jobs=_jobs, logger=logger, zstream_version=_latest_version):
+            if trigger_jobs(
+                config=config,
+                jobs=_jobs,
+                logger=logger,
+                zstream_version=_latest_version,
+                slack_digest=slack_digest,
+                outbox_batch=f"{_base_version}:{_latest_version}",
+            ):
                 update_processed_version(
                     base_version=_base_version,
                     version=str(_latest_version),
@@ -283,14 +420,21 @@ def monitor_and_trigger(logger: logging.Logger) -> None:
     )
 
     if cron_schedule := _config.get("cron_schedule"):
-        cron = get_cron_iter(cron_schedule=cron_schedule, config=_config, logger=logger)
+        cron = get_cron_iter(
+            cron_schedule=cron_schedule,
+            logger=logger,
+            slack_errors_webhook_url=_config.get("slack_errors_webhook_url"),
+        )
+        # Reported by get_cron_iter; the loop supervisor does not restart a loop which returns
         if not cron:
             return
 
     else:
         run_interval = tts(ts=_config.get("run_interval", "24h"))
 
+    drain_trigger_outbox(source=TRIGGER_OUTBOX_SOURCE, config_data=_config, logger=logger, loop_start=True)
     while True:
+        cycle_start_time = time.monotonic()
         try:
             if cron:
                 run_interval = int((cron.get_next(datetime.datetime) - datetime.datetime.now()).total_seconds())
@@ -299,23 +443,20 @@ def monitor_and_trigger(logger: logging.Logger) -> None:
                 logger.info(f"{LOG_PREFIX} Sleeping for {stt(seconds=run_interval)}...")
                 time.sleep(run_interval)
 
+            cycle_start_time = time.monotonic()
+            drain_trigger_outbox(source=TRIGGER_OUTBOX_SOURCE, config_data=_config, logger=logger)
             process_and_trigger_jobs(logger=logger)
+            record_loop_cycle(
+                loop_name="monitor_and_trigger", cycle_seconds=time.monotonic() - cycle_start_time, logger=logger
+            )
 
         except Exception as ex:
             logger.warning(f"{LOG_PREFIX} Error: {ex}")
+            record_loop_cycle(
+                loop_name="monitor_and_trigger",
+                cycle_seconds=time.monotonic() - cycle_start_time,
+                logger=logger,
+                failed=True,
+                next_run_seconds=DAYS_TO_SECONDS,
+            )
             time.sleep(DAYS_TO_SECONDS)
-
-
-def get_cron_iter(cron_schedule: str, config: Dict, logger: logging.Logger) -> croniter | None:
-    try:
-        return croniter(cron_schedule, start_time=datetime.datetime.now(), day_or=False)
-    except CroniterBadCronError:
-        err_msg: str = f"Invalid cron schedule: {cron_schedule}"
-        logger.error(f"{LOG_PREFIX} {err_msg}")
-        send_slack_message(
-            message=err_msg,
-            webhook_url=config.get("slack_errors_webhook_url"),
-            logger=logger,
-        )
-
-        return None
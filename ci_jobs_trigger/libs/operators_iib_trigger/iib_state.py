@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import json
+import sys
+
+IIB_STATE_FORMAT_VERSION = 2
+
+
+class IIBStateFormatError(Exception):
+    pass
+
+
+class IIBJobState:
+    __slots__ = ("ci", "operators")
+
+    def __init__(self, ci: str, operators: dict[str, str] | None = None) -> None:
+        self.ci = sys.intern(ci)
+        # operator name -> latest index image
+        self.operators = operators or {}
+
+
+class IIBState:
+    __slots__ = ("versions",)
+
+    def __init__(self) -> None:
+        # ocp version -> job name -> IIBJobState
+        self.versions: dict[str, dict[str, IIBJobState]] = {}
+
+    def get_iib(self, ocp_version: str, job_name: str, operator: str) -> str | None:
+        job_state = self.versions.get(ocp_version, {}).get(job_name)
+        return job_state.operators.get(operator) if job_state else None
+
+    def set_iib(self, ocp_version: str, job_name: str, ci: str, operator: str, iib: str) -> None:
+        jobs = self.versions.setdefault(sys.intern(ocp_version), {})
+        job_state = jobs.get(job_name)
+        if job_state is None:
+            job_state = jobs[sys.intern(job_name)] = IIBJobState(ci=ci)
+
+        else:
+            job_state.ci = sys.intern(ci)
+
+        job_state.operators[sys.intern(operator)] = iib
+
+    @classmethod
+    def from_dict(cls, data: dict) -> IIBState:
+        if not data:
+            return cls()
+
+        format_version = data.get("format_version")
+        if format_version is None:
+            return cls.from_legacy_dict(data=data)
+
+        if format_version != IIB_STATE_FORMAT_VERSION:
+            raise IIBStateFormatError(f"Unsupported IIB state format version: {format_version}")
+
+        state = cls()
+        operators = [sys.intern(operator) for operator in data["operators"]]
+        for ocp_version, jobs in data["jobs"].items():
+            for job_name, (ci, operators_iib) in jobs.items():
+                state.versions.setdefault(sys.intern(ocp_version), {})[sys.intern(job_name)] = IIBJobState(
+                    ci=ci, operators={operators[operator_index]: iib for operator_index, iib in operators_iib}
+                )
+
+        return state
+
+    @classmethod
+    def from_legacy_dict(cls, data: dict) -> IIBState:
+        # Legacy format: {ocp version: {job name: {"ci": ci, "operators": {operator: {"iib": iib, ...}}}}}
+        state = cls()
+        for ocp_version, jobs in data.items():
+            for job_name, job_data in jobs.items():
+                job_state = IIBJobState(ci=job_data["ci"])
+                for operator, operator_data in job_data.get("operators", {}).items():
+                    if isinstance(operator_data, dict) and operator_data.get("iib"):
+                        job_state.operators[sys.intern(operator)] = operator_data["iib"]
+
+                state.versions.setdefault(sys.intern(ocp_version), {})[sys.intern(job_name)] = job_state
+
+        return state
+
+    def to_dict(self) -> dict:
+        # Compact format: operator names are stored once and referenced by index
+        operators_index: dict[str, int] = {}
+        jobs: dict[str, dict[str, list]] = {}
+        for ocp_version, version_jobs in self.versions.items():
+            for job_name, job_state in version_jobs.items():
+                jobs.setdefault(ocp_version, {})[job_name] = [
+                    job_state.ci,
+                    [
+                        [operators_index.setdefault(operator, len(operators_index)), iib]
+                        for operator, iib in job_state.operators.items()
+                    ],
+                ]
+
+        return {
+            "format_version": IIB_STATE_FORMAT_VERSION,
+            "operators": list(operators_index),
+            "jobs": jobs,
+        }
+
+
+def load_iib_state(path: str) -> IIBState:
+    with open(path) as fd:
+        return IIBState.from_dict(data=json.load(fd))
+
+
+def dump_iib_state(state: IIBState, path: str) -> None:
+    with open(path, "w") as fd:
+        json.dump(state.to_dict(), fd, separators=(",", ":"))
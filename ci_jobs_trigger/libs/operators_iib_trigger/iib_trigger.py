@@ -1,21 +1,69 @@
-import copy
-import json
+from __future__ import annotations
+
+import contextvars
+import hashlib
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from json import JSONDecodeError
-from time import sleep
+from time import monotonic, sleep
+from typing import NamedTuple
 
-import requests
+from botocore.exceptions import ClientError
+from pyhelper_utils.general import stt
 
-from ci_jobs_trigger.libs.utils.general import trigger_ci_job
-from ci_jobs_trigger.utils.constant import DAYS_TO_SECONDS
+from ci_jobs_trigger.libs.operators_iib_trigger.iib_state import IIBState, dump_iib_state, load_iib_state
+from ci_jobs_trigger.libs.utils.general import drain_trigger_outbox, trigger_ci_job
+from ci_jobs_trigger.utils.circuit_breaker import guarded_dependency_call
 from ci_jobs_trigger.utils.general import (
     send_slack_message,
     get_config,
+    get_next_run_seconds,
     AddonsWebhookTriggerError,
+    SlackDigest,
 )
+from ci_jobs_trigger.utils.http_client import get_http_session
+from ci_jobs_trigger.utils.loop_supervisor import record_loop_cycle
+from ci_jobs_trigger.utils.metrics import track_cycle, track_dependency_call
+from ci_jobs_trigger.utils.rate_limiter import TRIGGER_PRIORITY_BULK
+from ci_jobs_trigger.utils.tracing import span
+from ci_jobs_trigger.utils.trigger_outbox import TRIGGER_STATUS_DONE, TriggerOutbox, claim_trigger
 from clouds.aws.session_clients import s3_client
 
+IIB_JOBS_TRIGGER_CONFIG_OS_ENV_STR = "CI_IIB_JOBS_TRIGGER_CONFIG"
 LOG_PREFIX = "iib-trigger:"
+S3_NOT_MODIFIED_ERROR_CODES = ("304", "NotModified")
+S3_NOT_FOUND_ERROR_CODES = ("404", "NoSuchKey")
+S3_PRECONDITION_FAILED_ERROR_CODES = ("412", "PreconditionFailed")
+DEFAULT_MAX_PARALLEL_TRIGGERS = {"openshift-ci": 10, "jenkins": 4}
+TRIGGER_OUTBOX_SOURCE = "iib"
+
+
+class IIBChange(NamedTuple):
+    ocp_version: str
+    job_name: str
+    ci: str
+    operator: str
+    old_iib: str | None
+    new_iib: str
+
+
+class IIBJobTrigger(NamedTuple):
+    job_name: str
+    ci: str
+    iib_changes: list[IIBChange]
+
+
+class IIBUpdate(NamedTuple):
+    iib_changes: list[IIBChange]
+    trigger_plan: dict[str, IIBJobTrigger]
+    # Job name -> trigger outbox entry of the trigger plan
+    outbox_entries: dict
+
+
+# Clients and last synced object state are kept for the lifetime of the process to avoid
+# re-creating a boto client and re-transferring an unchanged IIB file on every cycle.
+S3_CLIENTS = {}
+S3_OBJECTS_STATE = {}
 
 
 def get_operator_data_from_url(operator_name, ocp_version, logger):
@@ -25,18 +73,114 @@ def get_operator_data_from_url(operator_name, ocp_version, logger):
         "VirtualTopic.eng.ci.redhat-container-image.index.built"
     )
 
-    res = requests.get(
-        f"{datagrepper_query_url}&contains={operator_name}",
-        verify=False,
-    )
+    with span(name="datagrepper_query", operator=operator_name):
+        with guarded_dependency_call(dependency="datagrepper", operation="index_built_messages"):
+            res = get_http_session(dependency="datagrepper").get(f"{datagrepper_query_url}&contains={operator_name}")
+            json_res = res.json()
+
     logger.info(f"{LOG_PREFIX} Done getting IIB data for {operator_name}")
-    json_res = res.json()
     for raw_msg in json_res["raw_messages"]:
         _index = raw_msg["msg"]["index"]
         if _index["ocp_version"] == ocp_version:
             yield _index
 
 
+def get_s3_client(region):
+    if region not in S3_CLIENTS:
+        S3_CLIENTS[region] = s3_client(region_name=region)
+
+    return S3_CLIENTS[region]
+
+
+def get_s3_error_code(ex):
+    return ex.response.get("Error", {}).get("Code")
+
+
+def download_s3_bucket_file(client, bucket, key, filename, s3_bucket_file_full_path, logger):
+    object_state = S3_OBJECTS_STATE.get(s3_bucket_file_full_path, {})
+    get_object_kwargs = {"Bucket": bucket, "Key": key}
+    # Only ask for a conditional download if the local copy is still there to be reused
+    if object_state.get("etag") and os.path.exists(filename):
+        get_object_kwargs["IfNoneMatch"] = object_state["etag"]
+
+    try:
+        response = client.get_object(**get_object_kwargs)
+
+    except ClientError as ex:
+        error_code = get_s3_error_code(ex=ex)
+        if error_code in S3_NOT_MODIFIED_ERROR_CODES:
+            logger.info(f"{LOG_PREFIX} IIB file in s3 {s3_bucket_file_full_path} not modified, skipping download")
+            return True
+
+        if error_code in S3_NOT_FOUND_ERROR_CODES:
+            logger.info(f"{LOG_PREFIX} IIB file {s3_bucket_file_full_path} does not exist in s3 yet")
+            S3_OBJECTS_STATE[s3_bucket_file_full_path] = {"etag": None, "sha256": None, "exists": False}
+            return True
+
+        raise
+
+    logger.info(f"{LOG_PREFIX} Downloading IIB file from s3 {s3_bucket_file_full_path}")
+    content = response["Body"].read()
+    with open(filename, "wb") as fd:
+        fd.write(content)
+
+    S3_OBJECTS_STATE[s3_bucket_file_full_path] = {
+        "etag": response["ETag"],
+        "sha256": hashlib.sha256(content).hexdigest(),
+        "exists": True,
+    }
+    return True
+
+
+def upload_s3_bucket_file(client, bucket, key, filename, s3_bucket_file_full_path, logger, slack_errors_webhook_url):
+    with open(filename, "rb") as fd:
+        content = fd.read()
+
+    content_sha256 = hashlib.sha256(content).hexdigest()
+    object_state = S3_OBJECTS_STATE.get(s3_bucket_file_full_path, {})
+    if object_state.get("sha256") == content_sha256:
+        logger.info(f"{LOG_PREFIX} IIB file in s3 {s3_bucket_file_full_path} is up to date, skipping upload")
+        return True
+
+    put_object_kwargs = {"Bucket": bucket, "Key": key, "Body": content}
+    # Optimistic concurrency: only overwrite the object we last saw, or create it if it did not exist
+    if object_state.get("etag"):
+        put_object_kwargs["IfMatch"] = object_state["etag"]
+
+    elif object_state.get("exists") is False:
+        put_object_kwargs["IfNoneMatch"] = "*"
+
+    logger.info(f"{LOG_PREFIX} Uploading IIB file to s3 {s3_bucket_file_full_path}")
+    try:
+        response = client.put_object(**put_object_kwargs)
+
+    except Exception as ex:
+        # The object was changed by another writer or may have been written anyway (i.e. a timeout), the cached
+        # state is stale either way: force a full download on the next cycle
+        S3_OBJECTS_STATE.pop(s3_bucket_file_full_path, None)
+        if not isinstance(ex, ClientError) or get_s3_error_code(ex=ex) not in S3_PRECONDITION_FAILED_ERROR_CODES:
+            raise
+
+        error_msg = (
+            f"{LOG_PREFIX} IIB file in s3 {s3_bucket_file_full_path} was modified by another writer, "
+            "upload skipped and will be retried on next cycle"
+        )
+        logger.error(error_msg)
+        send_slack_message(
+            message=error_msg,
+            webhook_url=slack_errors_webhook_url,
+            logger=logger,
+        )
+        return False
+
+    S3_OBJECTS_STATE[s3_bucket_file_full_path] = {
+        "etag": response["ETag"],
+        "sha256": content_sha256,
+        "exists": True,
+    }
+    return True
+
+
 def upload_download_s3_bucket_file(
     action,
     filename,
@@ -66,15 +210,33 @@ def upload_download_s3_bucket_file(
         return False
 
     try:
-        client = boto_s3_client or s3_client(region_name=region)
-
-        if action == "upload":
-            logger.info(f"{LOG_PREFIX} Uploading IIB file to s3 {s3_bucket_file_full_path}")
-            return client.upload_file(Filename=filename, Bucket=bucket, Key=key)
-
-        elif action == "download":
-            logger.info(f"{LOG_PREFIX} Downloading IIB file from s3 {s3_bucket_file_full_path}")
-            return client.download_file(Bucket=bucket, Key=key, Filename=filename)
+        client = boto_s3_client or get_s3_client(region=region)
+
+        with track_dependency_call(dependency="s3", operation=action) as dependency_call:
+            if action == "upload":
+                synced = upload_s3_bucket_file(
+                    client=client,
+                    bucket=bucket,
+                    key=key,
+                    filename=filename,
+                    s3_bucket_file_full_path=s3_bucket_file_full_path,
+                    logger=logger,
+                    slack_errors_webhook_url=slack_errors_webhook_url,
+                )
+
+            else:
+                synced = download_s3_bucket_file(
+                    client=client,
+                    bucket=bucket,
+                    key=key,
+                    filename=filename,
+                    s3_bucket_file_full_path=s3_bucket_file_full_path,
+                    logger=logger,
+                )
+
+            dependency_call.failed = not synced
+
+        return synced
 
     except Exception as ex:
         error_msg = f"{LOG_PREFIX} S3 {action} failed: {ex}"
@@ -87,11 +249,14 @@ def upload_download_s3_bucket_file(
         return False
 
 
-def write_new_data_to_file_and_upload_to_s3(config_data, new_data, logger):
+@span(name="write_and_upload_iib_state")
+def write_new_data_to_file_and_upload_to_s3(config_data, iib_state, logger):
     iib_file = config_data["local_operators_latest_iib_filepath"]
 
-    with open(iib_file, "w") as fd:
-        fd.write(json.dumps(new_data))
+    # Write to a temporary file and rename it so a failure never leaves a partially written IIB file
+    tmp_iib_file = f"{iib_file}.tmp"
+    dump_iib_state(state=iib_state, path=tmp_iib_file)
+    os.replace(tmp_iib_file, iib_file)
 
     if s3_bucket_operators_latest_iib_path := config_data.get("s3_bucket_operators_latest_iib_path"):
         return upload_download_s3_bucket_file(
@@ -104,55 +269,91 @@ def write_new_data_to_file_and_upload_to_s3(config_data, new_data, logger):
         )
 
 
-def get_new_iib(config_data, logger):
-    new_trigger_data = False
-    data_from_file = get_iib_data_from_file(config_data=config_data)
-    new_data = copy.deepcopy(data_from_file)
+def iib_changes_to_str(iib_changes):
+    return "\n\t".join(
+        f"{change.ocp_version} {change.job_name} {change.operator}: {change.old_iib} -> {change.new_iib}"
+        for change in iib_changes
+    )
+
+
+def iib_changes_to_slack_str(iib_changes):
+    return "\n\t".join(f"{change.operator}: {change.new_iib}" for change in iib_changes)
+
+
+def get_iib_changes(iib_state, config_data, logger):
+    iib_changes = []
 
     for _ocp_version, _jobs_data in config_data.get("ci_jobs", {}).items():
         if _jobs_data:
             for _ci_job in _jobs_data:
                 job_name = _ci_job["name"]
-                job_products = _ci_job["products"]
-                new_data.setdefault(_ocp_version, {}).setdefault(job_name, {})
-                new_data[_ocp_version][job_name].setdefault("operators", {})
-                new_data[_ocp_version][job_name].setdefault("ci", _ci_job["ci"])
-                for _operator, _operator_name in job_products.items():
-                    new_data[_ocp_version][job_name]["operators"].setdefault(_operator_name, {})
-                    _operator_data = new_data[_ocp_version][job_name]["operators"][_operator_name]
-                    _operator_data["new-iib"] = False
+                for _operator, _operator_name in _ci_job["products"].items():
+                    current_iib = iib_state.get_iib(
+                        ocp_version=_ocp_version, job_name=job_name, operator=_operator_name
+                    )
+                    latest_iib = current_iib
                     logger.info(f"{LOG_PREFIX} Parsing new IIB data for {_operator_name}")
-                    for data_from_file in get_operator_data_from_url(
+                    for operator_data in get_operator_data_from_url(
                         operator_name=_operator,
                         ocp_version=_ocp_version,
                         logger=logger,
                     ):
-                        index_image = data_from_file["index_image"]
+                        index_image = operator_data["index_image"]
+                        if not latest_iib or latest_iib.split("iib:")[-1] < index_image.split("iib:")[-1]:
+                            latest_iib = index_image
+
+                    if latest_iib != current_iib:
+                        iib_changes.append(
+                            IIBChange(
+                                ocp_version=_ocp_version,
+                                job_name=job_name,
+                                ci=_ci_job["ci"],
+                                operator=_operator_name,
+                                old_iib=current_iib,
+                                new_iib=latest_iib,
+                            )
+                        )
+
+            logger.info(f"{LOG_PREFIX} Done parsing new IIB data for {_ocp_version}")
+
+    return iib_changes
 
-                        iib_data_from_file = _operator_data.get("iib")
-                        if iib_data_from_file:
-                            iib_from_url = data_from_file["index_image"].split("iib:")[-1]
-                            iib_from_file = iib_data_from_file.split("iib:")[-1]
-                            if iib_from_file < iib_from_url:
-                                _operator_data["iib"] = index_image
-                                _operator_data["new-iib"] = True
-                                new_trigger_data = True
 
-                        else:
-                            _operator_data["iib"] = index_image
-                            _operator_data["new-iib"] = True
-                            new_trigger_data = True
+def apply_iib_changes(iib_state, iib_changes):
+    for change in iib_changes:
+        iib_state.set_iib(
+            ocp_version=change.ocp_version,
+            job_name=change.job_name,
+            ci=change.ci,
+            operator=change.operator,
+            iib=change.new_iib,
+        )
 
-            logger.info(f"{LOG_PREFIX} Done parsing new IIB data for {_jobs_data}")
+    return iib_state
 
-    if new_trigger_data:
-        logger.info(f"{LOG_PREFIX} New IIB data found: {new_data}\nOld IIB data: {data_from_file}")
 
-        write_new_data_to_file_and_upload_to_s3(config_data=config_data, new_data=new_data, logger=logger)
+@span(name="get_new_iib")
+def get_new_iib(config_data, logger):
+    iib_state = get_iib_state_from_file(config_data=config_data)
+    iib_changes = get_iib_changes(iib_state=iib_state, config_data=config_data, logger=logger)
+    trigger_plan = get_iib_trigger_plan(ci_jobs=config_data.get("ci_jobs") or {}, iib_changes=iib_changes)
+    outbox_entries = {}
+
+    if iib_changes:
+        logger.info(f"{LOG_PREFIX} New IIB data found:\n\t{iib_changes_to_str(iib_changes=iib_changes)}")
+        # Once the new IIBs are saved they are not found again, the triggers are recorded first
+        # so the ones a restart interrupts are sent when the loop starts again
+        outbox_entries = record_iib_trigger_plan(trigger_plan=trigger_plan)
+        write_new_data_to_file_and_upload_to_s3(
+            config_data=config_data,
+            iib_state=apply_iib_changes(iib_state=iib_state, iib_changes=iib_changes),
+            logger=logger,
+        )
 
-    return new_data
+    return IIBUpdate(iib_changes=iib_changes, trigger_plan=trigger_plan, outbox_entries=outbox_entries)
 
 
+@span(name="download_iib_state")
 def download_iib_file_from_s3_bucket(
     s3_bucket_operators_latest_iib_path,
     aws_region,
@@ -171,7 +372,7 @@ def download_iib_file_from_s3_bucket(
         return False
 
     try:
-        upload_download_s3_bucket_file(
+        return upload_download_s3_bucket_file(
             action="download",
             filename=target_file_path,
             s3_bucket_file_full_path=s3_bucket_operators_latest_iib_path,
@@ -180,8 +381,6 @@ def download_iib_file_from_s3_bucket(
             slack_errors_webhook_url=slack_errors_webhook_url,
         )
 
-        return True
-
     except Exception as ex:
         error_msg = (
             f"{LOG_PREFIX} Failed to download IIB file from s3_bucket_operators_latest_iib_path: "
@@ -196,13 +395,12 @@ def download_iib_file_from_s3_bucket(
         return False
 
 
-def get_iib_data_from_file(config_data):
+def get_iib_state_from_file(config_data):
     try:
-        with open(config_data["local_operators_latest_iib_filepath"]) as fd:
-            return json.load(fd)
+        return load_iib_state(path=config_data["local_operators_latest_iib_filepath"])
 
     except (JSONDecodeError, FileNotFoundError):
-        return {}
+        return IIBState()
 
 
 def verify_s3_or_local_file(
@@ -226,9 +424,122 @@ def verify_s3_or_local_file(
     return True
 
 
+def get_ci_jobs_index(ci_jobs):
+    ci_jobs_index = {}
+    for _jobs_data in ci_jobs.values():
+        for _ci_job in _jobs_data or []:
+            ci_jobs_index[_ci_job["name"]] = _ci_job["ci"]
+
+    return ci_jobs_index
+
+
+def get_iib_trigger_plan(ci_jobs, iib_changes):
+    # Build the index once so planning stays linear in the number of jobs and changes
+    ci_jobs_index = get_ci_jobs_index(ci_jobs=ci_jobs)
+    trigger_plan = {}
+    for change in iib_changes:
+        if change.job_name not in ci_jobs_index:
+            continue
+
+        trigger_plan.setdefault(
+            change.job_name,
+            IIBJobTrigger(job_name=change.job_name, ci=ci_jobs_index[change.job_name], iib_changes=[]),
+        ).iib_changes.append(change)
+
+    return trigger_plan
+
+
+def get_iib_job_trigger_args(job_trigger):
+    return {
+        "product": ", ".join(change.operator for change in job_trigger.iib_changes),
+        "_type": "operator",
+        "triggered_with": iib_changes_to_slack_str(iib_changes=job_trigger.iib_changes),
+        "operator_iib": True,
+    }
+
+
+def record_iib_trigger_plan(trigger_plan):
+    # Job name -> trigger outbox entry; a job is triggered once for the same new IIBs
+    outbox_entries = {}
+    with TriggerOutbox() as trigger_outbox:
+        for _job_trigger in trigger_plan.values():
+            outbox_entries.update(
+                trigger_outbox.record(
+                    source=TRIGGER_OUTBOX_SOURCE,
+                    batch=",".join(sorted(change.new_iib for change in _job_trigger.iib_changes)),
+                    ci=_job_trigger.ci,
+                    priority=TRIGGER_PRIORITY_BULK,
+                    jobs={_job_trigger.job_name: get_iib_job_trigger_args(job_trigger=_job_trigger)},
+                )
+            )
+
+    return outbox_entries
+
+
+@span(name="dispatch_trigger_plan")
+def dispatch_iib_trigger_plan(trigger_plan, config_data, logger, slack_digest=None, outbox_entries=None):
+    # outbox_entries: the trigger plan entries returned by record_iib_trigger_plan, if it was recorded
+    outbox_entries = outbox_entries or {}
+    max_parallel_triggers = {**DEFAULT_MAX_PARALLEL_TRIGGERS, **(config_data.get("max_parallel_triggers") or {})}
+    ci_job_triggers = {}
+    for _job_trigger in trigger_plan.values():
+        ci_job_triggers.setdefault(_job_trigger.ci, []).append(_job_trigger)
+
+    failed_triggered_jobs = {}
+    # One pool per CI backend, so a slow Jenkins start confirmation does not hold openshift-ci triggers
+    executors = {
+        _ci: ThreadPoolExecutor(max_workers=max_parallel_triggers.get(_ci, 1), thread_name_prefix=f"iib-trigger-{_ci}")
+        for _ci in ci_job_triggers
+    }
+    try:
+        futures = {}
+        for _ci, _job_triggers in ci_job_triggers.items():
+            for _job_trigger in _job_triggers:
+                outbox_entry = outbox_entries.get(_job_trigger.job_name, {})
+                if outbox_entry.get("status") == TRIGGER_STATUS_DONE:
+                    logger.info(f"{LOG_PREFIX} {_job_trigger.job_name} already triggered for these IIBs, skipping")
+                    continue
+
+                if not claim_trigger(entry_id=outbox_entry.get("id")):
+                    logger.info(
+                        f"{LOG_PREFIX} {_job_trigger.job_name} is already deferred or being triggered, skipping"
+                    )
+                    continue
+
+                # Each trigger runs in a copy of the current context, so its spans belong to this trace
+                future = executors[_ci].submit(
+                    contextvars.copy_context().run,
+                    trigger_ci_job,
+                    job=_job_trigger.job_name,
+                    ci=_ci,
+                    logger=logger,
+                    config_data=config_data,
+                    slack_digest=slack_digest,
+                    trigger_priority=TRIGGER_PRIORITY_BULK,
+                    outbox_entry_id=outbox_entry.get("id"),
+                    **get_iib_job_trigger_args(job_trigger=_job_trigger),
+                )
+                futures[future] = _job_trigger
+
+        for future in as_completed(futures):
+            _job_trigger = futures[future]
+            try:
+                future.result()
+            except AddonsWebhookTriggerError:
+                failed_triggered_jobs.setdefault(_job_trigger.ci, []).append(_job_trigger.job_name)
+
+    finally:
+        for executor in executors.values():
+            executor.shutdown()
+
+    return failed_triggered_jobs
+
+
+@track_cycle(cycle="iib")
+@span(name="iib_cycle")
 def fetch_update_iib_and_trigger_jobs(logger, tmp_dir, config_dict=None):
     logger.info(f"{LOG_PREFIX} Check for new operators IIB")
-    config_data = get_config(os_environ="CI_IIB_JOBS_TRIGGER_CONFIG", logger=logger)
+    config_data = get_config(os_environ=IIB_JOBS_TRIGGER_CONFIG_OS_ENV_STR, logger=logger)
 
     s3_bucket_operators_latest_iib_path = config_data.get("s3_bucket_operators_latest_iib_path")
     user_local_operators_latest_iib_filepath = config_data.get("local_operators_latest_iib_filepath")
@@ -247,60 +558,96 @@ def fetch_update_iib_and_trigger_jobs(logger, tmp_dir, config_dict=None):
         logger.info(f"{LOG_PREFIX} Created temp dir: {local_operators_latest_iib_filepath}")
         config_data["local_operators_latest_iib_filepath"] = local_operators_latest_iib_filepath
 
-        if s3_bucket_operators_latest_iib_path:
-            if not download_iib_file_from_s3_bucket(
-                s3_bucket_operators_latest_iib_path=s3_bucket_operators_latest_iib_path,
-                aws_region=config_data.get("aws_region"),
-                slack_errors_webhook_url=config_data.get("slack_errors_webhook_url"),
-                logger=logger,
-                target_file_path=local_operators_latest_iib_filepath,
-            ):
-                return False
+        if s3_bucket_operators_latest_iib_path and not download_iib_file_from_s3_bucket(
+            s3_bucket_operators_latest_iib_path=s3_bucket_operators_latest_iib_path,
+            aws_region=config_data.get("aws_region"),
+            slack_errors_webhook_url=config_data.get("slack_errors_webhook_url"),
+            logger=logger,
+            target_file_path=local_operators_latest_iib_filepath,
+        ):
+            return False
 
-    if (ci_jobs := config_data.get("ci_jobs", {})) is None:
+    if config_data.get("ci_jobs", {}) is None:
         logger.error(f"{LOG_PREFIX} No ci_jobs found in config")
         return {}
 
-    trigger_dict = get_new_iib(config_data=config_data, logger=logger)
+    iib_update = get_new_iib(config_data=config_data, logger=logger)
+    if not iib_update.trigger_plan:
+        logger.info(f"{LOG_PREFIX} No new IIB found, no jobs to trigger")
+        return {}
 
-    failed_triggered_jobs = {}
-    for _, _job_data in trigger_dict.items():
-        for _job_name, _job_dict in _job_data.items():
-            if _job_name in [job["name"] for jobs in ci_jobs.values() if jobs for job in jobs]:
-                operators = _job_dict["operators"]
-                if any([_value["new-iib"] for _value in operators.values()]):
-                    try:
-                        trigger_ci_job(
-                            job=_job_name,
-                            product=", ".join(operators.keys()),
-                            _type="operator",
-                            trigger_dict=trigger_dict,
-                            ci=_job_dict["ci"],
-                            logger=logger,
-                            config_data=config_data,
-                            operator_iib=True,
-                        )
-                    except AddonsWebhookTriggerError:
-                        failed_triggered_jobs.setdefault(_job_dict["ci"], []).append(_job_name)
-                        continue
-    return failed_triggered_jobs
+    with SlackDigest(
+        title=f"{LOG_PREFIX} triggered {len(iib_update.trigger_plan)} jobs",
+        logger=logger,
+        enabled=bool(config_data.get("slack_digest")),
+    ) as slack_digest:
+        failed_triggered_jobs = dispatch_iib_trigger_plan(
+            trigger_plan=iib_update.trigger_plan,
+            config_data=config_data,
+            logger=logger,
+            slack_digest=slack_digest,
+            outbox_entries=iib_update.outbox_entries,
+        )
+
+    return {"trigger_plan": iib_update.trigger_plan, "failed_triggered_jobs": failed_triggered_jobs}
 
 
-def run_iib_update(logger, tmp_dir):
+def run_iib_update(logger, tmp_dir, run_now_event=None):
+    loop_start = True
+    failures = 0
     while True:
+        cycle_start_time = monotonic()
         try:
-            failed_triggered_jobs = fetch_update_iib_and_trigger_jobs(logger=logger, tmp_dir=tmp_dir)
-            if failed_triggered_jobs:
-                logger.info(f"{LOG_PREFIX} Failed triggered jobs: {failed_triggered_jobs}")
+            drain_trigger_outbox(
+                source=TRIGGER_OUTBOX_SOURCE,
+                config_data=get_config(os_environ=IIB_JOBS_TRIGGER_CONFIG_OS_ENV_STR, logger=logger),
+                logger=logger,
+                loop_start=loop_start,
+            )
+            loop_start = False
+            iib_trigger_result = fetch_update_iib_and_trigger_jobs(logger=logger, tmp_dir=tmp_dir)
+            # False when the IIB file could not be verified or downloaded, retried with the error backoff
+            if iib_trigger_result is False:
+                failures += 1
+                logger.warning(f"{LOG_PREFIX} Failed to get the operators IIB file, retrying with backoff")
+
+            else:
+                if iib_trigger_result and (failed_triggered_jobs := iib_trigger_result["failed_triggered_jobs"]):
+                    logger.info(f"{LOG_PREFIX} Failed triggered jobs: {failed_triggered_jobs}")
+
+                failures = 0
 
         except Exception as ex:
+            failures += 1
             err_msg = f"{LOG_PREFIX} Fail to run run_iib_update function. {ex}"
             logger.error(err_msg)
-            slack_errors_webhook_url = get_config(os_environ="CI_IIB_JOBS_TRIGGER_CONFIG", logger=logger).get(
+            slack_errors_webhook_url = get_config(os_environ=IIB_JOBS_TRIGGER_CONFIG_OS_ENV_STR, logger=logger).get(
                 "slack_errors_webhook_url"
             )
             send_slack_message(message=err_msg, webhook_url=slack_errors_webhook_url, logger=logger)
 
         finally:
-            logger.info(f"{LOG_PREFIX} Done check for new operators IIB, sleeping for 1 day")
-            sleep(DAYS_TO_SECONDS)
+            next_run_seconds = get_next_run_seconds(
+                config=get_config(os_environ=IIB_JOBS_TRIGGER_CONFIG_OS_ENV_STR, logger=logger),
+                logger=logger,
+                failures=failures,
+            )
+            record_loop_cycle(
+                loop_name="run_iib_update",
+                cycle_seconds=monotonic() - cycle_start_time,
+                logger=logger,
+                failed=bool(failures),
+                next_run_seconds=next_run_seconds,
+            )
+            logger.info(f"{LOG_PREFIX} Done check for new operators IIB, sleeping for {stt(seconds=next_run_seconds)}")
+            wait_for_next_run(seconds=next_run_seconds, run_now_event=run_now_event, logger=logger)
+
+
+def wait_for_next_run(seconds, logger, run_now_event=None):
+    if not run_now_event:
+        sleep(seconds)
+        return
+
+    if run_now_event.wait(timeout=seconds):
+        run_now_event.clear()
+        logger.info(f"{LOG_PREFIX} Run now requested")
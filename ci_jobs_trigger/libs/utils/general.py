@@ -1,7 +1,18 @@
 from ci_jobs_trigger.libs.openshift_ci.utils.constants import GANGWAY_API_URL
-from ci_jobs_trigger.libs.openshift_ci.utils.general import openshift_ci_trigger_job
+from ci_jobs_trigger.libs.openshift_ci.utils.general import defer_openshift_ci_trigger_job, openshift_ci_trigger_job
 from ci_jobs_trigger.libs.jenkins.utils.general import jenkins_trigger_job
-from ci_jobs_trigger.utils.general import send_slack_message, AddonsWebhookTriggerError
+from ci_jobs_trigger.utils.circuit_breaker import CircuitOpenError
+from ci_jobs_trigger.utils.general import SlackDigest, send_slack_message, AddonsWebhookTriggerError
+from ci_jobs_trigger.utils.rate_limiter import TRIGGER_PRIORITY_NORMAL
+from ci_jobs_trigger.utils.tracing import span
+from ci_jobs_trigger.utils.trigger_outbox import (
+    TRIGGER_OUTBOX_RETENTION_SECONDS,
+    TRIGGER_STATUS_DONE,
+    TRIGGER_STATUS_FAILED,
+    TriggerOutbox,
+    release_trigger_claim,
+    set_trigger_status,
+)
 
 
 def dict_to_str(_dict):
@@ -11,19 +22,6 @@ def dict_to_str(_dict):
     return dict_str
 
 
-def operators_triggered_for_slack(job_dict):
-    res = ""
-    for vals in job_dict.values():
-        for operator, data in vals["operators"].items():
-            if not isinstance(data, dict):
-                continue
-
-            if data.get("triggered"):
-                res += f"{operator}: {data.get('iib')}\n\t"
-
-    return res
-
-
 def trigger_ci_job(
     job,
     product,
@@ -31,25 +29,59 @@ def trigger_ci_job(
     ci,
     logger,
     config_data,
-    trigger_dict=None,
+    triggered_with=None,
     operator_iib=False,
+    slack_digest=None,
+    trigger_priority=TRIGGER_PRIORITY_NORMAL,
+    outbox_entry_id=None,
 ):
     openshift_ci_response = None
+    # Without the digest of a cycle, the messages are sent right away
+    slack_digest = slack_digest or SlackDigest(title=f"{ci} triggered jobs", logger=logger, enabled=False)
     logger.info(f"Triggering {ci} job for {product} [{_type}]: {job}")
-    job_dict = trigger_dict[[*trigger_dict][0]] if trigger_dict else None
     openshift_ci = ci == "openshift-ci"
     jenkins_ci = ci == "jenkins"
 
-    if openshift_ci:
-        openshift_ci_response = openshift_ci_trigger_job(job_name=job, trigger_token=config_data["trigger_token"])
-        rc = openshift_ci_response.ok
-        res = openshift_ci_response.json() if rc else openshift_ci_response.text
-
-    elif jenkins_ci:
-        rc, res = jenkins_trigger_job(job=job, config_data=config_data, logger=logger, operator_iib=operator_iib)
-
-    else:
-        raise ValueError(f"Unknown ci: {ci}")
+    with span(name="trigger_ci_job", ci=ci, job=job, product=product):
+        if openshift_ci:
+            try:
+                openshift_ci_response = openshift_ci_trigger_job(
+                    job_name=job, trigger_token=config_data["trigger_token"], priority=trigger_priority
+                )
+            except CircuitOpenError as ex:
+                # Gangway is down, the job is triggered once it recovers instead of failing
+                defer_openshift_ci_trigger_job(
+                    job_name=job,
+                    trigger_token=config_data["trigger_token"],
+                    priority=trigger_priority,
+                    retry_after_seconds=ex.retry_after_seconds,
+                    logger=logger,
+                    outbox_entry_id=outbox_entry_id,
+                )
+                deferred_message = f"{ci}: {job} for {_type} {product} deferred, gangway is unavailable"
+                slack_digest.add(message=deferred_message, webhook_url=config_data.get("slack_webhook_url"))
+
+                return None
+
+            except Exception:
+                # The entry stays pending and is sent again once it is not claimed any more
+                release_trigger_claim(entry_id=outbox_entry_id)
+                raise
+
+            rc = openshift_ci_response.ok
+            res = openshift_ci_response.json() if rc else openshift_ci_response.text
+
+        elif jenkins_ci:
+            try:
+                rc, res = jenkins_trigger_job(
+                    job=job, config_data=config_data, logger=logger, operator_iib=operator_iib
+                )
+            except Exception:
+                release_trigger_claim(entry_id=outbox_entry_id)
+                raise
+
+        else:
+            raise ValueError(f"Unknown ci: {ci}")
 
     if not rc:
         msg = f"Failed to trigger {ci} job: {job} for addon {product}, "
@@ -57,6 +89,7 @@ def trigger_ci_job(
             msg += f"response: {openshift_ci_response.headers.get('grpc-message')}"
 
         logger.error(msg)
+        set_trigger_status(entry_id=outbox_entry_id, status=TRIGGER_STATUS_FAILED, error=msg)
         send_slack_message(
             message=msg,
             webhook_url=config_data.get("slack_errors_webhook_url"),
@@ -64,6 +97,15 @@ def trigger_ci_job(
         )
         raise AddonsWebhookTriggerError(msg=msg)
 
+    set_trigger_status(entry_id=outbox_entry_id, status=TRIGGER_STATUS_DONE)
+    if slack_digest.enabled:
+        digest_message = f"{ci}: {job} triggered for {_type} {product}: {res['id'] if openshift_ci else res['url']}"
+        if triggered_with:
+            digest_message += f"\n\t{triggered_with}"
+
+        slack_digest.add(message=digest_message, webhook_url=config_data.get("slack_webhook_url"))
+        return res
+
     if openshift_ci:
         openshift_ci_response = {dict_to_str(_dict=res)}
         status_info_command = f"""
@@ -86,11 +128,11 @@ Get the status of the job run:
 {status_info_command}
 
 """
-    if job_dict:
+    if triggered_with:
         message += f"""
 
 Triggered using data:
-    {operators_triggered_for_slack(job_dict=job_dict)}
+    {triggered_with}
 ```
 
 """
@@ -100,3 +142,38 @@ Triggered using data:
         logger=logger,
     )
     return res
+
+
+def drain_trigger_outbox(source, config_data, logger, loop_start=False):
+    # Called by the loop of the source on every cycle: the pending entries no sender claims were not sent
+    # (restart in the middle of a cycle, a cycle which failed or deferred triggers lost on restart).
+    # A source is only triggered by its loop, the claims left when it starts belong to its previous run
+    with TriggerOutbox() as trigger_outbox:
+        if loop_start:
+            trigger_outbox.release_claims(source=source)
+
+        trigger_outbox.prune(retention_seconds=TRIGGER_OUTBOX_RETENTION_SECONDS)
+        pending_entries = trigger_outbox.claim_pending(source=source)
+
+    if pending_entries:
+        logger.info(f"Sending {len(pending_entries)} {source} triggers which were not sent")
+
+    for entry in pending_entries:
+        try:
+            trigger_ci_job(
+                job=entry["job_name"],
+                ci=entry["ci"],
+                logger=logger,
+                config_data=config_data,
+                trigger_priority=entry["priority"],
+                outbox_entry_id=entry["id"],
+                **entry["payload"],
+            )
+        except AddonsWebhookTriggerError:
+            continue
+
+        except Exception as ex:
+            # The entry stays pending and is sent again by a later cycle
+            logger.error(f"Failed to send pending {source} trigger of {entry['job_name']}. error: {ex}")
+
+    return len(pending_entries)
@@ -1,12 +1,47 @@
+import os
+
 import pytest
+import requests
 from gitlab import Gitlab
+from gitlab.exceptions import GitlabAuthenticationError
 from gitlab.v4.objects import ProjectManager, ProjectMergeRequestManager
 
 from simple_logger.logger import get_logger
 
-from ci_jobs_trigger.libs.addons_webhook_trigger.addons_webhook_trigger import process_hook
+from ci_jobs_trigger.libs.addons_webhook_trigger import addons_webhook_trigger
+from ci_jobs_trigger.libs.addons_webhook_trigger.addons_webhook_trigger import (
+    ADDONS_WEBHOOK_JOBS_TRIGGER_CONFIG_STR,
+    HOOKS_QUEUE_MAX_ATTEMPTS,
+    MERGE_REQUEST_DIFFS_PER_PAGE,
+    AddonsWebhookConfigError,
+    InvalidHookDataError,
+    compile_addons_jobs_index,
+    drain_hooks_queue,
+    enqueue_hook,
+    get_addons_jobs,
+    get_addons_webhook_config,
+    get_changed_addons,
+    get_merge_request,
+    get_merge_request_changed_files,
+    process_hook,
+    process_next_queued_hook,
+    RepositoryNotFoundError,
+)
+from ci_jobs_trigger.libs.addons_webhook_trigger.hooks_queue import (
+    HOOK_STATUS_DONE,
+    HOOK_STATUS_FAILED,
+    HOOK_STATUS_PENDING,
+    AddonsHooksQueue,
+)
+from ci_jobs_trigger.utils import general as general_utils
+from ci_jobs_trigger.utils.circuit_breaker import CircuitOpenError
 
 LOGGER = get_logger("test_addons_webhook_trigger")
+ADDONS_WEBHOOK_TRIGGER_MODULE_PATH = "ci_jobs_trigger.libs.addons_webhook_trigger.addons_webhook_trigger"
+
+
+class MockNotFoundError(Exception):
+    response_code = 404
 
 
 class MockGitlabProjectManager:
@@ -19,7 +54,31 @@ class MockGitlabProjectManager:
         return {123456: MockProjectMergeRequestManager()}
 
 
+def merge_request_diff(new_path, old_path=None):
+    return {"new_path": new_path, "old_path": old_path or new_path}
+
+
+class MockGitlab:
+    def __init__(self, diffs):
+        self.diffs = diffs
+
+    def http_list(self, path, iterator, per_page):
+        return iter(self.diffs)
+
+
+class MockMergeRequestManager:
+    path = "/projects/1/merge_requests"
+
+    def __init__(self, diffs):
+        self.gitlab = MockGitlab(diffs=diffs)
+
+
 class MockProjectMergeRequestManager:
+    encoded_id = 123456
+    manager = MockMergeRequestManager(
+        diffs=[merge_request_diff(new_path="addons/addon/addonimagesets/stage/addon.yaml")]
+    )
+
     @property
     def iid(self):
         return "123456"
@@ -28,25 +87,52 @@ class MockProjectMergeRequestManager:
     def title(self):
         return "Merge request 123456"
 
-    @staticmethod
-    def changes():
-        return {
-            "changes": [
-                {
-                    "new_path": "addons/addon/addonimagesets/stage/addon.yaml",
-                }
-            ]
-        }
-
     @staticmethod
     def get():
         return MockProjectMergeRequestManager()
 
 
+class MockMultiAddonsMergeRequest(MockProjectMergeRequestManager):
+    manager = MockMergeRequestManager(
+        diffs=[
+            merge_request_diff(new_path="addons/addon/addonimagesets/stage/addon.v1.yaml"),
+            merge_request_diff(new_path="addons/addon/addonimagesets/stage/addon.v2.yaml"),
+            merge_request_diff(new_path="addons/other-addon/addonimagesets/stage/other-addon.yaml"),
+            merge_request_diff(new_path="addons/other-addon/metadata/stage/addon.yaml"),
+        ]
+    )
+
+
+class MockLargeMergeRequest(MockProjectMergeRequestManager):
+    manager = MockMergeRequestManager(
+        diffs=[
+            merge_request_diff(
+                new_path="addons/addon/addonimagesets/production/addon.yaml",
+                old_path="addons/addon/addonimagesets/stage/addon.yaml",
+            ),
+            merge_request_diff(new_path="README.md"),
+        ]
+    )
+
+
+@pytest.fixture(autouse=True)
+def clean_gitlab_clients():
+    general_utils.GITLAB_CLIENTS.clear()
+    yield
+    general_utils.GITLAB_CLIENTS.clear()
+
+
+@pytest.fixture(autouse=True)
+def clean_addons_jobs_index_cache():
+    addons_webhook_trigger.ADDONS_JOBS_INDEX_CACHE.clear()
+    yield
+    addons_webhook_trigger.ADDONS_JOBS_INDEX_CACHE.clear()
+
+
 @pytest.fixture
 def webhook_data():
     return {
-        "object_attributes": {"action": "merge", "iid": 123456},
+        "object_attributes": {"action": "merge", "iid": 123456, "merge_commit_sha": "abcdef"},
         "repository": {"name": "managed-tenants"},
         "project": {"id": 1},
     }
@@ -68,9 +154,10 @@ def config_dict(tmp_path_factory):
                 "products_jobs_mapping": {
                     "openshift-ci": {
                         "addon": {"stage": ["openshift-ci-job-name"]},
+                        "other-addon": {"stage": ["openshift-ci-job-name", "other-openshift-ci-job-name"]},
                     },
                     "jenkins": {
-                        "addon": {"stage": ["jenkins-job-name"]},
+                        "addon": {"production": ["jenkins-production-job-name"], "stage": ["jenkins-job-name"]},
                     },
                 },
             }
@@ -90,3 +177,280 @@ def test_process_hook(mocker, functions_mocker, webhook_data, config_dict, get_c
     get_config_mocker.return_value = config_dict
 
     process_hook(data=webhook_data, logger=LOGGER)
+
+
+def test_get_merge_request_reuse_gitlab_client(mocker, webhook_data, config_dict):
+    auth_mock = mocker.patch.object(Gitlab, "auth", return_value=True)
+    mocker.patch.object(ProjectManager, "get", return_value=MockGitlabProjectManager())
+    repository_data = config_dict["repositories"]["managed-tenants"]
+
+    for _ in range(2):
+        get_merge_request(
+            repository_data=repository_data,
+            object_attributes=webhook_data["object_attributes"],
+            project=webhook_data["project"]["id"],
+            logger=LOGGER,
+        )
+
+    assert len(general_utils.GITLAB_CLIENTS) == 1
+    auth_mock.assert_not_called()
+
+
+def test_get_merge_request_reauth_on_rejected_token(mocker, webhook_data, config_dict):
+    auth_mock = mocker.patch.object(Gitlab, "auth", return_value=True)
+    mocker.patch.object(
+        ProjectManager, "get", side_effect=[GitlabAuthenticationError("401 Unauthorized"), MockGitlabProjectManager()]
+    )
+
+    merge_request = get_merge_request(
+        repository_data=config_dict["repositories"]["managed-tenants"],
+        object_attributes=webhook_data["object_attributes"],
+        project=webhook_data["project"]["id"],
+        logger=LOGGER,
+    )
+
+    assert merge_request.iid == "123456"
+    auth_mock.assert_called_once()
+
+
+def test_get_addons_jobs_multiple_addons(config_dict):
+    changed_addons = get_changed_addons(
+        changed_files=get_merge_request_changed_files(merge_request=MockMultiAddonsMergeRequest())
+    )
+    assert changed_addons == {("addon", "stage"), ("other-addon", "stage")}
+
+    assert get_addons_jobs(
+        changed_addons=changed_addons,
+        repository_name="managed-tenants",
+        addons_jobs_index=compile_addons_jobs_index(config_data=config_dict, logger=LOGGER),
+    ) == {
+        "openshift-ci": {
+            "openshift-ci-job-name": ["addon", "other-addon"],
+            "other-openshift-ci-job-name": ["other-addon"],
+        },
+        "jenkins": {"jenkins-job-name": ["addon"]},
+    }
+
+
+def test_get_merge_request_changed_files_paginated(mocker):
+    http_list_spy = mocker.spy(MockLargeMergeRequest.manager.gitlab, "http_list")
+
+    # A moved file changes both its old and new paths
+    assert get_merge_request_changed_files(merge_request=MockLargeMergeRequest()) == {
+        "addons/addon/addonimagesets/production/addon.yaml",
+        "addons/addon/addonimagesets/stage/addon.yaml",
+        "README.md",
+    }
+    http_list_spy.assert_called_once_with(
+        "/projects/1/merge_requests/123456/diffs", iterator=True, per_page=MERGE_REQUEST_DIFFS_PER_PAGE
+    )
+
+
+def test_process_hook_multiple_addons(mocker, webhook_data, config_dict, get_config_mocker):
+    mocker.patch(f"{ADDONS_WEBHOOK_TRIGGER_MODULE_PATH}.get_merge_request", return_value=MockMultiAddonsMergeRequest())
+    trigger_ci_job_mock = mocker.patch(f"{ADDONS_WEBHOOK_TRIGGER_MODULE_PATH}.trigger_ci_job")
+    get_config_mocker.return_value = config_dict
+
+    assert not process_hook(data=webhook_data, logger=LOGGER)
+    assert sorted(_call.kwargs["job"] for _call in trigger_ci_job_mock.call_args_list) == [
+        "jenkins-job-name",
+        "openshift-ci-job-name",
+        "other-openshift-ci-job-name",
+    ]
+
+
+def test_get_addons_jobs_all_ocm_envs(config_dict):
+    assert get_addons_jobs(
+        changed_addons={("addon", "production"), ("addon", "stage")},
+        repository_name="managed-tenants",
+        addons_jobs_index=compile_addons_jobs_index(config_data=config_dict, logger=LOGGER),
+    ) == {
+        "openshift-ci": {"openshift-ci-job-name": ["addon"]},
+        "jenkins": {"jenkins-production-job-name": ["addon"], "jenkins-job-name": ["addon"]},
+    }
+
+
+@pytest.mark.parametrize(
+    "products_jobs_mapping",
+    [
+        pytest.param({"tekton": {"addon": {"stage": ["job"]}}}, id="unsupported_ci"),
+        pytest.param({"jenkins": {"addon": {"integration": ["job"]}}}, id="unsupported_ocm_env"),
+        pytest.param({"jenkins": {"addon": ["job"]}}, id="addon_without_ocm_env"),
+        pytest.param({"jenkins": {"addon": {"stage": "job"}}}, id="jobs_not_a_list"),
+    ],
+)
+def test_compile_addons_jobs_index_invalid_config(config_dict, products_jobs_mapping):
+    config_dict["repositories"]["other-tenants"] = {
+        **config_dict["repositories"]["managed-tenants"],
+        "products_jobs_mapping": products_jobs_mapping,
+    }
+
+    # Only the invalid repository is skipped
+    addons_jobs_index = compile_addons_jobs_index(config_data=config_dict, logger=LOGGER)
+    assert {_key[0] for _key in addons_jobs_index} == {"managed-tenants"}
+    assert [*config_dict["repositories"]] == ["managed-tenants"]
+
+
+def test_compile_addons_jobs_index_missing_repositories(config_dict):
+    config_dict["repositories"] = None
+
+    with pytest.raises(AddonsWebhookConfigError):
+        compile_addons_jobs_index(config_data=config_dict, logger=LOGGER)
+
+
+def test_get_addons_webhook_config_cached_until_modified(mocker, tmp_path, config_dict, get_config_mocker):
+    config_file = tmp_path / "config.yaml"
+    config_file.write_text("")
+    mocker.patch.dict("os.environ", {ADDONS_WEBHOOK_JOBS_TRIGGER_CONFIG_STR: str(config_file)})
+    get_config_mocker.return_value = config_dict
+
+    _, addons_jobs_index = get_addons_webhook_config(logger=LOGGER)
+    assert get_addons_webhook_config(logger=LOGGER)[1] is addons_jobs_index
+    get_config_mocker.assert_called_once()
+
+    config_file.write_text("# modified")
+    os.utime(config_file, ns=(0, 0))
+    get_addons_webhook_config(logger=LOGGER)
+    assert get_config_mocker.call_count == 2
+
+
+@pytest.fixture
+def hooks_queue_config_dict(tmp_path, config_dict, get_config_mocker):
+    config_dict["hooks_queue_db_path"] = str(tmp_path / "hooks_queue.db")
+    get_config_mocker.return_value = config_dict
+    return config_dict
+
+
+def get_hooks_status(queue_db_path):
+    with AddonsHooksQueue(queue_db_path=queue_db_path) as hooks_queue:
+        return [row[0] for row in hooks_queue.connection.execute("SELECT status FROM hooks ORDER BY id")]
+
+
+def test_enqueue_hook_deduplicate_redelivery(webhook_data, hooks_queue_config_dict):
+    assert enqueue_hook(data=webhook_data, logger=LOGGER)
+    assert not enqueue_hook(data=webhook_data, logger=LOGGER)
+
+    webhook_data["object_attributes"]["merge_commit_sha"] = "123456"
+    assert enqueue_hook(data=webhook_data, logger=LOGGER)
+    assert get_hooks_status(queue_db_path=hooks_queue_config_dict["hooks_queue_db_path"]) == ["pending", "pending"]
+
+
+def test_enqueue_hook_not_merged(webhook_data, hooks_queue_config_dict):
+    webhook_data["object_attributes"]["action"] = "open"
+
+    assert not enqueue_hook(data=webhook_data, logger=LOGGER)
+
+
+def test_enqueue_hook_invalid_payload(webhook_data, hooks_queue_config_dict):
+    webhook_data["object_attributes"].pop("merge_commit_sha")
+
+    with pytest.raises(InvalidHookDataError):
+        enqueue_hook(data=webhook_data, logger=LOGGER)
+
+
+def test_hooks_queue_reset_processing_hooks(tmp_path):
+    with AddonsHooksQueue(queue_db_path=tmp_path / "hooks_queue.db") as hooks_queue:
+        hooks_queue.enqueue(project=1, iid=1, merge_commit_sha="abcdef", payload={})
+        hook_id, _, _ = hooks_queue.claim()
+        assert hooks_queue.claim() is None
+
+        assert hooks_queue.reset_processing_hooks() == 1
+        assert hooks_queue.claim()[0] == hook_id
+
+
+@pytest.mark.parametrize(
+    "process_hook_side_effect, expected_status",
+    [
+        pytest.param(None, HOOK_STATUS_DONE, id="processed"),
+        pytest.param(RuntimeError("GitLab is down"), HOOK_STATUS_PENDING, id="transient_error_retried"),
+        pytest.param(
+            CircuitOpenError(dependency="gitlab", retry_after_seconds=60),
+            HOOK_STATUS_PENDING,
+            id="circuit_open_retried",
+        ),
+        pytest.param(RepositoryNotFoundError("not found"), HOOK_STATUS_FAILED, id="permanent_error_failed"),
+        pytest.param(MockNotFoundError(), HOOK_STATUS_FAILED, id="client_error_failed"),
+    ],
+)
+def test_process_next_queued_hook(
+    mocker, webhook_data, hooks_queue_config_dict, process_hook_side_effect, expected_status
+):
+    process_hook_mock = mocker.patch(
+        f"{ADDONS_WEBHOOK_TRIGGER_MODULE_PATH}.process_hook", return_value={}, side_effect=process_hook_side_effect
+    )
+    mocker.patch(f"{ADDONS_WEBHOOK_TRIGGER_MODULE_PATH}.process_webhook_exception")
+    enqueue_hook(data=webhook_data, logger=LOGGER)
+
+    queue_db_path = hooks_queue_config_dict["hooks_queue_db_path"]
+    with AddonsHooksQueue(queue_db_path=queue_db_path) as hooks_queue:
+        assert process_next_queued_hook(hooks_queue=hooks_queue, logger=LOGGER)
+        assert not process_next_queued_hook(hooks_queue=hooks_queue, logger=LOGGER)
+
+    process_hook_mock.assert_called_once_with(data=webhook_data, logger=LOGGER)
+    assert get_hooks_status(queue_db_path=queue_db_path) == [expected_status]
+
+
+def test_process_next_queued_hook_attempts_exhausted(mocker, webhook_data, hooks_queue_config_dict):
+    mocker.patch(f"{ADDONS_WEBHOOK_TRIGGER_MODULE_PATH}.HOOKS_QUEUE_RETRY_SECONDS", 0)
+    process_hook_mock = mocker.patch(
+        f"{ADDONS_WEBHOOK_TRIGGER_MODULE_PATH}.process_hook", side_effect=RuntimeError("GitLab is down")
+    )
+    process_webhook_exception_mock = mocker.patch(f"{ADDONS_WEBHOOK_TRIGGER_MODULE_PATH}.process_webhook_exception")
+    enqueue_hook(data=webhook_data, logger=LOGGER)
+
+    queue_db_path = hooks_queue_config_dict["hooks_queue_db_path"]
+    with AddonsHooksQueue(queue_db_path=queue_db_path) as hooks_queue:
+        while process_next_queued_hook(hooks_queue=hooks_queue, logger=LOGGER):
+            pass
+
+    assert process_hook_mock.call_count == HOOKS_QUEUE_MAX_ATTEMPTS
+    process_webhook_exception_mock.assert_called_once()
+    assert get_hooks_status(queue_db_path=queue_db_path) == [HOOK_STATUS_FAILED]
+
+
+def test_hooks_queue_retry_after(tmp_path):
+    with AddonsHooksQueue(queue_db_path=tmp_path / "hooks_queue.db") as hooks_queue:
+        hooks_queue.enqueue(project=1, iid=1, merge_commit_sha="abcdef", payload={})
+        hook_id, _, attempts = hooks_queue.claim()
+        hooks_queue.retry(hook_id=hook_id, error="GitLab is down", retry_after_seconds=60)
+        assert hooks_queue.claim() is None
+
+        hooks_queue.retry(hook_id=hook_id, error="GitLab is down", retry_after_seconds=0)
+        assert hooks_queue.claim() == (hook_id, {}, attempts + 1)
+
+
+def test_process_hook_again_triggers_only_missing_jobs(
+    mocker, functions_mocker, webhook_data, config_dict, get_config_mocker
+):
+    mocker.patch(f"{ADDONS_WEBHOOK_TRIGGER_MODULE_PATH}.get_merge_request", return_value=MockMultiAddonsMergeRequest())
+    jenkins_trigger_job_mock = mocker.patch(
+        "ci_jobs_trigger.libs.utils.general.jenkins_trigger_job",
+        side_effect=[RuntimeError("Jenkins is down"), (True, {"url": "url"})],
+    )
+    get_config_mocker.return_value = config_dict
+    # Mocked by functions_mocker
+    post_mock = requests.Session.post
+
+    with pytest.raises(RuntimeError):
+        process_hook(data=webhook_data, logger=LOGGER)
+
+    assert post_mock.call_count == 2
+
+    assert not process_hook(data=webhook_data, logger=LOGGER)
+    assert post_mock.call_count == 2
+    assert jenkins_trigger_job_mock.call_count == 2
+
+
+def test_drain_hooks_queue_records_heartbeat(mocker, tmp_path):
+    mocker.patch(
+        f"{ADDONS_WEBHOOK_TRIGGER_MODULE_PATH}.process_next_queued_hook",
+        side_effect=[True, RuntimeError("database is locked"), False],
+    )
+    record_loop_cycle_mock = mocker.patch(f"{ADDONS_WEBHOOK_TRIGGER_MODULE_PATH}.record_loop_cycle")
+    # Stops the worker on its second wait for a hook
+    hook_queued_event = mocker.Mock(wait=mocker.Mock(side_effect=[False, KeyboardInterrupt]))
+
+    with pytest.raises(KeyboardInterrupt):
+        drain_hooks_queue(queue_db_path=tmp_path / "queue.db", logger=LOGGER, hook_queued_event=hook_queued_event)
+
+    assert [_call.kwargs["failed"] for _call in record_loop_cycle_mock.call_args_list] == [False, True, False]
@@ -0,0 +1,49 @@
+import json
+import os
+import subprocess
+import sys
+
+import ci_jobs_trigger
+
+# Imported by the routes and loops which use them, never by the app module itself
+HEAVY_MODULES = (
+    "boto3",
+    "clouds",
+    "croniter",
+    "gitlab",
+    "jenkins",
+    "kubernetes",
+    "ocm_python_wrapper",
+    "ocp_utilities",
+    "rosa",
+    "xmltodict",
+)
+# Loose upper bound to catch a heavy module creeping back into the app import, not a benchmark
+APP_IMPORT_MAX_SECONDS = 5
+
+IMPORT_APP_SCRIPT = f"""
+import json
+import sys
+import time
+
+start_time = time.perf_counter()
+import ci_jobs_trigger.app
+
+print(json.dumps({{
+    "seconds": time.perf_counter() - start_time,
+    "heavy_modules": [module for module in {HEAVY_MODULES!r} if module in sys.modules],
+}}))
+"""
+
+
+def test_app_import_skips_heavy_modules():
+    root_dir = os.path.dirname(os.path.dirname(ci_jobs_trigger.__file__))
+    output = subprocess.check_output(
+        [sys.executable, "-c", IMPORT_APP_SCRIPT],
+        env={**os.environ, "PYTHONPATH": root_dir},
+        cwd=root_dir,
+    )
+    import_result = json.loads(output.decode().strip().splitlines()[-1])
+
+    assert not import_result["heavy_modules"]
+    assert import_result["seconds"] < APP_IMPORT_MAX_SECONDS
@@ -0,0 +1,49 @@
+import pytest
+
+from ci_jobs_trigger import app
+
+
+@pytest.fixture
+def cgroup_files(tmp_path, mocker, monkeypatch):
+    cgroup_files = {
+        "cpu_max": tmp_path / "cpu.max",
+        "cpu_quota": tmp_path / "cpu.cfs_quota_us",
+        "cpu_period": tmp_path / "cpu.cfs_period_us",
+    }
+    mocker.patch.object(app, "CGROUP_V2_CPU_MAX_FILE", str(cgroup_files["cpu_max"]))
+    mocker.patch.object(app, "CGROUP_V1_CPU_QUOTA_FILE", str(cgroup_files["cpu_quota"]))
+    mocker.patch.object(app, "CGROUP_V1_CPU_PERIOD_FILE", str(cgroup_files["cpu_period"]))
+    monkeypatch.delenv("CI_JOBS_TRIGGER_WORKERS", raising=False)
+    return cgroup_files
+
+
+@pytest.mark.parametrize(
+    "cpu_max, expected_workers",
+    [
+        pytest.param("max 100000", app.DEFAULT_WORKERS, id="no_cpu_limit"),
+        pytest.param("50000 100000", 3, id="half_cpu_limit"),
+        pytest.param("200000 100000", 5, id="two_cpus_limit"),
+    ],
+)
+def test_server_workers_from_cgroup_v2(cgroup_files, cpu_max, expected_workers):
+    cgroup_files["cpu_max"].write_text(cpu_max)
+
+    assert app.get_server_options(host="localhost", port=5000)["workers"] == expected_workers
+
+
+def test_server_workers_from_cgroup_v1(cgroup_files):
+    cgroup_files["cpu_quota"].write_text("300000\n")
+    cgroup_files["cpu_period"].write_text("100000\n")
+
+    assert app.get_server_options(host="localhost", port=5000)["workers"] == 7
+
+
+def test_server_workers_without_cgroup(cgroup_files):
+    assert app.get_server_options(host="localhost", port=5000)["workers"] == app.DEFAULT_WORKERS
+
+
+def test_server_workers_from_env(cgroup_files, monkeypatch):
+    cgroup_files["cpu_max"].write_text("200000 100000")
+    monkeypatch.setenv("CI_JOBS_TRIGGER_WORKERS", "1")
+
+    assert app.get_server_options(host="localhost", port=5000)["workers"] == 1
@@ -0,0 +1,100 @@
+import pytest
+import requests
+from simple_logger.logger import get_logger
+
+from ci_jobs_trigger.libs.openshift_ci.utils import general as openshift_ci_utils
+from ci_jobs_trigger.libs.utils.general import trigger_ci_job
+from ci_jobs_trigger.utils import circuit_breaker
+from ci_jobs_trigger.utils.circuit_breaker import (
+    CIRCUIT_CLOSED,
+    CIRCUIT_HALF_OPEN,
+    CIRCUIT_OPEN,
+    CircuitOpenError,
+    get_circuit_breaker,
+    guarded_dependency_call,
+)
+
+LOGGER = get_logger("test_circuit_breaker")
+
+
+class MockNotFoundError(Exception):
+    response_code = 404
+
+
+def failing_call(dependency, ex=None):
+    with pytest.raises(type(ex) if ex else requests.exceptions.ConnectionError):
+        with guarded_dependency_call(dependency=dependency, operation="test"):
+            raise ex or requests.exceptions.ConnectionError("connection refused")
+
+
+def test_circuit_breaker_opens_after_failures(open_circuit):
+    open_circuit(dependency="gangway")
+
+    assert get_circuit_breaker(dependency="gangway").state == CIRCUIT_OPEN
+    with pytest.raises(CircuitOpenError):
+        with guarded_dependency_call(dependency="gangway", operation="test"):
+            pytest.fail("Call must not be made while the circuit is open")
+
+
+def test_circuit_breaker_client_errors_not_counted():
+    for _ in range(get_circuit_breaker(dependency="gitlab").failure_threshold):
+        failing_call(dependency="gitlab", ex=MockNotFoundError())
+
+    assert get_circuit_breaker(dependency="gitlab").state == CIRCUIT_CLOSED
+
+
+def test_circuit_breaker_half_open_probe(mocker, open_circuit):
+    open_circuit(dependency="datagrepper")
+    _circuit_breaker = get_circuit_breaker(dependency="datagrepper")
+    mocker.patch.object(_circuit_breaker, "reset_timeout_seconds", 0)
+
+    with guarded_dependency_call(dependency="datagrepper", operation="test"):
+        assert _circuit_breaker.state == CIRCUIT_HALF_OPEN
+        # Only one probe is let through while half-open
+        with pytest.raises(CircuitOpenError):
+            with guarded_dependency_call(dependency="datagrepper", operation="test"):
+                pass
+
+    assert _circuit_breaker.state == CIRCUIT_CLOSED
+
+
+def test_circuit_breaker_failed_probe_reopens(mocker, open_circuit):
+    open_circuit(dependency="ocm")
+    mocker.patch.object(get_circuit_breaker(dependency="ocm"), "reset_timeout_seconds", 0)
+
+    failing_call(dependency="ocm")
+
+    assert get_circuit_breaker(dependency="ocm").state == CIRCUIT_OPEN
+
+
+def test_trigger_ci_job_deferred_while_gangway_unavailable(mocker, functions_mocker, open_circuit):
+    open_circuit(dependency="gangway")
+    # Mocked by functions_mocker
+    post_mock = requests.Session.post
+    mocker.patch.object(circuit_breaker, "CIRCUIT_PROBE_WAIT_SECONDS", 0)
+    mocker.patch.object(get_circuit_breaker(dependency="gangway"), "reset_timeout_seconds", 0.1)
+
+    res = trigger_ci_job(
+        job="job1",
+        product="product1",
+        _type="addon",
+        ci="openshift-ci",
+        logger=LOGGER,
+        config_data={"trigger_token": "token"},
+    )
+
+    assert res is None
+    post_mock.assert_not_called()
+    openshift_ci_utils.DEFERRED_TRIGGERS.get().triggers.join()
+    assert post_mock.call_count == 1
+    assert get_circuit_breaker(dependency="gangway").state == CIRCUIT_CLOSED
+
+
+def test_open_circuit_does_not_take_rate_limit_token(mocker, open_circuit):
+    open_circuit(dependency="gangway")
+    acquire_mock = mocker.patch("ci_jobs_trigger.utils.rate_limiter.TokenBucket.acquire")
+
+    with pytest.raises(CircuitOpenError):
+        openshift_ci_utils.openshift_ci_trigger_job(job_name="job1", trigger_token="token")
+
+    acquire_mock.assert_not_called()
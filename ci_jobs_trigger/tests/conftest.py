@@ -3,16 +3,61 @@ import pytest
 import requests
 
 from ci_jobs_trigger.tests.utils import MockJenkinsBuild, MockJenkinsJob, MockRequestPost
+from ci_jobs_trigger.utils import circuit_breaker
+from ci_jobs_trigger.utils.circuit_breaker import get_circuit_breaker, guarded_dependency_call
+from ci_jobs_trigger.utils.rate_limiter import GANGWAY_RATE_LIMIT_STATE_FILE_OS_ENV_STR
+from ci_jobs_trigger.utils.trigger_outbox import TRIGGER_OUTBOX_DB_PATH_OS_ENV_STR
+
+
+@pytest.fixture(autouse=True)
+def slack_notifier_mock(mocker):
+    return mocker.patch("ci_jobs_trigger.utils.general.get_slack_notifier")
+
+
+@pytest.fixture(autouse=True)
+def circuit_breakers_reset(mocker):
+    # Circuits opened by a test must not fail the calls of the next tests
+    mocker.patch.dict(circuit_breaker.CIRCUIT_BREAKERS.objects, clear=True)
+
+
+@pytest.fixture()
+def open_circuit():
+    # Fails as many calls of the dependency as it takes to open its circuit
+    def _open_circuit(dependency):
+        for _ in range(get_circuit_breaker(dependency=dependency).failure_threshold):
+            with pytest.raises(requests.exceptions.ConnectionError):
+                with guarded_dependency_call(dependency=dependency, operation="test"):
+                    raise requests.exceptions.ConnectionError("connection refused")
+
+    return _open_circuit
+
+
+@pytest.fixture(autouse=True)
+def gangway_rate_limit_state_file(mocker, tmp_path):
+    # Each test starts with a full bucket
+    mocker.patch.dict(
+        "os.environ", {GANGWAY_RATE_LIMIT_STATE_FILE_OS_ENV_STR: str(tmp_path / "gangway-rate-limit.json")}
+    )
+
+
+@pytest.fixture(autouse=True)
+def trigger_outbox_db_path(mocker, tmp_path):
+    # Each test starts with an empty trigger outbox
+    mocker.patch.dict("os.environ", {TRIGGER_OUTBOX_DB_PATH_OS_ENV_STR: str(tmp_path / "trigger-outbox.db")})
 
 
 @pytest.fixture()
 def functions_mocker(mocker):
-    mocker.patch.object(requests, "post", return_value=MockRequestPost())
+    mocker.patch.object(requests.Session, "post", return_value=MockRequestPost())
 
     mocker.patch.object(jenkins.Jenkins, "get_job_info", return_value=MockJenkinsJob())
     mocker.patch.object(jenkins.Jenkins, "job_exists", return_value=MockJenkinsJob())
     mocker.patch.object(jenkins.Jenkins, "build_job", return_value=MockJenkinsBuild())
 
+    mocker.patch(
+        "ci_jobs_trigger.libs.jenkins.utils.general.get_jenkins_job_info",
+        return_value=MockJenkinsJob.get_job_info(),
+    )
     mocker.patch("ci_jobs_trigger.libs.jenkins.utils.general.set_job_params", return_value={})
     mocker.patch(
         "ci_jobs_trigger.libs.jenkins.utils.general.wait_for_job_started_in_jenkins",
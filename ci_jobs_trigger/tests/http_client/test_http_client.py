@@ -0,0 +1,54 @@
+import requests
+from requests.adapters import HTTPAdapter
+
+from ci_jobs_trigger.utils import http_client, process_local
+from ci_jobs_trigger.utils.http_client import get_http_session
+
+
+def test_get_http_session_reused_per_dependency():
+    assert get_http_session(dependency="gangway") is get_http_session(dependency="gangway")
+    assert get_http_session(dependency="gangway") is not get_http_session(dependency="gcsweb")
+
+
+def test_get_http_session_new_session_after_fork(mocker):
+    session = get_http_session(dependency="gangway")
+    mocker.patch.object(process_local.os, "getpid", return_value=-1)
+
+    assert get_http_session(dependency="gangway") is not session
+
+
+def test_http_session_default_timeout(mocker):
+    send_mock = mocker.patch.object(HTTPAdapter, "send")
+    session = get_http_session(dependency="datagrepper")
+    adapter = session.get_adapter("https://datagrepper.example.com")
+    request = requests.Request("GET", "https://datagrepper.example.com/raw").prepare()
+
+    adapter.send(request)
+    adapter.send(request, timeout=1)
+
+    assert send_mock.call_args_list[0].kwargs["timeout"] == (http_client.HTTP_CONNECT_TIMEOUT_SECONDS, 120)
+    assert send_mock.call_args_list[1].kwargs["timeout"] == 1
+    assert not session.verify
+
+
+def test_http_session_retries_idempotent_requests_only():
+    retry = get_http_session(dependency="gangway").get_adapter("https://gangway.example.com").max_retries
+
+    assert retry.is_retry(method="GET", status_code=503)
+    assert not retry.is_retry(method="POST", status_code=503)
+    assert not retry.is_retry(method="GET", status_code=404)
+
+
+def test_http_session_dependency_overrides():
+    retry = get_http_session(dependency="slack").get_adapter("https://hooks.slack.com").max_retries
+
+    assert not retry.is_retry(method="GET", status_code=429)
+    assert get_http_session(dependency="otlp").get_adapter("http://collector:4318").max_retries.total == 0
+
+
+def test_jitter_retry_backoff_time():
+    retry = http_client.JitterRetry(total=5, backoff_factor=1)
+    for _ in range(4):
+        retry = retry.increment(method="GET", url="/", error=requests.exceptions.ConnectionError())
+
+    assert 0 <= retry.get_backoff_time() <= 8
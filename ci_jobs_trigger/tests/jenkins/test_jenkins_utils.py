@@ -0,0 +1,140 @@
+import json
+import os
+
+import pytest
+from simple_logger.logger import get_logger
+
+from ci_jobs_trigger.libs.jenkins.utils import general as jenkins_utils
+from ci_jobs_trigger.libs.jenkins.utils.general import (
+    get_jenkins_api,
+    get_jenkins_job_url,
+    jenkins_trigger_job,
+    wait_for_job_started_in_jenkins,
+)
+
+LOGGER = get_logger("test_jenkins_utils")
+
+
+@pytest.fixture(autouse=True)
+def clean_jenkins_clients():
+    jenkins_utils.JENKINS_CLIENTS.clear()
+    jenkins_utils.JENKINS_JOB_PARAMETERS_CACHE.clear()
+    yield
+    jenkins_utils.JENKINS_CLIENTS.clear()
+    jenkins_utils.JENKINS_JOB_PARAMETERS_CACHE.clear()
+
+
+@pytest.fixture()
+def config_dict():
+    return {
+        "jenkins_token": "token",
+        "jenkins_username": "user",
+        "jenkins_url": "https://jenkins",
+    }
+
+
+def test_get_jenkins_api_cached():
+    api = get_jenkins_api(url="https://jenkins", username="user", password="token")
+
+    assert get_jenkins_api(url="https://jenkins", username="user", password="token") is api
+    assert get_jenkins_api(url="https://jenkins", username="other-user", password="token") is not api
+    assert get_jenkins_api(url="https://jenkins", username="user", password="new-token") is not api
+    assert not api._session.verify
+
+
+@pytest.mark.parametrize(
+    "job, expected",
+    [
+        pytest.param("jenkins-job-name", "https://jenkins/job/jenkins-job-name/", id="job"),
+        pytest.param("folder/jenkins job", "https://jenkins/job/folder/job/jenkins%20job/", id="job_in_folder"),
+    ],
+)
+def test_get_jenkins_job_url(job, expected):
+    api = get_jenkins_api(url="https://jenkins", username="user", password="token")
+
+    assert get_jenkins_job_url(api=api, job=job) == expected
+
+
+def test_jenkins_trigger_job_reuse_client(mocker, functions_mocker, config_dict):
+    jenkins_mock = mocker.patch.object(jenkins_utils.jenkins, "Jenkins", wraps=jenkins_utils.jenkins.Jenkins)
+    pythonhttpsverify = os.environ.get("PYTHONHTTPSVERIFY")
+
+    for _ in range(3):
+        assert jenkins_trigger_job(job="jenkins-job-name", config_data=config_dict, logger=LOGGER)[0]
+
+    assert jenkins_mock.call_count == 1
+    assert os.environ.get("PYTHONHTTPSVERIFY") == pythonhttpsverify
+
+
+def test_jenkins_trigger_job_single_job_info_request(mocker, config_dict):
+    job_info = {
+        "property": [
+            {},
+            {
+                "parameterDefinitions": [
+                    {"defaultParameterValue": {"name": "INSTALL_FROM_IIB", "value": False}},
+                    {"defaultParameterValue": {"name": "OTHER_PARAM", "value": "value"}},
+                ]
+            },
+        ],
+    }
+    jenkins_open_mock = mocker.patch.object(
+        jenkins_utils.jenkins.Jenkins, "jenkins_open", return_value=json.dumps(job_info)
+    )
+    build_job_mock = mocker.patch.object(jenkins_utils.jenkins.Jenkins, "build_job", return_value=25)
+    wait_mock = mocker.patch(
+        "ci_jobs_trigger.libs.jenkins.utils.general.wait_for_job_started_in_jenkins",
+        return_value=(True, {"url": "url"}),
+    )
+
+    for _ in range(2):
+        jenkins_trigger_job(job="jenkins-job-name", config_data=config_dict, logger=LOGGER, operator_iib=True)
+
+    # Parameter definitions are cached, the second trigger does not fetch the job info
+    assert jenkins_open_mock.call_count == 1
+    assert "parameterDefinitions" in jenkins_open_mock.call_args.args[0].url
+    assert build_job_mock.call_args.kwargs["parameters"] == {"INSTALL_FROM_IIB": True, "OTHER_PARAM": "value"}
+    assert wait_mock.call_args.kwargs["queue_item_number"] == 25
+
+
+def test_jenkins_trigger_job_not_found(mocker, config_dict):
+    mocker.patch.object(
+        jenkins_utils.jenkins.Jenkins, "jenkins_open", side_effect=jenkins_utils.jenkins.NotFoundException
+    )
+
+    assert jenkins_trigger_job(job="missing-job-name", config_data=config_dict, logger=LOGGER) == (False, None)
+
+
+@pytest.mark.parametrize(
+    "queue_items, expected",
+    [
+        pytest.param(
+            [{"why": "Waiting for next available executor"}, {"executable": {"number": 11, "url": "url"}}],
+            (True, {"number": 11, "url": "url"}),
+            id="started",
+        ),
+        pytest.param([{"why": "Waiting"}, {"cancelled": True}], (False, None), id="cancelled"),
+    ],
+)
+def test_wait_for_job_started_in_jenkins(mocker, queue_items, expected):
+    sleep_mock = mocker.patch.object(jenkins_utils.time, "sleep")
+    api = get_jenkins_api(url="https://jenkins", username="user", password="token")
+    get_queue_item_mock = mocker.patch.object(api, "get_queue_item", side_effect=queue_items)
+
+    assert (
+        wait_for_job_started_in_jenkins(
+            api=api, job="jenkins-job-name", queue_item_number=25, logger=LOGGER, timeout=60
+        )
+        == expected
+    )
+    get_queue_item_mock.assert_called_with(number=25)
+    sleep_mock.assert_called_once()
+
+
+def test_wait_for_job_started_in_jenkins_timeout(mocker):
+    api = get_jenkins_api(url="https://jenkins", username="user", password="token")
+    mocker.patch.object(api, "get_queue_item", return_value={"why": "Waiting for next available executor"})
+
+    assert wait_for_job_started_in_jenkins(
+        api=api, job="jenkins-job-name", queue_item_number=25, logger=LOGGER, timeout=0
+    ) == (False, None)
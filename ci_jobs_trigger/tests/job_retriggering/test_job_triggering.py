@@ -5,7 +5,9 @@ from simple_logger.logger import get_logger
 
 import xmltodict
 
+from ci_jobs_trigger.libs.openshift_ci.re_trigger.job_db import DB
 from ci_jobs_trigger.libs.openshift_ci.re_trigger.re_trigger import JobTriggering
+from ci_jobs_trigger.utils.circuit_breaker import CircuitOpenError
 
 LOGGER = get_logger(name=__name__)
 
@@ -96,3 +98,20 @@ class TestJobTriggering:
         hook_data_dict["prow_job_id"] = TestJobTriggering.PROW_JOB_ID
         job_triggering = JobTriggering(hook_data=hook_data_dict, logger=LOGGER)
         assert not job_triggering.execute_trigger(db_filepath), "Job should not be triggered"
+
+    def test_trigger_job_deferred_while_gangway_unavailable(self, mocker, tmp_path, job_triggering):
+        re_trigger_module_path = "ci_jobs_trigger.libs.openshift_ci.re_trigger.re_trigger"
+        mocker.patch(
+            f"{re_trigger_module_path}.openshift_ci_trigger_job",
+            side_effect=CircuitOpenError(dependency="gangway", retry_after_seconds=60),
+        )
+        defer_mock = mocker.patch(f"{re_trigger_module_path}.defer_openshift_ci_trigger_job")
+        job_db_path = tmp_path / "job_re_triggering.db"
+
+        assert job_triggering._trigger_job(job_db_path=job_db_path) is None
+        # The re-triggered job is saved once the deferred trigger succeeded
+        defer_mock.call_args.kwargs["on_triggered"](TestJobTriggering.PROW_JOB_ID)
+        with DB(job_db_path=job_db_path) as database:
+            assert database.check_prow_job_id_in_db(
+                job_name=job_triggering.job_name, prow_job_id=TestJobTriggering.PROW_JOB_ID
+            )
@@ -0,0 +1,105 @@
+import time
+
+import pytest
+from simple_logger.logger import get_logger
+
+from ci_jobs_trigger.utils import loop_supervisor
+from ci_jobs_trigger.utils.loop_supervisor import (
+    LOOPS_STATE_DIR_OS_ENV_STR,
+    LoopSupervisor,
+    get_loops_state,
+    record_loop_cycle,
+)
+
+LOGGER = get_logger("test_loop_supervisor")
+
+
+def crashing_loop():
+    raise RuntimeError("loop crashed")
+
+
+def sleeping_loop():
+    time.sleep(60)
+
+
+def stopping_loop():
+    return
+
+
+@pytest.fixture(autouse=True)
+def loops_state_dir(mocker, tmp_path):
+    mocker.patch.dict("os.environ", {LOOPS_STATE_DIR_OS_ENV_STR: str(tmp_path)})
+
+
+@pytest.fixture
+def supervisor():
+    _supervisor = LoopSupervisor(targets={crashing_loop: {}, sleeping_loop: {}}, logger=LOGGER)
+    yield _supervisor
+    for loop in _supervisor.loops.values():
+        if loop["process"] and loop["process"].is_alive():
+            loop["process"].kill()
+
+
+def test_loop_supervisor_restart_crashed_loop(mocker, supervisor):
+    get_backoff_seconds_mock = mocker.patch.object(loop_supervisor, "get_backoff_seconds", return_value=0)
+    supervisor.check_loops()
+    supervisor.loops["crashing_loop"]["process"].join(timeout=10)
+
+    supervisor.check_loops()
+
+    get_backoff_seconds_mock.assert_called_once_with(
+        failures=1,
+        base_seconds=loop_supervisor.LOOP_RESTART_BASE_SECONDS,
+        max_seconds=loop_supervisor.LOOP_RESTART_MAX_SECONDS,
+    )
+    loops_state = get_loops_state()["loops"]
+    assert loops_state["crashing_loop"]["restarts"] == 1
+    assert loops_state["crashing_loop"]["last_exit_code"] == 1
+    assert loops_state["sleeping_loop"]["alive"]
+    assert loops_state["sleeping_loop"]["restarts"] == 0
+
+
+def test_loop_supervisor_restart_backoff(mocker, supervisor):
+    mocker.patch.object(loop_supervisor, "get_backoff_seconds", return_value=60)
+    supervisor.check_loops()
+    crashed_process = supervisor.loops["crashing_loop"]["process"]
+    crashed_process.join(timeout=10)
+
+    supervisor.check_loops()
+
+    assert supervisor.loops["crashing_loop"]["process"] is None
+    assert not get_loops_state()["loops"]["crashing_loop"]["alive"]
+
+
+def test_loop_supervisor_does_not_restart_stopped_loop():
+    _supervisor = LoopSupervisor(targets={stopping_loop: {}}, logger=LOGGER)
+    _supervisor.check_loops()
+    _supervisor.loops["stopping_loop"]["process"].join(timeout=10)
+
+    _supervisor.check_loops()
+    _supervisor.check_loops()
+
+    loops_state = get_loops_state()["loops"]
+    assert loops_state["stopping_loop"]["stopped"]
+    assert loops_state["stopping_loop"]["restarts"] == 0
+    assert not loops_state["stopping_loop"]["alive"]
+
+
+def test_get_loops_state_loop_cycle(supervisor):
+    supervisor.write_state()
+    record_loop_cycle(loop_name="sleeping_loop", cycle_seconds=1.5, logger=LOGGER, next_run_seconds=60)
+
+    sleeping_loop_cycle = get_loops_state()["loops"]["sleeping_loop"]["cycle"]
+    assert sleeping_loop_cycle["last_cycle_seconds"] == 1.5
+    assert not sleeping_loop_cycle["last_cycle_failed"]
+    assert sleeping_loop_cycle["next_run_at"] > sleeping_loop_cycle["heartbeat"]
+
+
+def test_loop_supervisor_dotted_path_target():
+    _supervisor = LoopSupervisor(targets={f"{__name__}:sleeping_loop": {}}, logger=LOGGER)
+    try:
+        _supervisor.check_loops()
+
+        assert get_loops_state()["loops"]["sleeping_loop"]["alive"]
+    finally:
+        _supervisor.loops["sleeping_loop"]["process"].kill()
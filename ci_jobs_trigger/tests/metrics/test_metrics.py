@@ -0,0 +1,63 @@
+import pytest
+import requests
+from prometheus_client import REGISTRY
+
+from ci_jobs_trigger.app import APP
+from ci_jobs_trigger.libs.openshift_ci.utils.general import openshift_ci_trigger_job
+from ci_jobs_trigger.tests.utils import MockRequestPost
+from ci_jobs_trigger.utils.metrics import track_cycle, track_dependency_call
+
+
+def get_sample_value(name, labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_track_dependency_call_errors():
+    labels = {"dependency": "test-dependency", "operation": "call"}
+    errors = get_sample_value(name="ci_jobs_trigger_dependency_call_errors_total", labels=labels)
+    calls = get_sample_value(name="ci_jobs_trigger_dependency_call_seconds_count", labels=labels)
+
+    with track_dependency_call(**labels):
+        pass
+
+    with track_dependency_call(**labels) as dependency_call:
+        dependency_call.failed = True
+
+    with pytest.raises(ValueError):
+        with track_dependency_call(**labels):
+            raise ValueError("failed call")
+
+    assert get_sample_value(name="ci_jobs_trigger_dependency_call_seconds_count", labels=labels) == calls + 3
+    assert get_sample_value(name="ci_jobs_trigger_dependency_call_errors_total", labels=labels) == errors + 2
+    assert not get_sample_value(
+        name="ci_jobs_trigger_dependency_calls_in_flight", labels={"dependency": "test-dependency"}
+    )
+
+
+def test_track_cycle_errors():
+    errors = get_sample_value(name="ci_jobs_trigger_cycle_errors_total", labels={"cycle": "test-cycle"})
+
+    with pytest.raises(ValueError):
+        with track_cycle(cycle="test-cycle"):
+            raise ValueError("failed cycle")
+
+    assert get_sample_value(name="ci_jobs_trigger_cycle_errors_total", labels={"cycle": "test-cycle"}) == errors + 1
+
+
+def test_openshift_ci_trigger_job_metrics(mocker):
+    mocker.patch.object(requests.Session, "post", return_value=MockRequestPost())
+    labels = {"dependency": "gangway", "operation": "trigger"}
+    calls = get_sample_value(name="ci_jobs_trigger_dependency_call_seconds_count", labels=labels)
+
+    openshift_ci_trigger_job(job_name="job", trigger_token="token")
+
+    assert get_sample_value(name="ci_jobs_trigger_dependency_call_seconds_count", labels=labels) == calls + 1
+
+
+def test_metrics_route():
+    client = APP.test_client()
+    client.get("/healthcheck")
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert 'ci_jobs_trigger_route_request_seconds_count{route="/healthcheck",status="200"}' in response.text
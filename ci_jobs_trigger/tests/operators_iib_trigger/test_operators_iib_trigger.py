@@ -1,17 +1,41 @@
+import io
+import json
+import multiprocessing
 import tempfile
 
+import boto3
 import pytest
 import requests
+from botocore.exceptions import EndpointConnectionError
+from moto import mock_aws
 from simple_logger.logger import get_logger
 
+from ci_jobs_trigger.libs.operators_iib_trigger import iib_trigger
+from ci_jobs_trigger.libs.operators_iib_trigger.iib_state import (
+    IIB_STATE_FORMAT_VERSION,
+    IIBState,
+    IIBStateFormatError,
+    load_iib_state,
+)
 from ci_jobs_trigger.libs.operators_iib_trigger.iib_trigger import (
     fetch_update_iib_and_trigger_jobs,
     upload_download_s3_bucket_file,
     verify_s3_or_local_file,
     get_new_iib,
+    get_iib_trigger_plan,
+    dispatch_iib_trigger_plan,
+    run_iib_update,
+    wait_for_next_run,
+    IIBChange,
+    IIBJobTrigger,
 )
+from ci_jobs_trigger.utils.general import AddonsWebhookTriggerError, SlackDigest, get_next_run_seconds
 
 LOGGER = get_logger("test_operators_iib_trigger")
+IIB_TRIGGER_MODULE_PATH = "ci_jobs_trigger.libs.operators_iib_trigger.iib_trigger"
+S3_BUCKET = "operators-iib-test-bucket"
+S3_KEY = "operators_latest_iib.json"
+S3_BUCKET_FILE_FULL_PATH = f"{S3_BUCKET}/{S3_KEY}"
 
 
 class MockRequestGet:
@@ -33,12 +57,28 @@ class MockRequestGet:
 
 class MockS3Client:
     @staticmethod
-    def download_file(Filename, Bucket, Key):  # noqa N803
-        return True
+    def get_object(Bucket, Key, **kwargs):  # noqa N803
+        return {"Body": io.BytesIO(b"{}"), "ETag": '"etag"'}
 
     @staticmethod
-    def upload_file(Filename, Bucket, Key):  # noqa N803
-        return True
+    def put_object(Bucket, Key, Body, **kwargs):  # noqa N803
+        return {"ETag": '"etag"'}
+
+
+class CountingS3Client:
+    def __init__(self, client):
+        self.client = client
+        self.transfers = []
+
+    def get_object(self, **kwargs):
+        response = self.client.get_object(**kwargs)
+        self.transfers.append("download")
+        return response
+
+    def put_object(self, **kwargs):
+        response = self.client.put_object(**kwargs)
+        self.transfers.append("upload")
+        return response
 
 
 @pytest.fixture()
@@ -97,8 +137,37 @@ def s3_client_mock(mocker):
     return client_mock()
 
 
+@pytest.fixture(autouse=True)
+def clean_s3_objects_state():
+    iib_trigger.S3_OBJECTS_STATE.clear()
+    yield
+    iib_trigger.S3_OBJECTS_STATE.clear()
+
+
+@pytest.fixture()
+def moto_s3_client(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    with mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=S3_BUCKET)
+        yield client
+
+
+def s3_sync_iib_file(action, filename, boto_s3_client):
+    return upload_download_s3_bucket_file(
+        action=action,
+        filename=filename,
+        s3_bucket_file_full_path=S3_BUCKET_FILE_FULL_PATH,
+        region="us-east-1",
+        logger=LOGGER,
+        boto_s3_client=boto_s3_client,
+        slack_errors_webhook_url=None,
+    )
+
+
 def test_fetch_update_iib_and_trigger_jobs_no_ci_jobs_config(mocker, functions_mocker, config_dict_no_ci_jobs):
-    mocker.patch.object(requests, "get", return_value=MockRequestGet())
+    mocker.patch.object(requests.Session, "get", return_value=MockRequestGet())
     assert not fetch_update_iib_and_trigger_jobs(
         config_dict=config_dict_no_ci_jobs,
         logger=LOGGER,
@@ -107,10 +176,19 @@ def test_fetch_update_iib_and_trigger_jobs_no_ci_jobs_config(mocker, functions_m
 
 
 def test_fetch_update_iib_and_trigger_jobs(mocker, functions_mocker, config_dict):
-    mocker.patch.object(requests, "get", return_value=MockRequestGet())
+    mocker.patch.object(requests.Session, "get", return_value=MockRequestGet())
     fetch_update_iib_and_trigger_jobs(config_dict=config_dict, logger=LOGGER, tmp_dir=tempfile.mkdtemp(dir="/tmp"))
 
 
+def test_fetch_update_iib_and_trigger_jobs_trigger_plan(mocker, functions_mocker, config_dict):
+    mocker.patch.object(requests.Session, "get", return_value=MockRequestGet())
+    mocker.patch(f"{IIB_TRIGGER_MODULE_PATH}.get_config", return_value=config_dict)
+    iib_trigger_result = fetch_update_iib_and_trigger_jobs(logger=LOGGER, tmp_dir=tempfile.mkdtemp(dir="/tmp"))
+
+    assert [*iib_trigger_result["trigger_plan"]] == ["openshift-ci-job-name"]
+    assert not iib_trigger_result["failed_triggered_jobs"]
+
+
 def test_both_s3_and_local_file_configs():
     assert not verify_s3_or_local_file(
         s3_bucket_operators_latest_iib_path="s3_bucket_operators_latest_iib",
@@ -132,10 +210,10 @@ def test_invalid_upload_download_s3_action():
         )
 
 
-def test_download_file_from_s3_bucket(s3_client_mock):
+def test_download_file_from_s3_bucket(s3_client_mock, tmp_path):
     assert upload_download_s3_bucket_file(
         action="download",
-        filename="test",
+        filename=tmp_path / "test",
         s3_bucket_file_full_path="non-existing-bucket/test",
         region=None,
         logger=LOGGER,
@@ -145,7 +223,7 @@ def test_download_file_from_s3_bucket(s3_client_mock):
 
 
 def test_upload_missing_file_from_s3_bucket(s3_client_mock):
-    upload_download_s3_bucket_file(
+    assert not upload_download_s3_bucket_file(
         action="upload",
         filename="test",
         s3_bucket_file_full_path="non-existing-bucket/test",
@@ -156,16 +234,250 @@ def test_upload_missing_file_from_s3_bucket(s3_client_mock):
     )
 
 
-def test_get_new_iib(mocker, tmp_path, get_new_iib_config_dict):
-    mocker.patch.object(requests, "get", return_value=MockRequestGet())
-    new_data = get_new_iib(config_data=get_new_iib_config_dict, logger=LOGGER)
-    expected_data = {
-        "v4.15": {
-            "openshift-ci-job-name": {
-                "operators": {"operator": {"new-iib": True, "iib": "iib:quay.io/iib:690654"}},
-                "ci": "openshift-ci",
-            }
-        },
-        "v4.16": {"jenkins-job-name": {"operators": {"operator": {"new-iib": False}}, "ci": "jenkins"}},
+def test_get_new_iib(mocker, get_new_iib_config_dict):
+    mocker.patch.object(requests.Session, "get", return_value=MockRequestGet())
+    iib_update = get_new_iib(config_data=get_new_iib_config_dict, logger=LOGGER)
+    assert iib_update.iib_changes == [
+        IIBChange(
+            ocp_version="v4.15",
+            job_name="openshift-ci-job-name",
+            ci="openshift-ci",
+            operator="operator",
+            old_iib=None,
+            new_iib="iib:quay.io/iib:690654",
+        )
+    ]
+    iib_state = load_iib_state(path=get_new_iib_config_dict["local_operators_latest_iib_filepath"])
+    assert (
+        iib_state.get_iib(ocp_version="v4.15", job_name="openshift-ci-job-name", operator="operator")
+        == "iib:quay.io/iib:690654"
+    )
+    assert not iib_state.versions.get("v4.16")
+
+    assert [*iib_update.trigger_plan] == [*iib_update.outbox_entries] == ["openshift-ci-job-name"]
+
+    # A second run with the same IIB data must not produce any change
+    assert not get_new_iib(config_data=get_new_iib_config_dict, logger=LOGGER).iib_changes
+
+
+def test_iib_state_legacy_format():
+    iib_state = IIBState.from_dict(
+        data={
+            "v4.15": {
+                "openshift-ci-job-name": {
+                    "operators": {
+                        "operator": {"new-iib": True, "iib": "iib:quay.io/iib:690654"},
+                        "not-built-operator": {"triggered": False},
+                    },
+                    "ci": "openshift-ci",
+                }
+            },
+        }
+    )
+
+    assert (
+        iib_state.get_iib(ocp_version="v4.15", job_name="openshift-ci-job-name", operator="operator")
+        == "iib:quay.io/iib:690654"
+    )
+    assert not iib_state.get_iib(ocp_version="v4.15", job_name="openshift-ci-job-name", operator="not-built-operator")
+
+
+def test_iib_state_compact_format_round_trip():
+    iib_state = IIBState()
+    for ocp_version, job_name, ci in [
+        ("v4.15", "openshift-ci-job-name", "openshift-ci"),
+        ("v4.16", "jenkins-job-name", "jenkins"),
+    ]:
+        for operator in ("operator", "other-operator"):
+            iib_state.set_iib(
+                ocp_version=ocp_version, job_name=job_name, ci=ci, operator=operator, iib=f"iib:{job_name}-{operator}"
+            )
+
+    iib_state_dict = iib_state.to_dict()
+    assert iib_state_dict["format_version"] == IIB_STATE_FORMAT_VERSION
+    assert iib_state_dict["operators"] == ["operator", "other-operator"]
+
+    loaded_iib_state = IIBState.from_dict(data=json.loads(json.dumps(iib_state_dict)))
+    assert loaded_iib_state.to_dict() == iib_state_dict
+    assert loaded_iib_state.versions["v4.16"]["jenkins-job-name"].ci == "jenkins"
+
+
+def test_iib_state_unsupported_format_version():
+    with pytest.raises(IIBStateFormatError):
+        IIBState.from_dict(data={"format_version": IIB_STATE_FORMAT_VERSION + 1})
+
+
+def test_get_iib_trigger_plan(config_dict):
+    iib_change = IIBChange(
+        ocp_version="v4.15",
+        job_name="openshift-ci-job-name",
+        ci="openshift-ci",
+        operator="operator",
+        old_iib="iib:quay.io/iib:690653",
+        new_iib="iib:quay.io/iib:690654",
+    )
+    removed_job_iib_change = iib_change._replace(job_name="removed-job-name")
+
+    assert get_iib_trigger_plan(ci_jobs=config_dict["ci_jobs"], iib_changes=[iib_change, removed_job_iib_change]) == {
+        "openshift-ci-job-name": IIBJobTrigger(
+            job_name="openshift-ci-job-name", ci="openshift-ci", iib_changes=[iib_change]
+        ),
+    }
+
+
+def test_dispatch_iib_trigger_plan(mocker, config_dict):
+    def _trigger_ci_job(job, **kwargs):
+        if job.startswith("failed"):
+            raise AddonsWebhookTriggerError(msg=f"Failed to trigger {job}")
+
+    trigger_ci_job_mock = mocker.patch(f"{IIB_TRIGGER_MODULE_PATH}.trigger_ci_job", side_effect=_trigger_ci_job)
+    trigger_plan = {
+        job_name: IIBJobTrigger(job_name=job_name, ci=ci, iib_changes=[])
+        for job_name, ci in [
+            ("openshift-ci-job-name", "openshift-ci"),
+            ("failed-openshift-ci-job-name", "openshift-ci"),
+            ("jenkins-job-name", "jenkins"),
+            ("failed-jenkins-job-name", "jenkins"),
+        ]
     }
-    assert new_data == expected_data
+    config_dict["max_parallel_triggers"] = {"jenkins": 2}
+
+    assert dispatch_iib_trigger_plan(trigger_plan=trigger_plan, config_data=config_dict, logger=LOGGER) == {
+        "openshift-ci": ["failed-openshift-ci-job-name"],
+        "jenkins": ["failed-jenkins-job-name"],
+    }
+    assert trigger_ci_job_mock.call_count == 4
+
+
+def test_iib_job_trigger_slack_summary(mocker, functions_mocker, config_dict):
+    send_slack_message_mock = mocker.patch("ci_jobs_trigger.libs.utils.general.send_slack_message")
+    iib_change = IIBChange(
+        ocp_version="v4.15",
+        job_name="openshift-ci-job-name",
+        ci="openshift-ci",
+        operator="operator",
+        old_iib=None,
+        new_iib="iib:quay.io/iib:690654",
+    )
+    trigger_plan = {
+        "openshift-ci-job-name": IIBJobTrigger(
+            job_name="openshift-ci-job-name", ci="openshift-ci", iib_changes=[iib_change]
+        )
+    }
+
+    assert not dispatch_iib_trigger_plan(trigger_plan=trigger_plan, config_data=config_dict, logger=LOGGER)
+    assert "operator: iib:quay.io/iib:690654" in send_slack_message_mock.call_args.kwargs["message"]
+
+
+def test_iib_job_trigger_slack_digest(mocker, functions_mocker, config_dict):
+    send_slack_message_mock = mocker.patch("ci_jobs_trigger.utils.general.send_slack_message")
+    trigger_plan = {
+        job_name: IIBJobTrigger(job_name=job_name, ci=ci, iib_changes=[])
+        for job_name, ci in [("openshift-ci-job-name", "openshift-ci"), ("jenkins-job-name", "jenkins")]
+    }
+    config_dict.update({"slack_digest": True, "slack_webhook_url": "https://slack"})
+
+    with SlackDigest(title="IIB", logger=LOGGER) as slack_digest:
+        dispatch_iib_trigger_plan(
+            trigger_plan=trigger_plan, config_data=config_dict, logger=LOGGER, slack_digest=slack_digest
+        )
+        send_slack_message_mock.assert_not_called()
+
+    send_slack_message_mock.assert_called_once()
+    assert "(2 events)" in send_slack_message_mock.call_args.kwargs["message"]
+
+
+def test_s3_sync_skips_unchanged_transfers(moto_s3_client, tmp_path):
+    iib_file = tmp_path / "operators_latest_iib.json"
+    counting_client = CountingS3Client(client=moto_s3_client)
+
+    # First download of a missing object must not fail the cycle
+    assert s3_sync_iib_file(action="download", filename=iib_file, boto_s3_client=counting_client)
+    iib_file.write_text(json.dumps({"v4.15": {}}))
+    assert s3_sync_iib_file(action="upload", filename=iib_file, boto_s3_client=counting_client)
+    assert s3_sync_iib_file(action="download", filename=iib_file, boto_s3_client=counting_client)
+    assert s3_sync_iib_file(action="upload", filename=iib_file, boto_s3_client=counting_client)
+
+    assert counting_client.transfers == ["upload"]
+
+
+def test_s3_sync_download_modified_object(moto_s3_client, tmp_path):
+    iib_file = tmp_path / "operators_latest_iib.json"
+    moto_s3_client.put_object(Bucket=S3_BUCKET, Key=S3_KEY, Body=b"{}")
+    assert s3_sync_iib_file(action="download", filename=iib_file, boto_s3_client=moto_s3_client)
+
+    moto_s3_client.put_object(Bucket=S3_BUCKET, Key=S3_KEY, Body=b'{"v4.15": {}}')
+    assert s3_sync_iib_file(action="download", filename=iib_file, boto_s3_client=moto_s3_client)
+    assert json.loads(iib_file.read_text()) == {"v4.15": {}}
+
+
+def test_s3_sync_upload_conflict(moto_s3_client, tmp_path):
+    iib_file = tmp_path / "operators_latest_iib.json"
+    moto_s3_client.put_object(Bucket=S3_BUCKET, Key=S3_KEY, Body=b"{}")
+    assert s3_sync_iib_file(action="download", filename=iib_file, boto_s3_client=moto_s3_client)
+
+    # Another replica updates the file after our download
+    moto_s3_client.put_object(Bucket=S3_BUCKET, Key=S3_KEY, Body=b'{"v4.16": {}}')
+    iib_file.write_text(json.dumps({"v4.15": {}}))
+
+    assert not s3_sync_iib_file(action="upload", filename=iib_file, boto_s3_client=moto_s3_client)
+    s3_content = moto_s3_client.get_object(Bucket=S3_BUCKET, Key=S3_KEY)["Body"].read()
+    assert json.loads(s3_content) == {"v4.16": {}}
+
+
+def test_s3_sync_upload_failure_clears_object_state(mocker, moto_s3_client, tmp_path):
+    iib_file = tmp_path / "operators_latest_iib.json"
+    moto_s3_client.put_object(Bucket=S3_BUCKET, Key=S3_KEY, Body=b"{}")
+    assert s3_sync_iib_file(action="download", filename=iib_file, boto_s3_client=moto_s3_client)
+
+    iib_file.write_text(json.dumps({"v4.15": {}}))
+    mocker.patch.object(moto_s3_client, "put_object", side_effect=EndpointConnectionError(endpoint_url="s3"))
+    assert not s3_sync_iib_file(action="upload", filename=iib_file, boto_s3_client=moto_s3_client)
+    assert S3_BUCKET_FILE_FULL_PATH not in iib_trigger.S3_OBJECTS_STATE
+
+
+@pytest.mark.parametrize(
+    "config, failures, min_seconds, max_seconds",
+    [
+        pytest.param({}, 0, 86400, 86400, id="default_run_interval"),
+        pytest.param({"run_interval": "10m"}, 0, 600, 600, id="run_interval"),
+        pytest.param({"cron_schedule": "*/5 * * * *", "run_interval": "1h"}, 0, 0, 300, id="cron_schedule"),
+        pytest.param({"cron_schedule": "invalid", "run_interval": "1h"}, 0, 3600, 3600, id="invalid_cron_schedule"),
+        pytest.param({"run_interval": "1h"}, 1, 30, 60, id="first_failure"),
+        pytest.param({"run_interval": "1h", "error_retry_interval": "10s"}, 3, 20, 40, id="third_failure"),
+        pytest.param({"run_interval": "1h"}, 20, 1800, 3600, id="failure_backoff_capped"),
+    ],
+)
+def test_get_next_run_seconds(config, failures, min_seconds, max_seconds):
+    assert min_seconds <= get_next_run_seconds(config=config, logger=LOGGER, failures=failures) <= max_seconds
+
+
+def test_wait_for_next_run_run_now():
+    run_now_event = multiprocessing.Event()
+    run_now_event.set()
+    wait_for_next_run(seconds=60, logger=LOGGER, run_now_event=run_now_event)
+    assert not run_now_event.is_set()
+
+
+def test_run_iib_update_backoff_on_failed_cycle(mocker):
+    mocker.patch(
+        f"{IIB_TRIGGER_MODULE_PATH}.fetch_update_iib_and_trigger_jobs",
+        side_effect=[False, False, {}, False],
+    )
+    next_run_seconds_mock = mocker.patch(f"{IIB_TRIGGER_MODULE_PATH}.get_next_run_seconds", return_value=0)
+    drain_trigger_outbox_mock = mocker.patch(f"{IIB_TRIGGER_MODULE_PATH}.drain_trigger_outbox")
+    mocker.patch(f"{IIB_TRIGGER_MODULE_PATH}.record_loop_cycle")
+    # Stops the loop after the fourth cycle
+    mocker.patch(f"{IIB_TRIGGER_MODULE_PATH}.wait_for_next_run", side_effect=[None, None, None, KeyboardInterrupt])
+
+    with pytest.raises(KeyboardInterrupt):
+        run_iib_update(logger=LOGGER, tmp_dir=tempfile.gettempdir())
+
+    assert [_call.kwargs["failures"] for _call in next_run_seconds_mock.call_args_list] == [1, 2, 0, 1]
+    # The outbox is drained on every cycle
+    assert [_call.kwargs["loop_start"] for _call in drain_trigger_outbox_mock.call_args_list] == [
+        True,
+        False,
+        False,
+        False,
+    ]
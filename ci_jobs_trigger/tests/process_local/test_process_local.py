@@ -0,0 +1,18 @@
+from ci_jobs_trigger.utils import process_local
+from ci_jobs_trigger.utils.process_local import ProcessLocal
+
+
+def test_process_local_reused_per_key():
+    objects = ProcessLocal(factory=lambda name: object())
+
+    assert objects.get("gangway") is objects.get("gangway")
+    assert objects.get("gangway") is not objects.get("gitlab")
+
+
+def test_process_local_new_object_after_fork(mocker):
+    objects = ProcessLocal(factory=object)
+    obj = objects.get()
+    mocker.patch.object(process_local.os, "getpid", return_value=-1)
+
+    assert objects.get() is not obj
+    assert objects.get() is objects.get()
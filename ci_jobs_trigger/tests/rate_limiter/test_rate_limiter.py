@@ -0,0 +1,72 @@
+import multiprocessing
+
+import pytest
+
+from ci_jobs_trigger.utils.rate_limiter import (
+    GANGWAY_RATE_LIMIT_OS_ENV_STR,
+    TRIGGER_PRIORITIES_RESERVED_BURST,
+    TRIGGER_PRIORITY_BULK,
+    TRIGGER_PRIORITY_HIGH,
+    TokenBucket,
+    get_gangway_rate_limiter,
+)
+
+
+def take_tokens(state_file, attempts):
+    token_bucket = TokenBucket(name="test", rate=0.001, burst=20, state_file=state_file)
+    return sum(1 for _ in range(attempts) if not token_bucket.take_token(reserved_tokens=0))
+
+
+def test_token_bucket_burst_then_wait(mocker, tmp_path):
+    sleep_mock = mocker.patch("ci_jobs_trigger.utils.rate_limiter.time.sleep")
+    token_bucket = TokenBucket(name="test", rate=0.001, burst=2, state_file=str(tmp_path / "bucket.json"))
+
+    token_bucket.acquire(priority=TRIGGER_PRIORITY_HIGH)
+    token_bucket.acquire(priority=TRIGGER_PRIORITY_HIGH)
+    sleep_mock.assert_not_called()
+
+    assert token_bucket.take_token(reserved_tokens=0) > 0
+
+
+def test_token_bucket_waits_for_refill(tmp_path):
+    token_bucket = TokenBucket(name="test", rate=20, burst=1, state_file=str(tmp_path / "bucket.json"))
+
+    assert token_bucket.acquire() < 0.05
+    assert token_bucket.acquire() >= 0.04
+
+
+@pytest.mark.parametrize("burst", [1, 2, 3])
+@pytest.mark.parametrize("priority", list(TRIGGER_PRIORITIES_RESERVED_BURST))
+def test_token_bucket_small_burst_all_priorities(mocker, tmp_path, burst, priority):
+    sleep_mock = mocker.patch("ci_jobs_trigger.utils.rate_limiter.time.sleep")
+    token_bucket = TokenBucket(name="test", rate=0.001, burst=burst, state_file=str(tmp_path / "bucket.json"))
+
+    token_bucket.acquire(priority=priority)
+
+    sleep_mock.assert_not_called()
+
+
+def test_token_bucket_priority_reserve(tmp_path):
+    token_bucket = TokenBucket(name="test", rate=0.001, burst=4, state_file=str(tmp_path / "bucket.json"))
+    bulk_reserved_tokens = token_bucket.burst * TRIGGER_PRIORITIES_RESERVED_BURST[TRIGGER_PRIORITY_BULK]
+    high_reserved_tokens = token_bucket.burst * TRIGGER_PRIORITIES_RESERVED_BURST[TRIGGER_PRIORITY_HIGH]
+
+    assert not token_bucket.take_token(reserved_tokens=bulk_reserved_tokens)
+    assert not token_bucket.take_token(reserved_tokens=bulk_reserved_tokens)
+    # Bulk triggers wait, the reserved tokens are left to the higher priorities
+    assert token_bucket.take_token(reserved_tokens=bulk_reserved_tokens) > 0
+    assert not token_bucket.take_token(reserved_tokens=high_reserved_tokens)
+
+
+def test_token_bucket_shared_between_processes(tmp_path):
+    state_file = str(tmp_path / "bucket.json")
+    with multiprocessing.Pool(processes=4) as pool:
+        taken_tokens = pool.starmap(take_tokens, [(state_file, 10)] * 4)
+
+    assert sum(taken_tokens) == 20
+
+
+def test_gangway_rate_limiter_disabled(mocker):
+    mocker.patch.dict("os.environ", {GANGWAY_RATE_LIMIT_OS_ENV_STR: "0"})
+
+    assert get_gangway_rate_limiter() is None
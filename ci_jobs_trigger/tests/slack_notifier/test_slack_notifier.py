@@ -0,0 +1,95 @@
+import pytest
+from simple_logger.logger import get_logger
+
+from ci_jobs_trigger.utils import slack
+from ci_jobs_trigger.utils.general import SlackDigest, send_slack_message
+from ci_jobs_trigger.utils.slack import SlackNotifier, coalesce_messages
+
+LOGGER = get_logger("test_slack_notifier")
+
+
+class MockSlackResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.text = ""
+
+
+@pytest.fixture
+def slack_notifier(mocker):
+    mocker.patch.object(slack, "SLACK_COALESCE_WINDOW_SECONDS", 0.1)
+    notifier = SlackNotifier()
+    session_post_mock = mocker.patch.object(notifier.session, "post", return_value=MockSlackResponse(status_code=200))
+    return notifier, session_post_mock
+
+
+def test_send_slack_message_does_not_post(slack_notifier_mock):
+    send_slack_message(message="message", webhook_url="https://slack", logger=LOGGER)
+
+    slack_notifier_mock.return_value.send.assert_called_once_with(
+        message="message", webhook_url="https://slack", logger=LOGGER
+    )
+
+
+def test_slack_notifier_coalesce_messages_per_webhook(slack_notifier):
+    notifier, session_post_mock = slack_notifier
+    for message in ("first", "second"):
+        notifier.send(message=message, webhook_url="https://slack", logger=LOGGER)
+
+    notifier.send(message="error", webhook_url="https://slack-errors", logger=LOGGER)
+
+    assert notifier.flush()
+    assert sorted((_call.args[0], _call.kwargs["json"]["text"]) for _call in session_post_mock.call_args_list) == [
+        ("https://slack", "first\n\nsecond"),
+        ("https://slack-errors", "error"),
+    ]
+
+
+def test_slack_notifier_retry_after_rate_limit(mocker, slack_notifier):
+    notifier, session_post_mock = slack_notifier
+    sleep_mock = mocker.patch.object(slack.time, "sleep")
+    session_post_mock.side_effect = [
+        MockSlackResponse(status_code=429, headers={"Retry-After": "3"}),
+        MockSlackResponse(status_code=200),
+    ]
+
+    assert notifier.post_message(webhook_url="https://slack", message="message", logger=LOGGER)
+    sleep_mock.assert_called_once_with(3)
+    assert session_post_mock.call_count == 2
+
+
+def test_slack_notifier_queue_full(mocker, slack_notifier):
+    notifier, _ = slack_notifier
+    mocker.patch.object(notifier.messages, "put_nowait", side_effect=slack.queue.Full)
+    logger_mock = mocker.Mock()
+
+    notifier.send(message="message", webhook_url="https://slack", logger=logger_mock)
+    logger_mock.error.assert_called_once()
+
+
+def test_coalesce_messages_max_length(mocker):
+    mocker.patch.object(slack, "SLACK_MESSAGE_MAX_LENGTH", 10)
+
+    assert coalesce_messages(messages=["1234", "5678", "abcdefgh"]) == ["1234\n\n5678", "abcdefgh"]
+
+
+def test_slack_digest_one_message_per_webhook(mocker):
+    send_slack_message_mock = mocker.patch("ci_jobs_trigger.utils.general.send_slack_message")
+
+    with SlackDigest(title="cycle", logger=LOGGER) as slack_digest:
+        slack_digest.add(message="first", webhook_url="https://slack")
+        slack_digest.add(message="second", webhook_url="https://slack")
+        slack_digest.add(message="no webhook", webhook_url=None)
+        send_slack_message_mock.assert_not_called()
+
+    send_slack_message_mock.assert_called_once_with(
+        message="*cycle* (2 events)\n• first\n• second", webhook_url="https://slack", logger=LOGGER
+    )
+
+
+def test_slack_digest_disabled_sends_immediately(mocker):
+    send_slack_message_mock = mocker.patch("ci_jobs_trigger.utils.general.send_slack_message")
+
+    with SlackDigest(title="cycle", logger=LOGGER, enabled=False) as slack_digest:
+        slack_digest.add(message="first", webhook_url="https://slack")
+        send_slack_message_mock.assert_called_once_with(message="first", webhook_url="https://slack", logger=LOGGER)
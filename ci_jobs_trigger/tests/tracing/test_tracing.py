@@ -0,0 +1,80 @@
+import contextvars
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+
+from ci_jobs_trigger.utils import tracing
+from ci_jobs_trigger.utils.tracing import OTLP_ENDPOINT_OS_ENV_STR, TRACES_FILE_OS_ENV_STR, get_trace_id, span
+
+
+@pytest.fixture
+def traces_file(mocker, tmp_path):
+    _traces_file = tmp_path / "traces.jsonl"
+    mocker.patch.dict("os.environ", {TRACES_FILE_OS_ENV_STR: str(_traces_file)})
+    return _traces_file
+
+
+def read_spans(traces_file):
+    return {_span["name"]: _span for _span in map(json.loads, traces_file.read_text().splitlines())}
+
+
+def test_span_tree_exported_once_root_ends(traces_file):
+    with span(name="request", log_prefix="[abcdef]"):
+        with span(name="phase", step=1):
+            pass
+
+        assert not traces_file.exists()
+
+    spans = read_spans(traces_file=traces_file)
+    assert spans["request"]["trace_id"] == spans["phase"]["trace_id"] == get_trace_id(log_prefix="[abcdef]")
+    assert spans["request"]["attributes"] == {"log_prefix": "[abcdef]"}
+    assert spans["phase"]["parent_span_id"] == spans["request"]["span_id"]
+    assert spans["phase"]["attributes"] == {"step": 1}
+    assert spans["request"]["parent_span_id"] is None
+
+
+def test_span_error_status(traces_file):
+    with pytest.raises(ValueError):
+        with span(name="request"):
+            raise ValueError("failed phase")
+
+    assert read_spans(traces_file=traces_file)["request"]["status"] == "error"
+
+
+def trigger_in_thread():
+    with span(name="trigger"):
+        pass
+
+
+def test_span_in_thread_with_copied_context(traces_file):
+    with span(name="dispatch"):
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            executor.submit(contextvars.copy_context().run, trigger_in_thread).result()
+
+    spans = read_spans(traces_file=traces_file)
+    assert spans["trigger"]["parent_span_id"] == spans["dispatch"]["span_id"]
+
+
+def test_span_disabled(mocker):
+    mocker.patch.dict("os.environ", {}, clear=True)
+
+    with span(name="request") as _span:
+        assert _span is None
+
+
+def test_span_otlp_export(mocker):
+    mocker.patch.dict("os.environ", {OTLP_ENDPOINT_OS_ENV_STR: "http://collector:4318"}, clear=True)
+    mocker.patch.object(tracing.threading.Thread, "start", lambda thread: thread.run())
+    post_mock = mocker.patch.object(requests.Session, "post")
+
+    with span(name="request", log_prefix="[abcdef]"):
+        with span(name="phase"):
+            pass
+
+    assert post_mock.call_args.args[0] == "http://collector:4318/v1/traces"
+    otlp_spans = post_mock.call_args.kwargs["json"]["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert [otlp_span["name"] for otlp_span in otlp_spans] == ["phase", "request"]
+    assert otlp_spans[0]["parentSpanId"] == otlp_spans[1]["spanId"]
+    assert "parentSpanId" not in otlp_spans[1]
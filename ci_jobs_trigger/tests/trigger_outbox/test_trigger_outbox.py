@@ -0,0 +1,125 @@
+import requests
+from simple_logger.logger import get_logger
+
+from ci_jobs_trigger.libs.openshift_ci.utils import general as openshift_ci_utils
+from ci_jobs_trigger.libs.utils.general import drain_trigger_outbox, trigger_ci_job
+from ci_jobs_trigger.tests.utils import MockRequestPost
+from ci_jobs_trigger.utils import circuit_breaker
+from ci_jobs_trigger.utils.circuit_breaker import get_circuit_breaker
+from ci_jobs_trigger.utils.rate_limiter import TRIGGER_PRIORITY_BULK
+from ci_jobs_trigger.utils.trigger_outbox import (
+    TRIGGER_STATUS_DONE,
+    TRIGGER_STATUS_FAILED,
+    TRIGGER_STATUS_PENDING,
+    TriggerOutbox,
+    claim_trigger,
+    record_triggers,
+)
+
+LOGGER = get_logger("test_trigger_outbox")
+
+
+def get_triggers_status():
+    with TriggerOutbox() as trigger_outbox:
+        return dict(trigger_outbox.connection.execute("SELECT job_name, status FROM triggers ORDER BY id").fetchall())
+
+
+def record_iib_triggers(jobs):
+    return record_triggers(
+        source="iib",
+        batch="iib:quay.io/iib:690654",
+        ci="openshift-ci",
+        priority=TRIGGER_PRIORITY_BULK,
+        jobs={job: {"product": "operator", "_type": "operator"} for job in jobs},
+    )
+
+
+def test_trigger_outbox_record_again_keeps_status():
+    outbox_entries = record_iib_triggers(jobs=["job1", "job2"])
+    with TriggerOutbox() as trigger_outbox:
+        trigger_outbox.set_status(entry_id=outbox_entries["job1"]["id"], status=TRIGGER_STATUS_DONE)
+
+    assert record_iib_triggers(jobs=["job1", "job2"]) == {
+        "job1": {"id": outbox_entries["job1"]["id"], "status": TRIGGER_STATUS_DONE},
+        "job2": {"id": outbox_entries["job2"]["id"], "status": TRIGGER_STATUS_PENDING},
+    }
+
+
+def test_drain_trigger_outbox_sends_pending_triggers(mocker, functions_mocker):
+    outbox_entries = record_iib_triggers(jobs=["job1", "job2", "job3"])
+    with TriggerOutbox() as trigger_outbox:
+        trigger_outbox.set_status(entry_id=outbox_entries["job1"]["id"], status=TRIGGER_STATUS_DONE)
+
+    # Mocked by functions_mocker
+    post_mock = requests.Session.post
+    post_mock.side_effect = [
+        MockRequestPost(),
+        mocker.Mock(ok=False, status_code=400, text="error", headers={"grpc-message": "error"}),
+    ]
+
+    assert drain_trigger_outbox(source="iib", config_data={"trigger_token": "token"}, logger=LOGGER) == 2
+    assert post_mock.call_count == 2
+    assert get_triggers_status() == {
+        "job1": TRIGGER_STATUS_DONE,
+        "job2": TRIGGER_STATUS_DONE,
+        "job3": TRIGGER_STATUS_FAILED,
+    }
+    assert not drain_trigger_outbox(source="iib", config_data={"trigger_token": "token"}, logger=LOGGER)
+
+
+def test_drain_trigger_outbox_skips_claimed_triggers(functions_mocker):
+    outbox_entries = record_iib_triggers(jobs=["job1"])
+    # Being sent by a cycle
+    assert claim_trigger(entry_id=outbox_entries["job1"]["id"])
+
+    assert not drain_trigger_outbox(source="iib", config_data={"trigger_token": "token"}, logger=LOGGER)
+    # Claims left when the loop starts belong to its previous run
+    assert (
+        drain_trigger_outbox(source="iib", config_data={"trigger_token": "token"}, logger=LOGGER, loop_start=True) == 1
+    )
+    assert get_triggers_status() == {"job1": TRIGGER_STATUS_DONE}
+
+
+def test_deferred_trigger_marks_outbox_entry_done(mocker, functions_mocker, open_circuit):
+    outbox_entries = record_iib_triggers(jobs=["job1"])
+    open_circuit(dependency="gangway")
+    mocker.patch.object(circuit_breaker, "CIRCUIT_PROBE_WAIT_SECONDS", 0)
+    mocker.patch.object(get_circuit_breaker(dependency="gangway"), "reset_timeout_seconds", 0.1)
+
+    assert not trigger_ci_job(
+        job="job1",
+        product="operator",
+        _type="operator",
+        ci="openshift-ci",
+        logger=LOGGER,
+        config_data={"trigger_token": "token"},
+        outbox_entry_id=outbox_entries["job1"]["id"],
+    )
+    assert get_triggers_status() == {"job1": TRIGGER_STATUS_PENDING}
+
+    openshift_ci_utils.DEFERRED_TRIGGERS.get().triggers.join()
+    assert get_triggers_status() == {"job1": TRIGGER_STATUS_DONE}
+
+
+def test_deferred_trigger_sent_once_across_cycles(mocker, functions_mocker, open_circuit):
+    open_circuit(dependency="gangway")
+    mocker.patch.object(circuit_breaker, "CIRCUIT_PROBE_WAIT_SECONDS", 0)
+    mocker.patch.object(get_circuit_breaker(dependency="gangway"), "reset_timeout_seconds", 0.1)
+    # Two cycles while gangway is down, the second one does not defer the job again
+    for _ in range(2):
+        outbox_entries = record_iib_triggers(jobs=["job1"])
+        if claim_trigger(entry_id=outbox_entries["job1"]["id"]):
+            trigger_ci_job(
+                job="job1",
+                product="operator",
+                _type="operator",
+                ci="openshift-ci",
+                logger=LOGGER,
+                config_data={"trigger_token": "token"},
+                outbox_entry_id=outbox_entries["job1"]["id"],
+            )
+
+    openshift_ci_utils.DEFERRED_TRIGGERS.get().triggers.join()
+    # Mocked by functions_mocker
+    assert requests.Session.post.call_count == 1
+    assert get_triggers_status() == {"job1": TRIGGER_STATUS_DONE}
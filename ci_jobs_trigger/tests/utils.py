@@ -27,6 +27,8 @@ class MockJenkinsBuild:
 
 
 class MockRequestPost:
+    status_code = 200
+
     @property
     def ok(self):
         return True
@@ -5,10 +5,12 @@ from simple_logger.logger import get_logger
 
 from ci_jobs_trigger.libs.openshift_ci.zstream_trigger.zstream_trigger import (
     OPENSHIFT_CI_ZSTREAM_TRIGGER_CONFIG_OS_ENV_STR,
+    monitor_and_trigger,
     process_and_trigger_jobs,
 )
 from ci_jobs_trigger.tests.zstream_trigger.manifests.ocp_versions import OCP_VERSIONS
 from ci_jobs_trigger.tests.zstream_trigger.manifests.rosa_versions import ROSA_VERSIONS
+from ci_jobs_trigger.utils.circuit_breaker import CircuitOpenError
 
 LOGGER = get_logger("test_zstream_trigger")
 
@@ -140,3 +142,59 @@ def test_process_and_trigger_jobs_pass_version_not_in_config(mocker, config_dict
     )
     with pytest.raises(ValueError):
         process_and_trigger_jobs(logger=LOGGER, version="4.14")
+
+
+def test_process_and_trigger_jobs_deferred_not_processed(
+    mocker, config_dict, job_trigger_and_get_versions_mocker, ocm_client_mocker
+):
+    mocker.patch(f"{LIBS_ZSTREAM_TRIGGER_PATH}.processed_versions_file", return_value={})
+    mocker.patch(TRIGGER_JOBS_PATH, side_effect=CircuitOpenError(dependency="gangway", retry_after_seconds=60))
+    defer_mocker = mocker.patch(f"{LIBS_ZSTREAM_TRIGGER_PATH}.defer_openshift_ci_trigger_job")
+    update_processed_version_mocker = mocker.patch(f"{LIBS_ZSTREAM_TRIGGER_PATH}.update_processed_version")
+
+    assert process_and_trigger_jobs(logger=LOGGER) == {}
+    assert defer_mocker.call_count == 3
+    update_processed_version_mocker.assert_not_called()
+
+
+def test_process_and_trigger_jobs_resends_only_missing_jobs(
+    mocker, get_config_mocker, base_config_dict, job_trigger_and_get_versions_mocker
+):
+    base_config_dict["versions"] = {"4.13": ["job1", "job2", "job3"]}
+    get_config_mocker.return_value = base_config_dict
+    mocker.patch(f"{LIBS_ZSTREAM_TRIGGER_PATH}.processed_versions_file", return_value={})
+    update_processed_version_mocker = mocker.patch(f"{LIBS_ZSTREAM_TRIGGER_PATH}.update_processed_version")
+    # The cycle is interrupted after job1 was triggered
+    trigger_jobs_mocker = mocker.patch(
+        TRIGGER_JOBS_PATH,
+        side_effect=[mocker.Mock(ok=True), RuntimeError("restarted"), mocker.Mock(ok=True), mocker.Mock(ok=True)],
+    )
+
+    with pytest.raises(RuntimeError):
+        process_and_trigger_jobs(logger=LOGGER)
+
+    update_processed_version_mocker.assert_not_called()
+
+    assert process_and_trigger_jobs(logger=LOGGER) == {"4.13": "Triggered"}
+    assert [_call.kwargs["job_name"] for _call in trigger_jobs_mocker.call_args_list] == [
+        "job1",
+        "job2",
+        "job2",
+        "job3",
+    ]
+    update_processed_version_mocker.assert_called_once()
+
+
+def test_monitor_and_trigger_records_failed_cycle(mocker, get_config_mocker, base_config_dict):
+    base_config_dict["run_interval"] = "0s"
+    get_config_mocker.return_value = base_config_dict
+    mocker.patch(f"{LIBS_ZSTREAM_TRIGGER_PATH}.process_and_trigger_jobs", side_effect=RuntimeError("ocm is down"))
+    # Stops the loop after the first cycle
+    record_loop_cycle_mock = mocker.patch(
+        f"{LIBS_ZSTREAM_TRIGGER_PATH}.record_loop_cycle", side_effect=KeyboardInterrupt
+    )
+
+    with pytest.raises(KeyboardInterrupt):
+        monitor_and_trigger(logger=LOGGER)
+
+    assert record_loop_cycle_mock.call_args.kwargs["failed"]
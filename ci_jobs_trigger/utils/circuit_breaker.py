@@ -0,0 +1,158 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from ci_jobs_trigger.utils.metrics import (
+    track_circuit_breaker_state,
+    track_dependency_call,
+    track_dependency_call_rejected,
+)
+from ci_jobs_trigger.utils.process_local import ProcessLocal
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_HALF_OPEN = "half-open"
+CIRCUIT_OPEN = "open"
+
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_TIMEOUT_SECONDS = 60
+# Calls rejected while the half-open probe is in flight are retried after this delay
+CIRCUIT_PROBE_WAIT_SECONDS = 5
+
+# Overrides of the defaults above, per dependency
+CIRCUIT_BREAKERS_CONFIG = {
+    "gangway": {"failure_threshold": 5, "reset_timeout_seconds": 60},
+    "datagrepper": {"failure_threshold": 3, "reset_timeout_seconds": 120},
+    "ocm": {"failure_threshold": 3, "reset_timeout_seconds": 120},
+    "gitlab": {"failure_threshold": 5, "reset_timeout_seconds": 60},
+}
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, dependency, retry_after_seconds):
+        self.dependency = dependency
+        self.retry_after_seconds = retry_after_seconds
+
+    def __str__(self):
+        return f"{self.dependency} is unavailable, calls are rejected for {int(self.retry_after_seconds)} seconds"
+
+
+class CircuitBreaker:
+    # closed: calls go through; open: calls fail fast until the reset timeout ends;
+    # half-open: a single probe call decides whether the circuit closes or opens again
+    def __init__(self, dependency, failure_threshold, reset_timeout_seconds):
+        self.dependency = dependency
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_seconds = reset_timeout_seconds
+        self.state = CIRCUIT_CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self.probe_in_flight = False
+        self.lock = threading.Lock()
+
+    def set_state(self, state):
+        self.state = state
+        track_circuit_breaker_state(dependency=self.dependency, state=state)
+
+    def get_retry_after_seconds(self):
+        # Seconds before a call is let through, 0 when it would be; does not change the state
+        if self.state == CIRCUIT_OPEN:
+            return max(self.reset_timeout_seconds - (time.monotonic() - self.opened_at), 0)
+
+        if self.state == CIRCUIT_HALF_OPEN and self.probe_in_flight:
+            return CIRCUIT_PROBE_WAIT_SECONDS
+
+        return 0
+
+    def check(self):
+        with self.lock:
+            if retry_after_seconds := self.get_retry_after_seconds():
+                raise CircuitOpenError(dependency=self.dependency, retry_after_seconds=retry_after_seconds)
+
+    def before_call(self):
+        with self.lock:
+            if self.state == CIRCUIT_OPEN:
+                if retry_after_seconds := self.get_retry_after_seconds():
+                    raise CircuitOpenError(dependency=self.dependency, retry_after_seconds=retry_after_seconds)
+
+                self.set_state(state=CIRCUIT_HALF_OPEN)
+
+            if self.state == CIRCUIT_HALF_OPEN:
+                if self.probe_in_flight:
+                    raise CircuitOpenError(dependency=self.dependency, retry_after_seconds=CIRCUIT_PROBE_WAIT_SECONDS)
+
+                self.probe_in_flight = True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.probe_in_flight = False
+            if self.state != CIRCUIT_CLOSED:
+                self.set_state(state=CIRCUIT_CLOSED)
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.probe_in_flight = False
+            if self.state == CIRCUIT_HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self.set_state(state=CIRCUIT_OPEN)
+
+
+def create_circuit_breaker(dependency):
+    circuit_breaker_config = {
+        "failure_threshold": CIRCUIT_FAILURE_THRESHOLD,
+        "reset_timeout_seconds": CIRCUIT_RESET_TIMEOUT_SECONDS,
+        **CIRCUIT_BREAKERS_CONFIG.get(dependency, {}),
+    }
+    return CircuitBreaker(dependency=dependency, **circuit_breaker_config)
+
+
+# Breakers are per process; a forked process starts with closed circuits
+CIRCUIT_BREAKERS = ProcessLocal(factory=create_circuit_breaker)
+
+
+def get_circuit_breaker(dependency):
+    return CIRCUIT_BREAKERS.get(dependency)
+
+
+def is_dependency_failure(ex):
+    # Client errors (not found, bad request...) are answers of a healthy dependency
+    status_code = getattr(ex, "response_code", None) or getattr(getattr(ex, "response", None), "status_code", None)
+    return not isinstance(status_code, int) or status_code >= 500 or status_code == 429
+
+
+def check_dependency_available(dependency, operation):
+    # Raises CircuitOpenError as guarded_dependency_call would, without taking the half-open probe;
+    # lets callers skip work done before the call (i.e. waiting for a rate limit token)
+    try:
+        get_circuit_breaker(dependency=dependency).check()
+    except CircuitOpenError:
+        track_dependency_call_rejected(dependency=dependency, operation=operation)
+        raise
+
+
+@contextmanager
+def guarded_dependency_call(dependency, operation):
+    circuit_breaker = get_circuit_breaker(dependency=dependency)
+    try:
+        circuit_breaker.before_call()
+    except CircuitOpenError:
+        track_dependency_call_rejected(dependency=dependency, operation=operation)
+        raise
+
+    dependency_failed = True
+    try:
+        with track_dependency_call(dependency=dependency, operation=operation) as dependency_call:
+            yield dependency_call
+
+        dependency_failed = dependency_call.unavailable
+
+    except Exception as ex:
+        dependency_failed = is_dependency_failure(ex=ex)
+        raise
+
+    finally:
+        if dependency_failed:
+            circuit_breaker.record_failure()
+        else:
+            circuit_breaker.record_success()
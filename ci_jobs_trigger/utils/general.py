@@ -1,10 +1,17 @@
-import json
+import datetime
 import os
+import random
+import threading
 from multiprocessing import Process
 
-import requests
-import gitlab
 from pyaml_env import parse_config
+from pyhelper_utils.general import tts
+
+from ci_jobs_trigger.utils.circuit_breaker import guarded_dependency_call
+from ci_jobs_trigger.utils.slack import get_slack_notifier
+
+GITLAB_CLIENTS = {}
+GITLAB_CLIENTS_LOCK = threading.Lock()
 
 
 class AddonsWebhookTriggerError(Exception):
@@ -35,21 +42,51 @@ def get_config(os_environ, logger):
 def send_slack_message(message, webhook_url, logger):
     try:
         if webhook_url:
-            slack_data = {"text": message}
             logger.info(f"Sending message to slack: {message}")
-            response = requests.post(
-                webhook_url,
-                data=json.dumps(slack_data),
-                headers={"Content-Type": "application/json"},
-            )
-            if response.status_code != 200:
-                logger.error(
-                    f"Request to slack returned an error {response.status_code} with the following message: {response.text}"
-                )
+            # Messages are posted by a background sender, slack latency does not block the caller
+            get_slack_notifier().send(message=message, webhook_url=webhook_url, logger=logger)
     except Exception as ex:
         logger.error(f"Failed to send slack message. error: {ex}")
 
 
+class SlackDigest:
+    # Collects a cycle's slack messages and sends them as one summary per webhook when the cycle ends;
+    # when disabled messages are sent right away
+    def __init__(self, title, logger, enabled=True):
+        self.title = title
+        self.logger = logger
+        self.enabled = enabled
+        self.messages = {}
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.send()
+
+    def add(self, message, webhook_url):
+        if not self.enabled:
+            send_slack_message(message=message, webhook_url=webhook_url, logger=self.logger)
+            return
+
+        if webhook_url:
+            with self.lock:
+                self.messages.setdefault(webhook_url, []).append(message.strip())
+
+    def send(self):
+        with self.lock:
+            messages, self.messages = self.messages, {}
+
+        for webhook_url, webhook_messages in messages.items():
+            summary = "\n".join(f"• {message}" for message in webhook_messages)
+            send_slack_message(
+                message=f"*{self.title}* ({len(webhook_messages)} events)\n{summary}",
+                webhook_url=webhook_url,
+                logger=self.logger,
+            )
+
+
 def run_in_process(targets):
     for target, _kwargs in targets.items():
         proc = Process(target=target, kwargs=_kwargs)
@@ -67,6 +104,74 @@ def process_webhook_exception(logger, ex, route, slack_errors_webhook_url=None):
 
 
 def get_gitlab_api(url, token):
-    gitlab_api = gitlab.Gitlab(url=url, private_token=token, ssl_verify=False)
-    gitlab_api.auth()
+    # gitlab and croniter are imported on use, this module is also imported by the web workers and the loops supervisor
+    import gitlab
+
+    # Clients are cached to reuse their HTTP session; requests are authenticated by the token header,
+    # so there is no need to call auth() before using a client
+    with GITLAB_CLIENTS_LOCK:
+        if not (gitlab_api := GITLAB_CLIENTS.get((url, token))):
+            gitlab_api = GITLAB_CLIENTS[(url, token)] = gitlab.Gitlab(url=url, private_token=token, ssl_verify=False)
+
     return gitlab_api
+
+
+def run_gitlab_api_call(url, token, func):
+    import gitlab
+
+    with guarded_dependency_call(dependency="gitlab", operation=func.__name__.lstrip("_")):
+        try:
+            return func(get_gitlab_api(url=url, token=token))
+
+        except gitlab.exceptions.GitlabAuthenticationError:
+            # The token was rejected; drop the cached client, re-authenticate and retry once
+            with GITLAB_CLIENTS_LOCK:
+                GITLAB_CLIENTS.pop((url, token), None)
+
+            gitlab_api = get_gitlab_api(url=url, token=token)
+            gitlab_api.auth()
+            return func(gitlab_api)
+
+
+def get_cron_iter(cron_schedule, logger, slack_errors_webhook_url=None):
+    from croniter import CroniterBadCronError, croniter
+
+    try:
+        return croniter(cron_schedule, start_time=datetime.datetime.now(), day_or=False)
+    except CroniterBadCronError:
+        err_msg = f"Invalid cron schedule: {cron_schedule}"
+        logger.error(err_msg)
+        send_slack_message(
+            message=err_msg,
+            webhook_url=slack_errors_webhook_url,
+            logger=logger,
+        )
+
+        return None
+
+
+def get_backoff_seconds(failures, base_seconds, max_seconds):
+    # Exponential backoff with jitter, so replicas failing on the same upstream do not retry in lockstep
+    delay = min(max_seconds, base_seconds * 2 ** (failures - 1))
+    return int(random.uniform(delay / 2, delay))
+
+
+def get_next_run_seconds(config, logger, failures=0):
+    run_interval = tts(ts=config.get("run_interval", "24h"))
+
+    if failures:
+        return get_backoff_seconds(
+            failures=failures,
+            base_seconds=tts(ts=config.get("error_retry_interval", "1m")),
+            max_seconds=run_interval,
+        )
+
+    if cron_schedule := config.get("cron_schedule"):
+        if cron := get_cron_iter(
+            cron_schedule=cron_schedule,
+            logger=logger,
+            slack_errors_webhook_url=config.get("slack_errors_webhook_url"),
+        ):
+            return max(int((cron.get_next(datetime.datetime) - datetime.datetime.now()).total_seconds()), 0)
+
+    return run_interval
@@ -0,0 +1,88 @@
+import random
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from ci_jobs_trigger.utils.process_local import ProcessLocal
+
+HTTP_CONNECT_TIMEOUT_SECONDS = 5
+HTTP_READ_TIMEOUT_SECONDS = 30
+HTTP_MAX_RETRIES = 3
+HTTP_BACKOFF_FACTOR = 0.5
+HTTP_POOL_MAX_SIZE = 10
+HTTP_RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Overrides of the defaults above, per dependency
+HTTP_DEPENDENCIES_CONFIG = {
+    # Triggers are POST requests, only retried when the connection could not be established
+    "gangway": {"read_timeout": 60},
+    "gcsweb": {"read_timeout": 60},
+    "datagrepper": {"read_timeout": 120, "verify": False},
+    "jenkins": {"read_timeout": 60, "verify": False},
+    # The slack notifier handles the rate limits itself
+    "slack": {"read_timeout": 10, "retry_status_codes": ()},
+    # Traces are best effort
+    "otlp": {"read_timeout": 5, "max_retries": 0},
+}
+
+
+class JitterRetry(Retry):
+    def get_backoff_time(self):
+        # Full jitter, so processes failing on the same upstream do not retry in lockstep
+        return random.uniform(0, super().get_backoff_time())
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    def __init__(self, timeout, **kwargs):
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        return super().send(request, timeout=timeout or self.timeout, **kwargs)
+
+
+def get_dependency_http_config(dependency):
+    return {
+        "connect_timeout": HTTP_CONNECT_TIMEOUT_SECONDS,
+        "read_timeout": HTTP_READ_TIMEOUT_SECONDS,
+        "max_retries": HTTP_MAX_RETRIES,
+        "retry_status_codes": HTTP_RETRY_STATUS_CODES,
+        "verify": True,
+        **HTTP_DEPENDENCIES_CONFIG.get(dependency, {}),
+    }
+
+
+def mount_http_adapter(session, dependency):
+    http_config = get_dependency_http_config(dependency=dependency)
+    retry = JitterRetry(
+        total=http_config["max_retries"],
+        backoff_factor=HTTP_BACKOFF_FACTOR,
+        status_forcelist=http_config["retry_status_codes"],
+        # Only idempotent methods are retried after the request was sent
+        allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+        # Return the last response, callers check the response status
+        raise_on_status=False,
+    )
+    adapter = TimeoutHTTPAdapter(
+        timeout=(http_config["connect_timeout"], http_config["read_timeout"]),
+        max_retries=retry,
+        pool_maxsize=HTTP_POOL_MAX_SIZE,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+
+def create_http_session(dependency):
+    session = requests.Session()
+    session.verify = get_dependency_http_config(dependency=dependency)["verify"]
+    mount_http_adapter(session=session, dependency=dependency)
+    return session
+
+
+# One session per dependency keeps its connections alive between calls
+HTTP_SESSIONS = ProcessLocal(factory=create_http_session)
+
+
+def get_http_session(dependency):
+    return HTTP_SESSIONS.get(dependency)
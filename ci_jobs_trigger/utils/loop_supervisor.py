@@ -0,0 +1,186 @@
+import importlib
+import json
+import os
+import tempfile
+import threading
+import time
+from multiprocessing import Process
+
+from ci_jobs_trigger.utils.general import get_backoff_seconds
+from ci_jobs_trigger.utils.metrics import mark_metrics_process_dead
+
+LOOPS_STATE_DIR_OS_ENV_STR = "CI_JOBS_TRIGGER_LOOPS_STATE_DIR"
+SUPERVISOR_STATE_FILE_NAME = "supervisor.json"
+SUPERVISOR_CHECK_INTERVAL_SECONDS = 1
+LOOP_RESTART_BASE_SECONDS = 2
+LOOP_RESTART_MAX_SECONDS = 60
+# A loop which stays up this long is considered recovered and its restart backoff is reset
+LOOP_HEALTHY_SECONDS = 10 * 60
+
+
+def get_loops_state_dir():
+    state_dir = os.environ.get(LOOPS_STATE_DIR_OS_ENV_STR) or os.path.join(tempfile.gettempdir(), "ci-jobs-trigger")
+    os.makedirs(state_dir, exist_ok=True)
+    return state_dir
+
+
+def write_state_file(file_name, state):
+    state_file = os.path.join(get_loops_state_dir(), file_name)
+    # Threads of a loop (i.e. the addons hooks workers) may write the same state file
+    tmp_state_file = f"{state_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_state_file, "w") as fd:
+        json.dump(state, fd)
+
+    # Readers never see a partially written file
+    os.replace(tmp_state_file, state_file)
+
+
+def read_state_file(file_name):
+    try:
+        with open(os.path.join(get_loops_state_dir(), file_name)) as fd:
+            return json.load(fd)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def record_loop_cycle(loop_name, cycle_seconds, logger, failed=False, next_run_seconds=None):
+    try:
+        write_state_file(
+            file_name=f"{loop_name}.cycle.json",
+            state={
+                "heartbeat": time.time(),
+                "last_cycle_seconds": round(cycle_seconds, 3),
+                "last_cycle_failed": failed,
+                "next_run_at": time.time() + next_run_seconds if next_run_seconds is not None else None,
+            },
+        )
+    except OSError as ex:
+        # Failing to record the state must not stop the loop
+        logger.warning(f"Failed to record {loop_name} cycle state: {ex}")
+
+
+def get_loops_state():
+    loops_state = read_state_file(file_name=SUPERVISOR_STATE_FILE_NAME)
+    for loop_name, loop_state in loops_state.get("loops", {}).items():
+        loop_state["cycle"] = read_state_file(file_name=f"{loop_name}.cycle.json")
+
+    return loops_state
+
+
+def get_loop_name(target):
+    return target.rsplit(":", 1)[-1] if isinstance(target, str) else target.__name__
+
+
+def run_loop(target, kwargs):
+    # A "module:function" target is imported in the loop process only, the supervisor and the other loops
+    # do not pay for its dependencies
+    if isinstance(target, str):
+        module_name, function_name = target.split(":")
+        target = getattr(importlib.import_module(module_name), function_name)
+
+    target(**kwargs)
+
+
+class LoopSupervisor:
+    def __init__(self, targets, logger):
+        self.logger = logger
+        self.loops = {
+            get_loop_name(target=target): {
+                "target": target,
+                "kwargs": kwargs,
+                "process": None,
+                "started_at": None,
+                "restarts": 0,
+                "failures": 0,
+                "restart_at": 0,
+                "last_exit_code": None,
+                "stopped": False,
+            }
+            for target, kwargs in targets.items()
+        }
+
+    def start_loop(self, loop_name):
+        loop = self.loops[loop_name]
+        loop["process"] = Process(
+            target=run_loop, kwargs={"target": loop["target"], "kwargs": loop["kwargs"]}, name=loop_name
+        )
+        loop["process"].start()
+        loop["started_at"] = time.time()
+        self.logger.info(f"Loop supervisor: started {loop_name} (pid {loop['process'].pid})")
+
+    def check_loops(self):
+        now = time.time()
+        for loop_name, loop in self.loops.items():
+            process = loop["process"]
+            if loop["stopped"]:
+                continue
+
+            if process and process.is_alive():
+                if loop["failures"] and now - loop["started_at"] > LOOP_HEALTHY_SECONDS:
+                    loop["failures"] = 0
+
+                continue
+
+            if process:
+                mark_metrics_process_dead(pid=process.pid)
+                loop["process"] = None
+                loop["last_exit_code"] = process.exitcode
+                if process.exitcode == 0:
+                    # The loops never return unless their config does not let them run (i.e. an invalid cron
+                    # schedule), restarting them would fail the same way
+                    loop["stopped"] = True
+                    self.logger.error(f"Loop supervisor: {loop_name} stopped, not restarting it")
+                    continue
+
+                loop["failures"] += 1
+                restart_seconds = get_backoff_seconds(
+                    failures=loop["failures"],
+                    base_seconds=LOOP_RESTART_BASE_SECONDS,
+                    max_seconds=LOOP_RESTART_MAX_SECONDS,
+                )
+                loop["restart_at"] = now + restart_seconds
+                self.logger.error(
+                    f"Loop supervisor: {loop_name} exited with code {process.exitcode}, "
+                    f"restarting in {restart_seconds} seconds"
+                )
+
+            if now >= loop["restart_at"]:
+                if loop["last_exit_code"] is not None:
+                    loop["restarts"] += 1
+
+                self.start_loop(loop_name=loop_name)
+
+        self.write_state()
+
+    def write_state(self):
+        write_state_file(
+            file_name=SUPERVISOR_STATE_FILE_NAME,
+            state={
+                "pid": os.getpid(),
+                "heartbeat": time.time(),
+                "loops": {
+                    loop_name: {
+                        "alive": bool(loop["process"] and loop["process"].is_alive()),
+                        "pid": loop["process"].pid if loop["process"] else None,
+                        "started_at": loop["started_at"],
+                        "restarts": loop["restarts"],
+                        "last_exit_code": loop["last_exit_code"],
+                        "stopped": loop["stopped"],
+                    }
+                    for loop_name, loop in self.loops.items()
+                },
+            },
+        )
+
+    def run(self):
+        while True:
+            try:
+                self.check_loops()
+            except Exception as ex:
+                self.logger.error(f"Loop supervisor: failed to check loops: {ex}")
+
+            time.sleep(SUPERVISOR_CHECK_INTERVAL_SECONDS)
+
+
+def supervise_loops(targets, logger):
+    LoopSupervisor(targets=targets, logger=logger).run()
@@ -0,0 +1,168 @@
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# Metrics are shared between the web workers and the loops processes when PROMETHEUS_MULTIPROC_DIR is set;
+# all metrics have labels so their files are only created once used, after the directory is prepared
+PROMETHEUS_MULTIPROC_DIR_OS_ENV_STR = "PROMETHEUS_MULTIPROC_DIR"
+METRICS_CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+DEPENDENCY_CALL_SECONDS = Histogram(
+    "ci_jobs_trigger_dependency_call_seconds",
+    "Outbound dependency calls latency",
+    ["dependency", "operation"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+DEPENDENCY_CALL_ERRORS = Counter(
+    "ci_jobs_trigger_dependency_call_errors_total",
+    "Failed outbound dependency calls",
+    ["dependency", "operation"],
+)
+DEPENDENCY_CALLS_IN_FLIGHT = Gauge(
+    "ci_jobs_trigger_dependency_calls_in_flight",
+    "Outbound dependency calls in flight",
+    ["dependency"],
+    multiprocess_mode="livesum",
+)
+ROUTE_REQUEST_SECONDS = Histogram(
+    "ci_jobs_trigger_route_request_seconds",
+    "Webhook routes requests latency",
+    ["route", "status"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300),
+)
+ROUTE_REQUESTS_IN_FLIGHT = Gauge(
+    "ci_jobs_trigger_route_requests_in_flight",
+    "Webhook routes requests in flight",
+    ["route"],
+    multiprocess_mode="livesum",
+)
+CYCLE_SECONDS = Histogram(
+    "ci_jobs_trigger_cycle_seconds",
+    "Background trigger cycles duration",
+    ["cycle"],
+    buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600),
+)
+CYCLE_ERRORS = Counter(
+    "ci_jobs_trigger_cycle_errors_total",
+    "Background trigger cycles which raised an error",
+    ["cycle"],
+)
+RATE_LIMIT_WAIT_SECONDS = Histogram(
+    "ci_jobs_trigger_rate_limit_wait_seconds",
+    "Time waited for a rate limiter token",
+    ["limiter", "priority"],
+    buckets=(0.01, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+CIRCUIT_BREAKER_STATE = Gauge(
+    "ci_jobs_trigger_circuit_breaker_state",
+    "Dependencies circuit breakers state (0 closed, 1 half-open, 2 open)",
+    ["dependency"],
+    # The state of the live processes only, a dead worker must not keep reporting an open circuit
+    multiprocess_mode="livemax",
+)
+CIRCUIT_BREAKER_STATES = {"closed": 0, "half-open": 1, "open": 2}
+DEPENDENCY_CALLS_REJECTED = Counter(
+    "ci_jobs_trigger_dependency_calls_rejected_total",
+    "Outbound dependency calls rejected by an open circuit breaker",
+    ["dependency", "operation"],
+)
+
+
+class DependencyCall:
+    def __init__(self):
+        # Set by the caller when the call returned an error response without raising
+        self.failed = False
+        # Set by the caller when the error response is a server error, counted by the circuit breakers
+        self.unavailable = False
+
+
+@contextmanager
+def track_dependency_call(dependency, operation):
+    dependency_call = DependencyCall()
+    in_flight = DEPENDENCY_CALLS_IN_FLIGHT.labels(dependency=dependency)
+    in_flight.inc()
+    start_time = time.perf_counter()
+    try:
+        yield dependency_call
+
+    except Exception:
+        dependency_call.failed = True
+        raise
+
+    finally:
+        in_flight.dec()
+        DEPENDENCY_CALL_SECONDS.labels(dependency=dependency, operation=operation).observe(
+            time.perf_counter() - start_time
+        )
+        if dependency_call.failed:
+            DEPENDENCY_CALL_ERRORS.labels(dependency=dependency, operation=operation).inc()
+
+
+@contextmanager
+def track_cycle(cycle):
+    start_time = time.perf_counter()
+    try:
+        yield
+
+    except Exception:
+        CYCLE_ERRORS.labels(cycle=cycle).inc()
+        raise
+
+    finally:
+        CYCLE_SECONDS.labels(cycle=cycle).observe(time.perf_counter() - start_time)
+
+
+def track_circuit_breaker_state(dependency, state):
+    CIRCUIT_BREAKER_STATE.labels(dependency=dependency).set(CIRCUIT_BREAKER_STATES[state])
+
+
+def track_dependency_call_rejected(dependency, operation):
+    DEPENDENCY_CALLS_REJECTED.labels(dependency=dependency, operation=operation).inc()
+
+
+def track_rate_limit_wait(limiter, priority, seconds):
+    RATE_LIMIT_WAIT_SECONDS.labels(limiter=limiter, priority=priority).observe(seconds)
+
+
+def track_route_request_started(route):
+    ROUTE_REQUESTS_IN_FLIGHT.labels(route=route).inc()
+    return time.perf_counter()
+
+
+def track_route_request_finished(route, status, start_time):
+    ROUTE_REQUESTS_IN_FLIGHT.labels(route=route).dec()
+    ROUTE_REQUEST_SECONDS.labels(route=route, status=status).observe(time.perf_counter() - start_time)
+
+
+def prepare_metrics_multiprocess_dir():
+    if metrics_dir := os.environ.get(PROMETHEUS_MULTIPROC_DIR_OS_ENV_STR):
+        os.makedirs(metrics_dir, exist_ok=True)
+        # Values left by a previous run would be added to the new run values
+        for file_name in os.listdir(metrics_dir):
+            if file_name.endswith(".db"):
+                os.remove(os.path.join(metrics_dir, file_name))
+
+
+def mark_metrics_process_dead(pid):
+    if os.environ.get(PROMETHEUS_MULTIPROC_DIR_OS_ENV_STR):
+        multiprocess.mark_process_dead(pid)
+
+
+def get_metrics():
+    if os.environ.get(PROMETHEUS_MULTIPROC_DIR_OS_ENV_STR):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+
+    return generate_latest(REGISTRY)
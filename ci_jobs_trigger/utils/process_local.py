@@ -0,0 +1,20 @@
+import os
+import threading
+
+
+class ProcessLocal:
+    # Lazily creates one object per key and process; a forked process inherits neither the threads nor
+    # the sockets of its parent, so it replaces the objects it inherited with its own
+    def __init__(self, factory):
+        self.factory = factory
+        self.objects = {}
+        self.lock = threading.Lock()
+
+    def get(self, *key):
+        with self.lock:
+            obj, pid = self.objects.get(key, (None, None))
+            if obj is None or pid != os.getpid():
+                obj = self.factory(*key)
+                self.objects[key] = (obj, os.getpid())
+
+        return obj
@@ -0,0 +1,88 @@
+import fcntl
+import json
+import os
+import tempfile
+import time
+
+from ci_jobs_trigger.utils.metrics import track_rate_limit_wait
+
+GANGWAY_RATE_LIMIT_OS_ENV_STR = "CI_JOBS_TRIGGER_GANGWAY_TRIGGERS_PER_SECOND"
+GANGWAY_BURST_OS_ENV_STR = "CI_JOBS_TRIGGER_GANGWAY_TRIGGERS_BURST"
+GANGWAY_RATE_LIMIT_STATE_FILE_OS_ENV_STR = "CI_JOBS_TRIGGER_GANGWAY_RATE_LIMIT_STATE_FILE"
+GANGWAY_DEFAULT_TRIGGERS_PER_SECOND = 2
+GANGWAY_DEFAULT_TRIGGERS_BURST = 20
+RATE_LIMIT_MAX_SLEEP_SECONDS = 5
+
+TRIGGER_PRIORITY_HIGH = "high"
+TRIGGER_PRIORITY_NORMAL = "normal"
+TRIGGER_PRIORITY_BULK = "bulk"
+# Part of the burst a priority class cannot use, it is left to the classes above it;
+# bulk triggers wait while re-triggers and webhooks still find tokens
+TRIGGER_PRIORITIES_RESERVED_BURST = {
+    TRIGGER_PRIORITY_HIGH: 0,
+    TRIGGER_PRIORITY_NORMAL: 0.25,
+    TRIGGER_PRIORITY_BULK: 0.5,
+}
+
+
+class TokenBucket:
+    # The bucket state is kept in a file locked with flock, so the web workers and the loops processes share one bucket
+    def __init__(self, name, rate, burst, state_file):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.state_file = state_file
+
+    def take_token(self, reserved_tokens):
+        # Returns 0 when a token was taken, otherwise the seconds to wait for one
+        with open(self.state_file, "a+") as fd:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                fd.seek(0)
+                try:
+                    state = json.loads(fd.read())
+                except json.JSONDecodeError:
+                    state = {"tokens": self.burst, "updated_at": time.time()}
+
+                now = time.time()
+                tokens = min(self.burst, state["tokens"] + max(now - state["updated_at"], 0) * self.rate)
+                wait_seconds = 0
+                if tokens - 1 >= reserved_tokens:
+                    tokens -= 1
+                else:
+                    wait_seconds = (reserved_tokens + 1 - tokens) / self.rate
+
+                fd.seek(0)
+                fd.truncate()
+                fd.write(json.dumps({"tokens": tokens, "updated_at": now}))
+                fd.flush()
+                return wait_seconds
+
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def acquire(self, priority=TRIGGER_PRIORITY_NORMAL):
+        # At least one token is always usable, a small burst must not block the lower priorities forever
+        reserved_tokens = min(self.burst * TRIGGER_PRIORITIES_RESERVED_BURST[priority], self.burst - 1)
+        start_time = time.monotonic()
+        # Callers wait for a token, a trigger is delayed but never dropped
+        while wait_seconds := self.take_token(reserved_tokens=reserved_tokens):
+            time.sleep(min(wait_seconds, RATE_LIMIT_MAX_SLEEP_SECONDS))
+
+        waited_seconds = time.monotonic() - start_time
+        track_rate_limit_wait(limiter=self.name, priority=priority, seconds=waited_seconds)
+        return waited_seconds
+
+
+def get_gangway_rate_limiter():
+    # 0 triggers per second disables the limiter
+    if not (rate := float(os.environ.get(GANGWAY_RATE_LIMIT_OS_ENV_STR, GANGWAY_DEFAULT_TRIGGERS_PER_SECOND))):
+        return None
+
+    return TokenBucket(
+        name="gangway",
+        rate=rate,
+        burst=max(int(os.environ.get(GANGWAY_BURST_OS_ENV_STR, GANGWAY_DEFAULT_TRIGGERS_BURST)), 1),
+        state_file=os.environ.get(GANGWAY_RATE_LIMIT_STATE_FILE_OS_ENV_STR)
+        or os.path.join(tempfile.gettempdir(), "ci-jobs-trigger-gangway-rate-limit.json"),
+    )
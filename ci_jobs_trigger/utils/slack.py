@@ -0,0 +1,116 @@
+import atexit
+import queue
+import threading
+import time
+
+import requests
+
+from ci_jobs_trigger.utils.http_client import get_http_session
+from ci_jobs_trigger.utils.metrics import track_dependency_call
+from ci_jobs_trigger.utils.process_local import ProcessLocal
+
+SLACK_QUEUE_MAX_SIZE = 1000
+SLACK_COALESCE_WINDOW_SECONDS = 2
+SLACK_MAX_RETRIES = 3
+SLACK_MAX_RETRY_AFTER_SECONDS = 60
+SLACK_FLUSH_TIMEOUT_SECONDS = 5
+# Slack truncates messages longer than 40,000 characters
+SLACK_MESSAGE_MAX_LENGTH = 39000
+
+
+class SlackNotifier:
+    def __init__(self):
+        self.messages = queue.Queue(maxsize=SLACK_QUEUE_MAX_SIZE)
+        self.session = get_http_session(dependency="slack")
+        self.sender = threading.Thread(target=self.run, name="slack-notifier", daemon=True)
+        self.sender.start()
+
+    def send(self, message, webhook_url, logger):
+        try:
+            self.messages.put_nowait((webhook_url, message, logger))
+        except queue.Full:
+            logger.error(f"Slack messages queue is full, dropping message: {message}")
+
+    def run(self):
+        while True:
+            pending_messages = [self.messages.get()]
+            # Messages sent to the same webhook within the window are posted as a single Slack message
+            deadline = time.monotonic() + SLACK_COALESCE_WINDOW_SECONDS
+            while (remaining_seconds := deadline - time.monotonic()) > 0:
+                try:
+                    pending_messages.append(self.messages.get(timeout=remaining_seconds))
+                except queue.Empty:
+                    break
+
+            try:
+                self.send_pending_messages(pending_messages=pending_messages)
+            except Exception as ex:
+                # Never let a failure stop the sender thread
+                pending_messages[0][2].error(f"Failed to send slack messages. error: {ex}")
+            finally:
+                for _ in pending_messages:
+                    self.messages.task_done()
+
+    def send_pending_messages(self, pending_messages):
+        messages_by_webhook = {}
+        for webhook_url, message, logger in pending_messages:
+            messages_by_webhook.setdefault(webhook_url, {"logger": logger, "messages": []})["messages"].append(message)
+
+        for webhook_url, webhook_messages in messages_by_webhook.items():
+            for message in coalesce_messages(messages=webhook_messages["messages"]):
+                self.post_message(webhook_url=webhook_url, message=message, logger=webhook_messages["logger"])
+
+    def post_message(self, webhook_url, message, logger):
+        for attempt in range(SLACK_MAX_RETRIES + 1):
+            try:
+                with track_dependency_call(dependency="slack", operation="post_message") as dependency_call:
+                    response = self.session.post(webhook_url, json={"text": message})
+                    dependency_call.failed = response.status_code != 200
+            except requests.RequestException as ex:
+                logger.error(f"Failed to send slack message. error: {ex}")
+                return False
+
+            if response.status_code == 429 and attempt < SLACK_MAX_RETRIES:
+                retry_after = response.headers.get("Retry-After", "1")
+                retry_after = min(int(retry_after) if retry_after.isdigit() else 1, SLACK_MAX_RETRY_AFTER_SECONDS)
+                logger.warning(f"Slack rate limited the webhook, retrying in {retry_after} seconds")
+                time.sleep(retry_after)
+                continue
+
+            if response.status_code != 200:
+                logger.error(
+                    f"Request to slack returned an error {response.status_code} with the following message: {response.text}"
+                )
+                return False
+
+            return True
+
+        return False
+
+    def flush(self, timeout=SLACK_FLUSH_TIMEOUT_SECONDS):
+        with self.messages.all_tasks_done:
+            return self.messages.all_tasks_done.wait_for(lambda: not self.messages.unfinished_tasks, timeout=timeout)
+
+
+def coalesce_messages(messages):
+    coalesced_messages = []
+    for message in messages:
+        if coalesced_messages and len(coalesced_messages[-1]) + len(message) + 2 <= SLACK_MESSAGE_MAX_LENGTH:
+            coalesced_messages[-1] = f"{coalesced_messages[-1]}\n\n{message}"
+        else:
+            coalesced_messages.append(message)
+
+    return coalesced_messages
+
+
+def create_slack_notifier():
+    slack_notifier = SlackNotifier()
+    atexit.register(slack_notifier.flush)
+    return slack_notifier
+
+
+SLACK_NOTIFIER = ProcessLocal(factory=create_slack_notifier)
+
+
+def get_slack_notifier():
+    return SLACK_NOTIFIER.get()
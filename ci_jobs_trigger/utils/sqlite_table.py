@@ -0,0 +1,50 @@
+import sqlite3
+import time
+from contextlib import contextmanager
+
+
+class SQLiteTable:
+    # A table shared by several processes; subclasses set table_name, table_columns and final_statuses
+    table_name = None
+    table_columns = None
+    final_statuses = ()
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.connection = None
+
+    def __enter__(self):
+        # Autocommit mode; transactions which must be atomic across processes are opened with write_transaction
+        self.connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(f"CREATE TABLE if not exists {self.table_name}({', '.join(self.table_columns)})")
+
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.connection.close()
+
+    @contextmanager
+    def write_transaction(self):
+        # BEGIN IMMEDIATE takes the write lock, rows read in the transaction are not changed by another process
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.connection
+            self.connection.execute("COMMIT")
+        except Exception:
+            self.connection.execute("ROLLBACK")
+            raise
+
+    def update_status(self, row_id, status, error=None):
+        self.connection.execute(
+            f"UPDATE {self.table_name} SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+            (status, error, time.time(), row_id),
+        )
+
+    def prune(self, retention_seconds):
+        # Rows in a final status are kept for retention_seconds after their last update
+        return self.connection.execute(
+            f"DELETE FROM {self.table_name} WHERE status IN ({', '.join('?' * len(self.final_statuses))}) "
+            "AND updated_at < ?",
+            (*self.final_statuses, time.time() - retention_seconds),
+        ).rowcount
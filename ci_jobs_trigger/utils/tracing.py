@@ -0,0 +1,150 @@
+import contextvars
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import requests
+
+from ci_jobs_trigger.utils.http_client import get_http_session
+
+TRACES_FILE_OS_ENV_STR = "CI_JOBS_TRIGGER_TRACES_FILE"
+OTLP_ENDPOINT_OS_ENV_STR = "CI_JOBS_TRIGGER_OTLP_ENDPOINT"
+OTLP_STATUS_CODES = {"ok": 1, "error": 2}
+
+CURRENT_SPAN = contextvars.ContextVar("ci_jobs_trigger_current_span", default=None)
+TRACES_FILE_LOCK = threading.Lock()
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_span_id", "name", "attributes", "start_time_ns", "end_time_ns", "status")
+
+    def __init__(self, trace, name, parent_span_id, attributes):
+        self.trace = trace
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_span_id = parent_span_id
+        self.name = name
+        self.attributes = attributes
+        self.start_time_ns = time.time_ns()
+        self.end_time_ns = None
+        self.status = "ok"
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace["trace_id"],
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_span_id,
+            "name": self.name,
+            "start_time_ns": self.start_time_ns,
+            "end_time_ns": self.end_time_ns,
+            "duration_ms": round((self.end_time_ns - self.start_time_ns) / 1e6, 3),
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+def get_trace_id(log_prefix=None):
+    # Ties the trace to the log lines of the flow; a 32 hex chars id is required by OTLP collectors
+    if log_prefix:
+        return hashlib.md5(log_prefix.encode(), usedforsecurity=False).hexdigest()
+
+    return uuid.uuid4().hex
+
+
+def tracing_enabled():
+    return bool(os.environ.get(TRACES_FILE_OS_ENV_STR) or os.environ.get(OTLP_ENDPOINT_OS_ENV_STR))
+
+
+@contextmanager
+def span(name, log_prefix=None, **attributes):
+    if not tracing_enabled():
+        yield None
+        return
+
+    parent_span = CURRENT_SPAN.get()
+    if parent_span:
+        trace = parent_span.trace
+    else:
+        trace = {"trace_id": get_trace_id(log_prefix=log_prefix), "spans": [], "lock": threading.Lock()}
+        if log_prefix:
+            attributes["log_prefix"] = log_prefix
+
+    _span = Span(
+        trace=trace, name=name, parent_span_id=parent_span.span_id if parent_span else None, attributes=attributes
+    )
+    token = CURRENT_SPAN.set(_span)
+    try:
+        yield _span
+
+    except Exception as ex:
+        _span.status = "error"
+        _span.set_attribute("error", str(ex))
+        raise
+
+    finally:
+        _span.end_time_ns = time.time_ns()
+        CURRENT_SPAN.reset(token)
+        with trace["lock"]:
+            trace["spans"].append(_span)
+
+        # The whole span tree is exported once the root span ends
+        if not parent_span:
+            export_trace(spans=trace["spans"])
+
+
+def export_trace(spans):
+    if traces_file := os.environ.get(TRACES_FILE_OS_ENV_STR):
+        with TRACES_FILE_LOCK, open(traces_file, "a") as fd:
+            for _span in spans:
+                fd.write(f"{json.dumps(_span.to_dict())}\n")
+
+    if otlp_endpoint := os.environ.get(OTLP_ENDPOINT_OS_ENV_STR):
+        # Posted from a background thread so a slow collector does not delay the traced flow
+        threading.Thread(
+            target=post_otlp_trace, kwargs={"otlp_endpoint": otlp_endpoint, "spans": spans}, daemon=True
+        ).start()
+
+
+def get_otlp_attributes(attributes):
+    return [{"key": key, "value": {"stringValue": str(value)}} for key, value in attributes.items()]
+
+
+def post_otlp_trace(otlp_endpoint, spans):
+    otlp_spans = []
+    for _span in spans:
+        otlp_span = {
+            "traceId": _span.trace["trace_id"],
+            "spanId": _span.span_id,
+            "name": _span.name,
+            "kind": 1,
+            "startTimeUnixNano": str(_span.start_time_ns),
+            "endTimeUnixNano": str(_span.end_time_ns),
+            "attributes": get_otlp_attributes(attributes=_span.attributes),
+            "status": {"code": OTLP_STATUS_CODES[_span.status]},
+        }
+        if _span.parent_span_id:
+            otlp_span["parentSpanId"] = _span.parent_span_id
+
+        otlp_spans.append(otlp_span)
+
+    try:
+        get_http_session(dependency="otlp").post(
+            f"{otlp_endpoint.rstrip('/')}/v1/traces",
+            json={
+                "resourceSpans": [
+                    {
+                        "resource": {"attributes": get_otlp_attributes(attributes={"service.name": "ci-jobs-trigger"})},
+                        "scopeSpans": [{"scope": {"name": "ci_jobs_trigger"}, "spans": otlp_spans}],
+                    }
+                ]
+            },
+        )
+    except requests.RequestException:
+        # Traces are best effort
+        pass
@@ -0,0 +1,162 @@
+import json
+import os
+import tempfile
+import time
+
+from ci_jobs_trigger.utils.sqlite_table import SQLiteTable
+
+TRIGGER_OUTBOX_DB_PATH_OS_ENV_STR = "CI_JOBS_TRIGGER_OUTBOX_DB_PATH"
+TRIGGER_OUTBOX_RETENTION_SECONDS = 7 * 24 * 60 * 60
+# A pending entry is owned by the process sending (or deferring) it until its claim expires,
+# an expired claim means the process died before the trigger was sent
+TRIGGER_OUTBOX_CLAIM_SECONDS = 10 * 60
+
+TRIGGER_STATUS_PENDING = "pending"
+TRIGGER_STATUS_DONE = "done"
+TRIGGER_STATUS_FAILED = "failed"
+
+
+class TriggerOutbox(SQLiteTable):
+    # Triggers are recorded before they are sent and marked done or failed after;
+    # entries still pending were interrupted by a restart (or deferred) and are sent again
+    table_name = "triggers"
+    table_columns = (
+        "id INTEGER PRIMARY KEY AUTOINCREMENT",
+        "source TEXT NOT NULL",
+        "batch TEXT NOT NULL",
+        "job_name TEXT NOT NULL",
+        "ci TEXT NOT NULL",
+        "priority TEXT NOT NULL",
+        "payload TEXT NOT NULL",
+        "status TEXT NOT NULL",
+        "error TEXT",
+        "claimed_until REAL NOT NULL DEFAULT 0",
+        "created_at REAL NOT NULL",
+        "updated_at REAL NOT NULL",
+        "UNIQUE(source, batch, job_name, ci)",
+    )
+    final_statuses = (TRIGGER_STATUS_DONE, TRIGGER_STATUS_FAILED)
+
+    def __init__(self, db_path=None):
+        super().__init__(
+            db_path=db_path
+            or os.environ.get(TRIGGER_OUTBOX_DB_PATH_OS_ENV_STR)
+            or os.path.join(tempfile.gettempdir(), "ci-jobs-trigger-outbox.db")
+        )
+
+    def record(self, source, batch, ci, priority, jobs):
+        # jobs: job name -> trigger_ci_job arguments needed to send the trigger again.
+        # A batch recorded again (i.e. a version or a hook processed again) keeps its entries and their status
+        now = time.time()
+        with self.write_transaction() as connection:
+            connection.executemany(
+                f"INSERT OR IGNORE INTO {self.table_name} "
+                "(source, batch, job_name, ci, priority, payload, status, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (source, batch, job_name, ci, priority, json.dumps(payload), TRIGGER_STATUS_PENDING, now, now)
+                    for job_name, payload in jobs.items()
+                ],
+            )
+            rows = connection.execute(
+                f"SELECT id, job_name, status FROM {self.table_name} WHERE source = ? AND batch = ? AND ci = ?",
+                (source, batch, ci),
+            ).fetchall()
+
+        return {job_name: {"id": entry_id, "status": status} for entry_id, job_name, status in rows if job_name in jobs}
+
+    def claim(self, entry_id):
+        # An entry not done is sent by the single caller which claims it; it stays claimed while it is being
+        # sent or deferred, a failed entry is pending again once claimed
+        now = time.time()
+        return (
+            self.connection.execute(
+                f"UPDATE {self.table_name} SET status = ?, claimed_until = ?, updated_at = ? "
+                "WHERE id = ? AND status != ? AND claimed_until <= ?",
+                (TRIGGER_STATUS_PENDING, now + TRIGGER_OUTBOX_CLAIM_SECONDS, now, entry_id, TRIGGER_STATUS_DONE, now),
+            ).rowcount
+            == 1
+        )
+
+    def set_status(self, entry_id, status, error=None):
+        self.update_status(row_id=entry_id, status=status, error=error)
+
+    def get_status(self, entry_id):
+        row = self.connection.execute(f"SELECT status FROM {self.table_name} WHERE id = ?", (entry_id,)).fetchone()
+        return row[0] if row else None
+
+    def set_claimed_until(self, entry_id, claimed_until):
+        self.connection.execute(
+            f"UPDATE {self.table_name} SET claimed_until = ? WHERE id = ?", (claimed_until, entry_id)
+        )
+
+    def release_claims(self, source):
+        return self.connection.execute(
+            f"UPDATE {self.table_name} SET claimed_until = 0 WHERE source = ? AND status = ? AND claimed_until > 0",
+            (source, TRIGGER_STATUS_PENDING),
+        ).rowcount
+
+    def claim_pending(self, source):
+        # Pending entries no sender owns any more (its process stopped before sending them) are claimed for the caller
+        now = time.time()
+        with self.write_transaction() as connection:
+            rows = connection.execute(
+                f"SELECT id, job_name, ci, priority, payload FROM {self.table_name} "
+                "WHERE source = ? AND status = ? AND claimed_until <= ? ORDER BY id",
+                (source, TRIGGER_STATUS_PENDING, now),
+            ).fetchall()
+            connection.executemany(
+                f"UPDATE {self.table_name} SET claimed_until = ? WHERE id = ?",
+                [(now + TRIGGER_OUTBOX_CLAIM_SECONDS, row[0]) for row in rows],
+            )
+
+        return [
+            {"id": entry_id, "job_name": job_name, "ci": ci, "priority": priority, "payload": json.loads(payload)}
+            for entry_id, job_name, ci, priority, payload in rows
+        ]
+
+
+def record_triggers(source, batch, ci, priority, jobs):
+    with TriggerOutbox() as trigger_outbox:
+        return trigger_outbox.record(source=source, batch=batch, ci=ci, priority=priority, jobs=jobs)
+
+
+def set_trigger_status(entry_id, status, error=None):
+    # Entries are optional, callers pass the entry id they got from record_triggers, if any
+    if entry_id is None:
+        return
+
+    with TriggerOutbox() as trigger_outbox:
+        trigger_outbox.set_status(entry_id=entry_id, status=status, error=error)
+
+
+def claim_trigger(entry_id):
+    # Without an entry there is nothing to share the trigger with
+    if entry_id is None:
+        return True
+
+    with TriggerOutbox() as trigger_outbox:
+        return trigger_outbox.claim(entry_id=entry_id)
+
+
+def get_trigger_status(entry_id):
+    with TriggerOutbox() as trigger_outbox:
+        return trigger_outbox.get_status(entry_id=entry_id)
+
+
+def extend_trigger_claim(entry_id, seconds):
+    # A deferred trigger stays claimed until it is sent, its entry is not sent by another cycle meanwhile
+    if entry_id is None:
+        return
+
+    with TriggerOutbox() as trigger_outbox:
+        trigger_outbox.set_claimed_until(entry_id=entry_id, claimed_until=time.time() + seconds)
+
+
+def release_trigger_claim(entry_id):
+    # A trigger which raised stays pending and is sent again by the next cycle
+    if entry_id is None:
+        return
+
+    with TriggerOutbox() as trigger_outbox:
+        trigger_outbox.set_claimed_until(entry_id=entry_id, claimed_until=0)